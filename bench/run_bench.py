@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	Benchmarks of the overhead added by hardsub itself: media tools are replaced
+	by the stubs of stub_tool.py, so only the Python side is measured and the
+	suite runs offline. Results are written as JSON, to be compared between commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from hardsub import hardsub, matroska, mediainfo, streaming, utils
+
+# Tools replaced by stubs
+STUB_TOOLS = ('mencoder', 'mplayer', 'mkvinfo', 'mkvmerge', 'mkvextract', 'mp4info', 'MP4Box', 'ffprobe', 'ffmpeg')
+
+# Smallest headers recognized by libmagic, by container
+MAGIC_HEADERS = {
+	'matroska': b'\x1a\x45\xdf\xa3\xa3\x42\x86\x81\x01\x42\xf7\x81\x01\x42\xf2\x81\x04\x42\xf3\x81\x08\x42\x82\x88matroska\x42\x87\x81\x04\x42\x85\x81\x02',
+	'avi': b'RIFF\x00\x00\x00\x00AVI LIST',
+	'mp4': b'\x00\x00\x00\x18ftypisom\x00\x00\x00\x01isomavc1'
+}
+
+EXTENSIONS = {'matroska': '.mkv', 'avi': '.avi', 'mp4': '.mp4'}
+
+def install_stubs(work_dir):
+	"""
+		Put the stubs on PATH, in front of any real tool
+	"""
+	bin_dir = os.path.join(work_dir, 'bin')
+	os.mkdir(bin_dir)
+	for tool in STUB_TOOLS:
+		os.symlink(os.path.join(BENCH_DIR, 'stub_tool.py'), os.path.join(bin_dir, tool))
+	os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+def configure_stubs(lines=200, rate=0, size=4096):
+	os.environ['HS_STUB_LINES'] = str(lines)
+	os.environ['HS_STUB_RATE'] = str(rate)
+	os.environ['HS_STUB_SIZE'] = str(size)
+
+class Measure(object):
+	"""
+		Wall time and CPU time of this process and of its children while the block runs
+	"""
+
+	def __enter__(self):
+		self.start = time.time()
+		self.own = resource.getrusage(resource.RUSAGE_SELF)
+		self.children = resource.getrusage(resource.RUSAGE_CHILDREN)
+		return self
+
+	def __exit__(self, *exc_info):
+		own = resource.getrusage(resource.RUSAGE_SELF)
+		children = resource.getrusage(resource.RUSAGE_CHILDREN)
+		self.wall = time.time() - self.start
+		self.cpu = (own.ru_utime - self.own.ru_utime) + (own.ru_stime - self.own.ru_stime)
+		self.children_cpu = (children.ru_utime - self.children.ru_utime) + (children.ru_stime - self.children.ru_stime)
+
+	def result(self, **extra):
+		result = {'wall': self.wall, 'cpu': self.cpu, 'children_cpu': self.children_cpu}
+		result.update(extra)
+		return result
+
+def make_source_dir(directory, files, video_ratio=0.1, kinds=('matroska',)):
+	"""
+		Fill a directory with fake videos with a .srt companion and unrelated files
+		:returns: int -- Number of videos
+	"""
+	os.makedirs(directory)
+	videos = 0
+	for i in range(files):
+		if i % int(1 / video_ratio) == 0:
+			kind = kinds[videos % len(kinds)]
+			base = os.path.join(directory, 'movie{:06d}'.format(i))
+			with open(base + EXTENSIONS[kind], 'wb') as f:
+				f.write(MAGIC_HEADERS[kind] + b'\0' * 1024)
+			with open(base + '.srt', 'w') as f:
+				f.write('1\n00:00:01,000 --> 00:00:02,000\nHello\n\n')
+			videos = videos + 1
+		else:
+			with open(os.path.join(directory, 'note{:06d}.nfo'.format(i)), 'w') as f:
+				f.write('not a video\n')
+	return videos
+
+def bench_scan(work_dir, files):
+	"""
+		find_candidates on a big directory, with a cold and a warm probe cache
+	"""
+	source_dir = os.path.join(work_dir, 'scan')
+	videos = make_source_dir(source_dir, files)
+	configure_stubs()
+	cache_file = os.path.join(work_dir, 'probe-cache.json')
+	results = {'files': files, 'videos': videos}
+	for name in ('cold', 'warm'):
+		with Measure() as m:
+			found = hardsub.find_candidates(source_dir, mediainfo.ProbeCache(cache_file))
+		results[name] = m.result(found=len(found), per_file=m.wall / files)
+	return results
+
+def bench_probe(work_dir, files):
+	"""
+		Probe of each container, without cache
+	"""
+	source_dir = os.path.join(work_dir, 'probe')
+	make_source_dir(source_dir, files * 3, 1.0, ('matroska', 'avi', 'mp4'))
+	configure_stubs()
+	results = {}
+	for kind in ('matroska', 'avi', 'mp4'):
+		names = sorted([os.path.join(source_dir, f) for f in os.listdir(source_dir) if f.endswith(EXTENSIONS[kind])])
+		with Measure() as m:
+			probed = [mediainfo.probe(f) for f in names]
+		results[kind] = m.result(files=len(names), per_file=m.wall / len(names), detected=len([p for p in probed if p.kind == kind]))
+	return results
+
+def bench_progress(work_dir, lines, rates):
+	"""
+		Progress parsing of launch_process_with_progress_bar at several line rates
+	"""
+	utils.set_progress_output(open(os.devnull, 'w'))
+	output_file = os.path.join(work_dir, 'progress.out')
+	results = {}
+	for tool, parser, scale, arguments in (
+		('mencoder', matroska.REQUIRED_EXECUTABLES['mencoder'], 100, '-o "{}"'),
+		('mkvmerge', matroska.REQUIRED_EXECUTABLES['mkvmerge'], 100, '-o "{}"'),
+		('ffmpeg', streaming.REQUIRED_EXECUTABLES['ffmpeg'], 600 * 25, '-y -nostats -progress pipe:1 "{}"')):
+		command = utils.which(tool)[0] + ' ' + arguments.format(output_file)
+		for rate in rates:
+			configure_stubs(lines, rate, 1)
+			with Measure() as m:
+				utils.launch_process_with_progress_bar(command, parser, scale, tool + ': ', False, False)
+			results['{}@{}'.format(tool, rate or 'max')] = m.result(lines=lines, rate=rate, lines_per_second=lines / m.wall, cpu_per_line=m.cpu / lines)
+	utils.set_progress_output(None)
+	return results
+
+def bench_mux_glob(work_dir, files):
+	"""
+		Selection of the files of a job on a crowded output directory, done by mux_audio_video
+	"""
+	output_dir = os.path.join(work_dir, 'mux')
+	os.makedirs(output_dir)
+	for i in range(files):
+		open(os.path.join(output_dir, 'other{:06d}_1.aac'.format(i)), 'w').close()
+	configure_stubs(10, 0, 1)
+	media = mediainfo.MediaInfo(os.path.join(work_dir, 'movie.mkv'), 0, 0, 'matroska')
+	media.audio_tracks = [(1, 'A_AAC')]
+	rounds = 20
+	with Measure() as m:
+		for i in range(rounds):
+			for f in ('movie.264', 'movie_1.aac'):
+				open(os.path.join(output_dir, f), 'w').close()
+			matroska.mux_audio_video(media, output_dir)
+	return m.result(files=files, rounds=rounds, per_round=m.wall / rounds)
+
+def git_revision():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+BENCHMARKS = ('scan', 'probe', 'progress', 'mux_glob')
+
+def main():
+	ap = argparse.ArgumentParser(description='Measure the overhead of hardsub with stub media tools')
+	ap.add_argument('-o', '--output', default='bench_results.json', help='JSON file where results are written', metavar='<output_file>')
+	ap.add_argument('--files', default=10000, type=int, help='files of the scanned and muxed directories', metavar='<files>')
+	ap.add_argument('--probe-files', default=200, type=int, help='files probed for each container', metavar='<files>')
+	ap.add_argument('--lines', default=5000, type=int, help='progress lines printed by each stub run', metavar='<lines>')
+	ap.add_argument('--rates', default='1000,5000,0', help='progress lines per second, 0 for as fast as possible', metavar='<rates>')
+	ap.add_argument('--only', choices=BENCHMARKS, action='append', help='run only this benchmark, may be repeated')
+	arguments = ap.parse_args()
+	work_dir = tempfile.mkdtemp(prefix='hs-bench-')
+	results = {}
+	try:
+		install_stubs(work_dir)
+		for name in arguments.only or BENCHMARKS:
+			sys.stderr.write('Running {}...\n'.format(name))
+			if name == 'scan':
+				results[name] = bench_scan(work_dir, arguments.files)
+			elif name == 'probe':
+				results[name] = bench_probe(work_dir, arguments.probe_files)
+			elif name == 'progress':
+				results[name] = bench_progress(work_dir, arguments.lines, [int(r) for r in arguments.rates.split(',')])
+			elif name == 'mux_glob':
+				results[name] = bench_mux_glob(work_dir, arguments.files)
+	finally:
+		shutil.rmtree(work_dir)
+	data = {
+		'version': 1,
+		'revision': git_revision(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'results': results
+	}
+	with open(arguments.output, 'w') as f:
+		json.dump(data, f, indent=1, sort_keys=True)
+	print(json.dumps(data, indent=1, sort_keys=True))
+
+if __name__ == '__main__':
+	main()
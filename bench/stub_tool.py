@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+	Stand-in for the media tools used by hardsub. It is linked on PATH under the
+	name of each tool and behaves after the name it is called with: probe tools
+	print track information, the others print progress lines in the format of
+	the real tool and write a dummy output file.
+
+	Behaviour is set by environment variables:
+	HS_STUB_LINES  progress lines printed by each run (default 200)
+	HS_STUB_RATE   progress lines per second, 0 for as fast as possible (default 1000)
+	HS_STUB_SIZE   bytes of each dummy output file (default 1048576)
+	HS_STUB_FPS    frame rate of the probed videos (default 25)
+	HS_STUB_LENGTH seconds of the probed videos (default 600)
+"""
+
+import os
+import sys
+import time
+
+LINES = int(os.environ.get('HS_STUB_LINES', 200))
+RATE = float(os.environ.get('HS_STUB_RATE', 1000))
+SIZE = int(os.environ.get('HS_STUB_SIZE', 1 << 20))
+FPS = float(os.environ.get('HS_STUB_FPS', 25))
+LENGTH = float(os.environ.get('HS_STUB_LENGTH', 600))
+
+def write_dummy(file_name):
+	block = b'\0' * min(SIZE, 1 << 20)
+	with open(file_name, 'wb') as f:
+		left = SIZE
+		while left > 0:
+			f.write(block[:left])
+			left = left - len(block)
+
+def option(args, name):
+	if name in args and args.index(name) + 1 < len(args):
+		return args[args.index(name) + 1]
+	return None
+
+def progress(line_format, end='\r'):
+	"""
+		Print progress lines at the configured rate, line_format gets the line number and the percentage
+	"""
+	start = time.time()
+	for i in range(1, LINES + 1):
+		sys.stdout.write(line_format(i, 100 * i // LINES) + end)
+		sys.stdout.flush()
+		if RATE > 0:
+			delay = start + float(i) / RATE - time.time()
+			if delay > 0:
+				time.sleep(delay)
+	sys.stdout.write('\n')
+
+def mencoder(args):
+	progress(lambda i, p: 'Pos: {:6.1f}s {:6d}f ({:2d}%) {:6.2f}fps Trem:   {}min  {}mb  A-V:0.000 [1500:128]'.format(
+		i / FPS, i, p, FPS * 4, max(100 - p, 0) // 10, SIZE >> 20))
+	write_dummy(option(args, '-o'))
+
+def mplayer(args):
+	if '-identify' in args:
+		print('ID_VIDEO_FORMAT=XVID')
+		print('ID_VIDEO_FPS={:.3f}'.format(FPS))
+		print('ID_AUDIO_ID=1')
+		print('ID_LENGTH={:.2f}'.format(LENGTH))
+		return
+	progress(lambda i, p: 'dump: {} bytes written ({}%)'.format(i * 1024, p))
+	write_dummy(option(args, '-dumpfile'))
+
+def mkvinfo(args):
+	print('+ EBML head')
+	print('+ Segment, size 1000000')
+	print('|+ Segment information')
+	print('| + Duration: {:.3f}s'.format(LENGTH))
+	print('|+ Segment tracks')
+	print('| + A track')
+	print('|  + Track number: 1 (track ID for mkvmerge & mkvextract: 0)')
+	print('|  + Track type: video')
+	print('|  + Codec ID: V_MPEG4/ISO/AVC')
+	print('|  + Default duration: {:.3f}ms ({:.3f} frames/fields per second for a video track)'.format(1000 / FPS, FPS))
+	print('| + A track')
+	print('|  + Track number: 2 (track ID for mkvmerge & mkvextract: 1)')
+	print('|  + Track type: audio')
+	print('|  + Codec ID: A_AAC')
+
+def mkvmerge(args):
+	progress(lambda i, p: 'Progress: {}%'.format(p))
+	write_dummy(option(args, '-o'))
+
+def mkvextract(args):
+	progress(lambda i, p: 'Progress: {}%'.format(p))
+	for arg in args:
+		if ':' in arg and arg.split(':', 1)[0].isdigit():
+			write_dummy(arg.split(':', 1)[1])
+
+def mp4info(args):
+	print('Track\tType\tInfo')
+	print('1\tvideo\tH264 Main@3.1, {:.3f} secs, 1500 kbps, 1280x720 @ {:.6f} fps'.format(LENGTH, FPS))
+	print('2\taudio\tMPEG-4 AAC LC, {:.3f} secs, 128 kbps, 48000 Hz'.format(LENGTH))
+
+def mp4box(args):
+	progress(lambda i, p: 'Importing ISO File: |{:20}| ({}/100)'.format('=' * (p // 5), p))
+	write_dummy(option(args, '-out') or args[-1])
+
+def ffprobe(args):
+	if '-show_streams' in args:
+		print('[STREAM]')
+		print('nb_frames={}'.format(int(LENGTH * FPS)))
+		print('[/STREAM]')
+		return
+	print('h264')
+	for i in range(int(LENGTH)):
+		print('{:.6f},{}'.format(i, 'K_' if i % 10 == 0 else '__'))
+
+def ffmpeg(args):
+	frames = int(LENGTH * FPS)
+
+	def block(i, p):
+		return 'frame={}\nfps={:.2f}\nbitrate=1500.0kbits/s\nout_time_us={}\nprogress={}'.format(
+			frames * i // LINES, FPS * 4, int(1000000 * LENGTH * i / LINES), 'end' if i == LINES else 'continue')
+
+	progress(block, '\n')
+	write_dummy(args[-1])
+
+TOOLS = {
+	'mencoder': mencoder,
+	'mplayer': mplayer,
+	'mkvinfo': mkvinfo,
+	'mkvmerge': mkvmerge,
+	'mkvextract': mkvextract,
+	'mp4info': mp4info,
+	'MP4Box': mp4box,
+	'ffprobe': ffprobe,
+	'ffmpeg': ffmpeg
+}
+
+if __name__ == '__main__':
+	TOOLS[os.path.basename(sys.argv[0])](sys.argv[1:])
@@ -1 +1,3 @@
-from hardsub import hardsub_main
+from hardsub import hardsub_main, NotEnoughSpace
+from pipeline import HardsubJob, Pipeline, JobCancelled, NotAVideo, MissingExecutables
+from utils import HardsubError, ToolError
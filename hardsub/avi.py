@@ -2,144 +2,172 @@
 
 import os
 import re
+import sys
 
-import pexpect
-
-from utils import which, launch_process_with_progress_bar
+from profiles import DEFAULT_PROFILE, PROFILES, in_use, mencoder_video_options
+from progress import MencoderParser, FfmpegParser
+from utils import which, launch_process_with_progress_bar, get_base_file_name, run_command
 
 # List of required executables on a Linux Box used to accomplish
 # hard subbing
 REQUIRED_EXECUTABLES = {
-	'mencoder' : '.*\((.*)%\).*',
-	'mplayer'  : '.*\((.*)%\).*',
-	'ffmpeg'   : '.*frame=(\d+).*'
+	'mencoder' : MencoderParser,
+	'mplayer'  : MencoderParser,
+	'ffmpeg'   : FfmpegParser
 }
 
+# Executable used by probe, needed whatever engine hardsubs the file
+PROBE_EXECUTABLE = 'mplayer'
+
+# Extension of the hardsubbed video track written by hardsub_video
+VIDEO_EXTENSION = 'xvid'
+
 verbose = False
 
 debug = False
 
-def check_video(file_name):
+# Settings of this container on the encoding profile in use
+encoding = PROFILES[DEFAULT_PROFILE]['avi']
+
+def probe(file_name):
 	"""
-		Checks if the file has a video track
-		:param file_name: file to check
+		Read tracks, duration and frames of an AVI file with a single mplayer run
+		:param file_name: file to probe
 		:type fille_name: string
-		:returns: boolean -- True if the file has a video track, False otherwise. 
+		:returns: dict -- has_video, audio_tracks, duration and frames of the file
 	"""
-	found = False
 	# copyed from midentify
-	command = '{mplayer} -noconfig all -cache-min 0 -vo null -ao null -frames 0 -identify "{input_file}" 2>/dev/null | grep ID_VIDEO_FORMAT'.format(mplayer=which('mplayer')[0], input_file=file_name)
-	if verbose:
-		print command
-	thread = pexpect.spawn(command)
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		".*ID_VIDEO_FORMAT.*"
-		])
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0:  # EOF, Process exited
-			break
-		if i == 1:  # Status
-			found = True	
-	thread.close()	 
-	return found
+	command = '{mplayer} -noconfig all -cache-min 0 -vo null -ao null -frames 0 -identify "{input_file}"'.format(mplayer=which('mplayer')[0], input_file=file_name)
+	output = run_command(command, verbose)
+	info = {
+		'has_video': re.search(r'^ID_VIDEO_FORMAT=', output, re.M) is not None,
+		'audio_tracks': [(int(t), '') for t in re.findall(r'^ID_AUDIO_ID=(\d+)', output, re.M)],
+		'duration': None,
+		'frames': None
+	}
+	length = re.search(r'^ID_LENGTH=(\d+(?:\.\d+)?)', output, re.M)
+	if length is not None:
+		info['duration'] = float(length.group(1))
+	fps = re.search(r'^ID_VIDEO_FPS=(\d+(?:\.\d+)?)', output, re.M)
+	if fps is not None and info['duration'] is not None:
+		info['frames'] = int(round(info['duration'] * float(fps.group(1))))
+	return info
 
-def hardsub_video(file_name, output_dir, scale):
+def mencoder_command(input_file, sub_file, output_file, scale, raw=False, encoding_settings=None):
+	"""
+		Build the mencoder command that hardsubs a AVI video
+		:param input_file: Name of the file that had to be reencoded
+		:type input_file: str
+		:param sub_file: .srt file with subtitles to burn
+		:type sub_file: str
+		:param output_file: Where to write the hardsubbed video track
+		:type output_file: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param raw: Write a raw elementary stream instead of a container
+		:type raw: bool
+		:param encoding_settings: Settings of this container on an encoding profile, None for the ones in use
+		:type encoding_settings: dict
+		:returns: str -- mencoder command
+	"""
+	return '{mencoder} -o "{output_file}"{raw} -nosound -noautosub -noskip -mc 0 -sub "{sub_file}" -subfont-text-scale "{subtitle_scale}" {video_opts} "{input_file}"'.format(
+		mencoder = which("mencoder")[0],
+		output_file = output_file,
+		raw = ' -of rawvideo' if raw else '',
+		sub_file = sub_file,
+		subtitle_scale = scale,
+		video_opts = mencoder_video_options(encoding_settings or in_use('avi', encoding)),
+		input_file = input_file
+	)
+
+def hardsub_video(media, output_dir, scale):
 	"""
 		Hardsub a AVI video reencoding it using a .srt file for Subititles
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw hardsubbed video
 		:type output_dir: str
 		:param scale: Subtitle font scale
 		:type a: int
 	"""
-	# Build MEncoder command
-	command = '{mencoder} -o "{output_file}" -nosound -noautosub -noskip -mc 0 -sub "{sub_file}" -subfont-text-scale "{subtitle_scale}" -ovc xvid -xvidencopts fixed_quant=2 "{input_file}"'.format(
-		mencoder=which("mencoder")[0],
-		output_file="{}/{}.xvid".format(output_dir, os.path.splitext(os.path.basename(file_name))[0]),
-		sub_file=os.path.splitext(file_name)[0] + ".srt",
-		subtitle_scale=scale,
-		input_file=file_name
-	)
-	launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mencoder'], 100, 'Video Encoding: ', verbose, debug)
+	file_name = media.file_name
+	command = mencoder_command(file_name, os.path.splitext(file_name)[0] + ".srt", "{}/{}.xvid".format(output_dir, get_base_file_name(file_name)), scale)
+	frames = launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mencoder'], 100, 'Video Encoding: ', verbose, debug)
+	if media.frames is None:
+		# Encoding keeps every frame of the source
+		media.frames = frames
 
-def extract_audio(file_name, output_dir):
+def extract_audio(media, output_dir):
 	"""
-		Extract all audio tracks from a AVI container
-		:param filename: Name of the file that contains audio track
-		:type filename: str 
+		Extract all audio tracks from a AVI container with a single sequential read of
+		the source. Each track is copied on its own Matroska audio file, the video track
+		is only counted, so the frames of the file are known when it is rebuilt.
+		:param media: File that contains audio track
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw audio track
 		:type output_dir: str	
 	"""
-	# detect how many audio track
-	command = '{mplayer} -noconfig all -cache-min 0 -vo null -ao null -frames 0 -identify "{input_file}" 2>/dev/null | grep ID_AUDIO_ID'.format(mplayer=which('mplayer')[0], input_file=file_name)
-	if verbose:
-		print command
-	thread = pexpect.spawn(command)
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		"ID_AUDIO_ID=(\d+).*"
-		])
-	audio_tracks = []
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0:  # EOF, Process exited
-			break
-		if i == 1:  # Status
-			audio_tracks.append(int(thread.match.group(1)))	
-	thread.close()	 
-	# Now extract each audio track
-	for track in audio_tracks:
-		t_command = '{mplayer} -aid {track} -dumpaudio -dumpfile {dest_file} "{input_file}"'.format(
-			mplayer=which("mplayer")[0],
-			input_file=file_name,
-			track=track,
-			dest_file=output_dir + os.sep + "{}".format(track) + ".audio"
-		)
-		launch_process_with_progress_bar(t_command, REQUIRED_EXECUTABLES['mplayer'], 100, 'Extract audio track {}: '.format(track), verbose, debug)
+	if len(media.audio_tracks) == 0:
+		return
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
+	# Audio tracks are listed in the order of their streams
+	outputs = ['-map 0:a:{index} -c copy -f matroska "{dest_file}"'.format(
+			index=index,
+			dest_file=output_dir + os.sep + base_file_name + '_' + "{}".format(track) + ".audio"
+		) for index, (track, codec) in enumerate(media.audio_tracks)]
+	command = '{ffmpeg} -y -nostats -progress pipe:1 -i "{input_file}" -map 0:v:0 -c copy -f null - {outputs}'.format(
+		ffmpeg=which("ffmpeg")[0],
+		input_file=file_name,
+		outputs=' '.join(outputs)
+	)
+	frames = launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['ffmpeg'], media.frames or sys.maxint, 'Extract audio tracks: ', verbose, debug)
+	if media.frames is None:
+		media.frames = frames
 
-def mux_audio_video(file_name, output_dir):
+def mux_audio_video(media, output_dir, passthrough=False):
 	"""
 		Rebuild the AVI container for source file with hardsubbed video track
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw hardsubbed video
 		:type output_dir: str
+		:param passthrough: Take audio tracks straight from the source file instead of the extracted ones
+		:type passthrough: bool
 	"""
-	list_of_files = [f for f in os.listdir(output_dir)  if re.match(r'.*\.(xvid|audio)', f)]
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
+	# Only pick the files of this job, other jobs may share the output directory
+	extensions = 'xvid' if passthrough else 'xvid|audio'
+	list_of_files = [f for f in os.listdir(output_dir) if re.match(re.escape(base_file_name) + r'(_\d+)?\.(' + extensions + ')$', f)]
 	input_param = []
 	map_param = []
 	count = 0
 	for f in reversed(list_of_files):
 		if f[-5:] == '.xvid':
-			video_file = '-i "' + output_dir + os.sep + f + '"'
+			video_path = output_dir + os.sep + f
+			video_file = '-i "' + video_path + '"'
 		else:
 			count = count + 1
 			input_param.append('-i "' + output_dir + os.sep + f + '"')
 			map_param.append('-map ' + str(count) + ':0')
+	if passthrough and len(media.audio_tracks) > 0:
+		input_param.append('-i "' + file_name + '"')
+		map_param.append('-map ' + str(count + 1) + ':a')
 
-	# Gather data for the progress bar.
-	# If you have ffmpeg you have ffprobe, so it is not checked in REQUIRED_EXECUTABLES
-	command = '{ffprobe} -show_streams "{video_input}"'.format(
-		ffprobe=which('ffprobe')[0],
-                video_input=output_dir + os.sep + f,
-	)
-	thread = pexpect.spawn(command)
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		"nb_frames=(\d+)"
-		])
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0:  # EOF, Process exited
-			break
-		if i == 1:  # Status
-			tot_frames = int(thread.match.group(1))
-	thread.close()	 
+	# Gather data for the progress bar, encoding keeps every frame of the source.
+	# Frames are known from the probe, the audio extraction or the encoder, unless
+	# those stages were run by a previous run of the job.
+	tot_frames = media.frames
+	if tot_frames is None:
+		# If you have ffmpeg you have ffprobe, so it is not checked in REQUIRED_EXECUTABLES
+		command = '{ffprobe} -show_streams "{video_input}"'.format(
+			ffprobe=which('ffprobe')[0],
+			video_input=video_path,
+		)
+		tot_frames = int(re.search(r'nb_frames=(\d+)', run_command(command, verbose)).group(1))
 
-	command = '{ffmpeg} -y {video_input} {input_params} -c copy -map 0:0 {map_params} "{dest_file}"'.format(
+	command = '{ffmpeg} -y -nostats -progress pipe:1 {video_input} {input_params} -c copy -map 0:0 {map_params} "{dest_file}"'.format(
 		ffmpeg=which('ffmpeg')[0],
                 video_input=video_file,
 		input_params=' '.join(input_param),
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: batchprogress
+
+    :synopsis: Module that orders the files of a batch longest first and estimates when the whole batch ends
+"""
+
+import multiprocessing
+import threading
+import time
+
+import progress
+import report
+
+# Frame rate assumed for files whose frame count is unknown
+DEFAULT_FPS = 25
+
+# Stages whose progress tells how far the encode of a file is
+ENCODE_STAGES = ('hardsub_video', 'stream_video', 'hardsub_with_engine', 'hardsub_languages')
+
+# Progress of the encode commands of the job running on this process, by command
+_percents = {}
+_percents_lock = threading.Lock()
+
+def job_frames(media):
+	"""
+		Estimate the frames a file takes to encode
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:returns: float -- Frames of the file, estimated from its duration or, lacking that, its size
+	"""
+	if media.frames:
+		return float(media.frames)
+	if media.duration:
+		return media.duration * DEFAULT_FPS
+	# Roughly 1 MB every 10 seconds of video
+	return media.size / 1e5 * DEFAULT_FPS
+
+def longest_first(files):
+	"""
+		Order files so that the longest jobs start first, which keeps the end of a parallel batch short
+		:param files: MediaInfo of the files that had to be reencoded
+		:type files: list
+		:returns: list -- Files, longest first, by name when equally long
+	"""
+	return sorted(files, key=lambda m: (-job_frames(m), m.file_name))
+
+class BatchProgress(object):
+	"""
+		Progress of a batch: frames of finished files and of the files being
+		encoded on each slot, shared by the processes forked after it is created.
+		:param files: MediaInfo of the files of the batch
+		:type files: list
+		:param slots: Number of files hardsubbed at the same time
+		:type slots: int
+	"""
+
+	def __init__(self, files, slots):
+		self.files = len(files)
+		self.total = sum([job_frames(f) for f in files])
+		self.done = 0.0
+		self.finished = 0
+		self.start = time.time()
+		self.slot_frames = multiprocessing.Array('d', slots)
+		self.slot_fraction = multiprocessing.Array('d', slots)
+		self.slot_start = multiprocessing.Array('d', slots)
+
+	def start_job(self, slot, media):
+		"""
+			Record that a slot starts working on a file
+		"""
+		with _percents_lock:
+			_percents.clear()
+		self.slot_frames[slot] = job_frames(media)
+		self.slot_fraction[slot] = 0.0
+		self.slot_start[slot] = time.time()
+
+	def update(self, slot):
+		"""
+			Record how far the encode of the file of a slot is, as the average of its encode commands
+		"""
+		with _percents_lock:
+			if len(_percents) > 0:
+				self.slot_fraction[slot] = min(sum(_percents.values()) / len(_percents) / 100.0, 1.0)
+
+	def end_job(self, slot):
+		"""
+			Record that the file of a slot is over, job_done accounts it on the batch
+		"""
+		self.slot_frames[slot] = 0.0
+		self.slot_fraction[slot] = 0.0
+
+	def job_done(self, media):
+		"""
+			Account a finished file, on the process that started the batch
+			:param media: Finished file
+			:type media: MediaInfo
+		"""
+		self.done = self.done + job_frames(media)
+		self.finished = self.finished + 1
+
+	def estimate(self):
+		"""
+			Estimate the end of the batch from the frames processed so far. The batch cannot
+			end before the slowest running file, whatever the other slots do.
+			:returns: (float, float, float) -- Processed part of the batch, frames per second and seconds left, None when unknown
+		"""
+		now = time.time()
+		processed = self.done
+		tail = 0.0
+		for slot in range(len(self.slot_frames)):
+			frames = self.slot_frames[slot]
+			fraction = self.slot_fraction[slot]
+			processed = processed + frames * fraction
+			elapsed = now - self.slot_start[slot]
+			if frames > 0 and fraction > 0 and elapsed > 0:
+				tail = max(tail, elapsed * (1 - fraction) / fraction)
+		elapsed = now - self.start
+		if processed <= 0 or elapsed <= 0 or self.total <= 0:
+			return (0.0, None, None)
+		fps = processed / elapsed
+		return (min(processed / self.total, 1.0), fps, max((self.total - processed) / fps, tail))
+
+	def describe(self):
+		"""
+			:returns: str -- Progress of the batch, ready to be shown
+		"""
+		part, fps, left = self.estimate()
+		text = "Batch: {:.0%} ({}/{} files)".format(part, self.finished, self.files)
+		if fps is not None:
+			text = text + ", {:.1f} fps, ETA {}".format(fps, time.strftime("%H:%M:%S", time.gmtime(left)))
+		return text
+
+def _record_percent(event):
+	"""
+		Progress subscriber that keeps the progress of the encode commands of the current job
+	"""
+	if event.done or event.percent is None or event.frame is None:
+		# Commands that do not count frames only split, join or mux
+		return
+	if report.get_context()[1] not in ENCODE_STAGES:
+		return
+	with _percents_lock:
+		_percents[event.command] = max(min(event.percent, 100.0), 0.0)
+
+def track(batch, slot):
+	"""
+		Follow the encode commands launched by this process on a slot of a batch
+		:param batch: Progress of the batch
+		:type batch: BatchProgress
+		:param slot: Slot of this process
+		:type slot: int
+	"""
+	def update(event):
+		_record_percent(event)
+		batch.update(slot)
+
+	progress.subscribe(update)
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: cluster
+
+    :synopsis: Module that spreads a batch over several hosts: a coordinator leases jobs over HTTP to workers sharing the same storage
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import traceback
+import urllib2
+import uuid
+
+import colorama
+
+import batchprogress
+import hardsub
+import loadcontrol
+import runner
+from journal import Journal
+from mediainfo import ProbeCache, probe
+from outputcache import OutputCache, parse_size
+from report import BatchReport, JobReport, set_job_report
+from utils import ProgressLine, log, set_progress_output
+
+# Port of the coordinator when none is given
+DEFAULT_PORT = 8642
+
+# Seconds a lease lasts without heartbeats
+LEASE_TIME = 120
+
+# Seconds between two heartbeats of a worker, well within a lease
+HEARTBEAT_INTERVAL = 20
+
+# Leases of a file that may expire before it is given up
+MAX_ATTEMPTS = 3
+
+# Seconds a worker waits before asking again when every job is leased
+WAIT_TIME = 5
+
+# Seconds a worker waits for an answer of the coordinator
+REQUEST_TIMEOUT = 30
+
+# Options of hardsub_file sent by the coordinator, the others belong to each worker
+SHARED_OPTIONS = ('segments', 'stream', 'passthrough', 'engine', 'smart_render', 'profile', 'source_dir', 'tool_timeout', 'languages')
+
+# States of a job
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+class Coordinator(object):
+	"""
+		Jobs of a batch, leased one at a time. A lease that is not renewed
+		by heartbeats expires and its file is leased again to another worker.
+		:param files: MediaInfo of the files that had to be reencoded
+		:type files: list
+		:param output_dir: Directory where to place hardsubbed videos
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type scale: int
+		:param options: Shared keyword arguments of hardsub_file, plus cache_dir and cache_size
+		:type options: dict
+		:param lease_time: Seconds a lease lasts without heartbeats
+		:type lease_time: float
+	"""
+
+	def __init__(self, files, output_dir, scale, options, lease_time=LEASE_TIME):
+		self.jobs = [{'file_name': f.file_name, 'state': PENDING, 'attempts': 0, 'worker': None, 'running': [], 'report': None} for f in files]
+		self.output_dir = output_dir
+		self.scale = scale
+		self.options = options
+		self.lease_time = lease_time
+		self.leases = {}
+		self.lock = threading.Lock()
+
+	def expire(self):
+		"""
+			Take back the jobs whose lease has expired
+		"""
+		now = time.time()
+		with self.lock:
+			for lease, job in self.leases.items():
+				if job['expires'] >= now:
+					continue
+				del self.leases[lease]
+				job['state'] = PENDING if job['attempts'] < MAX_ATTEMPTS else FAILED
+				log(colorama.Fore.YELLOW + "Lease of {} on {} expired".format(os.path.basename(job['file_name']), job['worker']) + colorama.Fore.RESET)
+
+	def lease(self, worker):
+		"""
+			Lease the next pending job
+			:param worker: Name of the worker
+			:type worker: str
+			:returns: dict -- Job and lease, or wait to ask again later, or finished when nothing is left
+		"""
+		self.expire()
+		with self.lock:
+			pending = [job for job in self.jobs if job['state'] == PENDING]
+			if len(pending) == 0:
+				if len(self.leases) == 0:
+					return {'finished': True}
+				return {'wait': WAIT_TIME}
+			job = pending[0]
+			lease = uuid.uuid4().hex
+			job.update({'state': LEASED, 'worker': worker, 'expires': time.time() + self.lease_time, 'running': []})
+			job['attempts'] = job['attempts'] + 1
+			self.leases[lease] = job
+		log("Leased {} to {}".format(os.path.basename(job['file_name']), worker))
+		return {
+			'lease': lease,
+			'file_name': job['file_name'],
+			'output_dir': self.output_dir,
+			'scale': self.scale,
+			'options': self.options,
+			'heartbeat': min(HEARTBEAT_INTERVAL, self.lease_time / 3.0)
+		}
+
+	def heartbeat(self, lease, running=None, stages=None):
+		"""
+			Renew a lease and record the stages of its job
+			:param lease: Lease to renew
+			:type lease: str
+			:param running: Stages running on the worker
+			:type running: list
+			:param stages: Stages of the job so far, see JobReport.to_dict
+			:type stages: dict
+			:returns: boolean -- False if the lease has expired
+		"""
+		with self.lock:
+			job = self.leases.get(lease)
+			if job is None:
+				return False
+			job['expires'] = time.time() + self.lease_time
+			job['running'] = running or []
+			if stages is not None:
+				job['stages'] = stages
+			return True
+
+	def finish(self, lease, done, job_report=None):
+		"""
+			Record the outcome of a leased job
+			:param lease: Lease of the job
+			:type lease: str
+			:param done: True if the file has been hardsubbed
+			:type done: bool
+			:param job_report: Report of the job, see JobReport.to_dict
+			:type job_report: dict
+			:returns: boolean -- False if the lease has expired
+		"""
+		with self.lock:
+			job = self.leases.pop(lease, None)
+			if job is None:
+				return False
+			job.update({'state': DONE if done else FAILED, 'running': [], 'report': job_report})
+		if done:
+			outcome = colorama.Fore.GREEN + "done" + colorama.Fore.RESET
+		else:
+			outcome = colorama.Fore.RED + "failed" + colorama.Fore.RESET
+		log("{} {} on {}".format(os.path.basename(job['file_name']), outcome, job['worker']))
+		return True
+
+	def release(self, lease):
+		"""
+			Give back a leased job without outcome, e.g. when its worker is stopping
+			:param lease: Lease of the job
+			:type lease: str
+			:returns: boolean -- False if the lease has expired
+		"""
+		with self.lock:
+			job = self.leases.pop(lease, None)
+			if job is None:
+				return False
+			job['state'] = PENDING
+			job['attempts'] = job['attempts'] - 1
+			job['running'] = []
+		log("{} released by {}".format(os.path.basename(job['file_name']), job['worker']))
+		return True
+
+	def finished(self):
+		"""
+			:returns: boolean -- True when every job is done or failed
+		"""
+		with self.lock:
+			return all(job['state'] in (DONE, FAILED) for job in self.jobs)
+
+	def status(self):
+		"""
+			:returns: dict -- State, worker and stages of every job
+		"""
+		with self.lock:
+			jobs = [dict((k, v) for k, v in job.items() if k != 'report') for job in self.jobs]
+		counts = dict((state, len([j for j in jobs if j['state'] == state])) for state in (PENDING, LEASED, DONE, FAILED))
+		return {'counts': counts, 'jobs': jobs}
+
+	def results(self):
+		"""
+			:returns: list -- (file name, done, elapsed seconds, job report) for every finished job
+		"""
+		results = []
+		with self.lock:
+			for job in self.jobs:
+				job_report = job['report'] or {'file_name': job['file_name'], 'wall': 0.0, 'stages': {}}
+				results.append((job['file_name'], job['state'] == DONE, job_report['wall'] or 0.0, job_report))
+		return results
+
+class CoordinatorHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""
+		JSON over HTTP interface of the coordinator:
+		GET /status, POST /lease, /heartbeat, /finish and /release
+	"""
+
+	def _reply(self, code, data=None):
+		body = json.dumps(data if data is not None else {})
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path == '/status':
+			self._reply(200, self.server.coordinator.status())
+		else:
+			self._reply(404)
+
+	def do_POST(self):
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))) or '{}')
+		except ValueError:
+			self._reply(400)
+			return
+		coordinator = self.server.coordinator
+		if self.path == '/lease':
+			self._reply(200, coordinator.lease(request.get('worker', self.client_address[0])))
+		elif self.path == '/heartbeat':
+			self._reply(200 if coordinator.heartbeat(request.get('lease'), request.get('running'), request.get('stages')) else 410)
+		elif self.path == '/finish':
+			self._reply(200 if coordinator.finish(request.get('lease'), request.get('done', False), request.get('report')) else 410)
+		elif self.path == '/release':
+			self._reply(200 if coordinator.release(request.get('lease')) else 410)
+		else:
+			self._reply(404)
+
+	def log_message(self, format, *args):
+		# Requests are not logged, the coordinator logs what they change
+		pass
+
+class CoordinatorServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""
+		HTTP server of a coordinator, answering each request on its own thread
+	"""
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, coordinator):
+		BaseHTTPServer.HTTPServer.__init__(self, address, CoordinatorHandler)
+		self.coordinator = coordinator
+
+def parse_address(listen):
+	"""
+		Parse an address such as 0.0.0.0:8642, :8642 or 8642
+		:param listen: Address to parse
+		:type listen: str
+		:returns: (str, int) -- Host and port
+	"""
+	host, _, port = listen.rpartition(':')
+	return (host, int(port))
+
+def build_serve_parser():
+	"""
+		Build an ArgumentParser instance suitable for the coordinator
+		:returns: ArgumentParser -- ArgumentParser for the coordinator
+	"""
+	ap = hardsub.build_argument_parser()
+	ap.prog = "hs serve"
+	ap.description = "Lease the files of a batch to workers running on other hosts"
+	ap.add_argument("--listen", default=":{}".format(DEFAULT_PORT), help="address where workers connect, e.g. 0.0.0.0:{}".format(DEFAULT_PORT), metavar="<[host]:port>")
+	ap.add_argument("--lease-time", default=LEASE_TIME, type=float, help="seconds a job stays leased to a worker that stopped sending heartbeats", metavar="<seconds>")
+	return ap
+
+def serve_main(argv):
+	"""
+		Run the coordinator of a batch until every file is done or failed
+		:param argv: Parameters of the coordinator
+		:type argv: list
+	"""
+	ap = build_serve_parser()
+	arguments = ap.parse_args(argv)
+	parameter_checks, param_errors = hardsub.check_arguments(vars(arguments))
+	try:
+		address = parse_address(arguments.listen)
+	except ValueError:
+		parameter_checks = False
+		param_errors.append(colorama.Style.BRIGHT + "listen" + colorama.Style.NORMAL + " is not a valid address")
+	if arguments.preview:
+		parameter_checks = False
+		param_errors.append(colorama.Style.BRIGHT + "preview" + colorama.Style.NORMAL + " can only be used on a batch")
+	if arguments.lease_time <= 0:
+		parameter_checks = False
+		param_errors.append(colorama.Style.BRIGHT + "lease time" + colorama.Style.NORMAL + " must be positive")
+	if not parameter_checks:
+		print ("Some parameters are inconsistent:")
+		for pe in param_errors:
+			print ("\t- {}".format(pe))
+		sys.exit(3)
+	hardsub.check_output_dir(arguments)
+	# Workers run on other hosts, on the same paths of the shared storage
+	arguments.source_dir = os.path.abspath(arguments.source_dir)
+	arguments.output = os.path.abspath(arguments.output)
+	runner.tool_timeout = arguments.tool_timeout or None
+	batch_report = BatchReport()
+	with batch_report.stage('probe'):
+		files_to_hardsub = hardsub.find_candidates(arguments.source_dir, None if arguments.no_probe_cache else ProbeCache(arguments.probe_cache), arguments.recursive, arguments.languages)
+	if len(files_to_hardsub) == 0:
+		print ("There are no video files to hardsub on the source directory.")
+		sys.exit(4)
+	file_options = hardsub.build_file_options(arguments)
+	files_to_hardsub = hardsub.skip_completed(files_to_hardsub, arguments, file_options)
+	if len(files_to_hardsub) == 0:
+		sys.exit(0)
+	options = dict((k, v) for k, v in file_options.items() if k in SHARED_OPTIONS)
+	options['cache_dir'] = arguments.cache_dir
+	options['cache_size'] = arguments.cache_size
+	# Longest files are leased first, so the farm is not left waiting on a long one at the end
+	coordinator = Coordinator(batchprogress.longest_first(files_to_hardsub), arguments.output, arguments.subtitle_scale, options, arguments.lease_time)
+	server = CoordinatorServer(address, coordinator)
+	server.timeout = 1
+	log("Leasing " + colorama.Style.BRIGHT + "{}".format(len(files_to_hardsub)) + colorama.Style.NORMAL + " file(s) on {}:{}".format(address[0] or '*', server.server_address[1]))
+	start = time.time()
+	try:
+		while not coordinator.finished():
+			server.handle_request()
+			coordinator.expire()
+		# Let waiting workers know that the batch is over
+		linger = time.time() + 2 * WAIT_TIME
+		while time.time() < linger:
+			server.handle_request()
+	finally:
+		server.server_close()
+	results = coordinator.results()
+	hardsub.print_summary(results, time.time() - start)
+	if arguments.report is not None:
+		for file_name, done, seconds, job_report in results:
+			batch_report.add_job(job_report, done)
+		batch_report.write(arguments.report)
+	if len([r for r in results if not r[1]]) > 0:
+		sys.exit(6)
+
+def _request(url, path, data=None):
+	"""
+		Send a request to the coordinator
+		:returns: (int, dict) -- HTTP status and decoded answer, None on errors
+	"""
+	request = urllib2.Request(url.rstrip('/') + path, json.dumps(data) if data is not None else None, {'Content-Type': 'application/json'})
+	try:
+		return (200, json.load(urllib2.urlopen(request, timeout=REQUEST_TIMEOUT)))
+	except urllib2.HTTPError as e:
+		return (e.code, None)
+
+def _heartbeat(url, lease, job_report, stop, expired, interval):
+	"""
+		Renew a lease, reporting the stages of its job, until stop is set. If the lease
+		has expired, the file may already be leased to another worker on the same
+		workspace and output: expired is set and the tools of the job are killed.
+	"""
+	while not stop.wait(interval):
+		try:
+			status, answer = _request(url, '/heartbeat', {'lease': lease, 'running': job_report.running_stages(), 'stages': job_report.to_dict()['stages']})
+		except (urllib2.URLError, socket.error):
+			# The coordinator may be busy, the lease lasts several heartbeats
+			continue
+		if status == 410:
+			log(colorama.Fore.YELLOW + "Lease of {} expired, giving it up".format(os.path.basename(job_report.file_name)) + colorama.Fore.RESET)
+			expired.set()
+			runner.cancel_all()
+			return
+
+def _job_options(job, scratch_dir, verbose, debug):
+	"""
+		Build the keyword arguments of hardsub_file for a leased job
+	"""
+	options = dict((str(k), v) for k, v in job['options'].items() if k in SHARED_OPTIONS)
+	options.update({
+		'verbose': verbose,
+		'debug': debug,
+		'scratch_dir': scratch_dir,
+		'resume': Journal(job['output_dir']),
+		'cache': None
+	})
+	if job['options'].get('cache_dir') is not None:
+		cache_size = job['options'].get('cache_size')
+		options['cache'] = OutputCache(job['options']['cache_dir'], None if cache_size is None else parse_size(cache_size))
+	return options
+
+def _cluster_worker(url, worker, stopping, scratch_dir, verbose, debug):
+	"""
+		Lease and hardsub files until the batch is over or the worker is stopped
+	"""
+	# Signals are handled by the parent process, which lets running jobs finish
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+	while not stopping.is_set():
+		try:
+			status, job = _request(url, '/lease', {'worker': worker})
+		except (urllib2.URLError, socket.error) as e:
+			log(colorama.Fore.RED + "Coordinator {} unreachable: {}".format(url, e) + colorama.Fore.RESET)
+			return
+		if job is None or job.get('finished'):
+			return
+		if 'wait' in job:
+			stopping.wait(job['wait'])
+			continue
+		options = _job_options(job, scratch_dir, verbose, debug)
+		set_progress_output(ProgressLine(0, hardsub.rows_per_job(options.get('segments', 1)), threading.Lock(), stream=open(os.devnull, 'w')))
+		try:
+			media = probe(job['file_name'])
+		except (OSError, IOError) as e:
+			# The file vanished from shared storage: fail it instead of passing it to the next worker
+			log(colorama.Fore.RED + "Cannot read {}: {}".format(os.path.basename(job['file_name']), e.strerror) + colorama.Fore.RESET)
+			try:
+				_request(url, '/finish', {'lease': job['lease'], 'done': False, 'report': JobReport(job['file_name']).to_dict()})
+			except (urllib2.URLError, socket.error) as e:
+				log(colorama.Fore.RED + "Coordinator {} unreachable: {}".format(url, e) + colorama.Fore.RESET)
+				return
+			continue
+		executables_found, missing_executables = hardsub.check_prerequisites(media, options['stream'], options['engine'], options['smart_render'])
+		if not executables_found:
+			log(colorama.Fore.RED + "Missing {}, giving {} back".format(', '.join(missing_executables), os.path.basename(media.file_name)) + colorama.Fore.RESET)
+			try:
+				_request(url, '/release', {'lease': job['lease']})
+			except (urllib2.URLError, socket.error) as e:
+				log(colorama.Fore.RED + "Coordinator {} unreachable: {}".format(url, e) + colorama.Fore.RESET)
+			return
+		log("Start work on " + colorama.Style.BRIGHT + "{}".format(os.path.basename(media.file_name)) + colorama.Style.NORMAL)
+		job_report = JobReport(media.file_name)
+		set_job_report(job_report)
+		stop_heartbeat = threading.Event()
+		expired = threading.Event()
+		heartbeat = threading.Thread(target=_heartbeat, args=(url, job['lease'], job_report, stop_heartbeat, expired, job['heartbeat']))
+		heartbeat.daemon = True
+		heartbeat.start()
+		try:
+			done = media.kind is not None and hardsub.hardsub_file(media, job['output_dir'], job['scale'], **options)
+		except Exception:
+			traceback.print_exc()
+			done = False
+		finally:
+			stop_heartbeat.set()
+			heartbeat.join()
+		job_report.finish()
+		if expired.is_set():
+			# The file belongs to another lease now, its outcome is not ours to tell
+			continue
+		try:
+			if not done and stopping.is_set():
+				# Interrupted by the shutdown, another worker takes the file
+				_request(url, '/release', {'lease': job['lease']})
+			else:
+				_request(url, '/finish', {'lease': job['lease'], 'done': done, 'report': job_report.to_dict()})
+		except (urllib2.URLError, socket.error) as e:
+			log(colorama.Fore.RED + "Coordinator {} unreachable: {}".format(url, e) + colorama.Fore.RESET)
+			return
+
+def build_work_parser():
+	"""
+		Build an ArgumentParser instance suitable for a worker
+		:returns: ArgumentParser -- ArgumentParser for a worker
+	"""
+	ap = argparse.ArgumentParser(
+		prog="hs work",
+		description="Hardsub files leased by a coordinator started with hs serve"
+	)
+	ap.add_argument("coordinator", help="URL of the coordinator, e.g. http://render1:{}/".format(DEFAULT_PORT))
+	ap.add_argument("-j", "--jobs", default=1, type=int, help="number of files hardsubbed at the same time", metavar="<jobs>")
+	ap.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+	ap.add_argument("--adaptive", help="start encodes, extractions and muxes according to the CPU, memory and disk load of the host, with -j as the most files at once", action="store_true")
+	ap.add_argument("--min-free-memory", default="1G", help="memory that must be available to start an encode with --adaptive (e.g. 2G)", metavar="<size>")
+	ap.add_argument("--scratch-dir", help="directory where each job writes its intermediate files, e.g. on a fast local disk or a tmpfs", metavar="<scratch_dir>")
+	ap.add_argument("--debug", help="save stdout and stderr on /tmp/hs.log", action="store_true")
+	return ap
+
+def work_main(argv):
+	"""
+		Run workers that hardsub files leased by a coordinator, until the batch is over
+		:param argv: Parameters of the worker
+		:type argv: list
+	"""
+	ap = build_work_parser()
+	arguments = ap.parse_args(argv)
+	param_errors = []
+	if arguments.jobs < 1:
+		param_errors.append(colorama.Style.BRIGHT + "jobs" + colorama.Style.NORMAL + " must be at least 1")
+	if arguments.scratch_dir is not None and not os.path.isdir(arguments.scratch_dir):
+		param_errors.append(colorama.Style.BRIGHT + "scratch directory" + colorama.Style.NORMAL + " is not a valid directory")
+	try:
+		min_memory = parse_size(arguments.min_free_memory)
+	except ValueError:
+		param_errors.append(colorama.Style.BRIGHT + "minimum free memory" + colorama.Style.NORMAL + " is not a valid size")
+	if len(param_errors) > 0:
+		print ("Some parameters are inconsistent:")
+		for pe in param_errors:
+			print ("\t- {}".format(pe))
+		sys.exit(3)
+	if arguments.adaptive:
+		loadcontrol.controller = loadcontrol.LoadController(min_memory)
+	stopping = multiprocessing.Event()
+	workers = [multiprocessing.Process(target=_cluster_worker, args=(arguments.coordinator, "{}:{}".format(socket.gethostname(), i), stopping, arguments.scratch_dir, arguments.verbose, arguments.debug))
+		for i in range(arguments.jobs)]
+	for worker in workers:
+		worker.start()
+	signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+	log("Working for {} with {} worker(s)".format(arguments.coordinator, arguments.jobs))
+	while any(worker.is_alive() for worker in workers):
+		for worker in workers:
+			# A timeout keeps signals handled while waiting
+			worker.join(1)
+	if stopping.is_set():
+		log("Stopped, running jobs have been completed or given back")
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: ffmpeg
+
+    :synopsis: Engine that hardsubs a video with a single ffmpeg run, whatever the container is
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from profiles import DEFAULT_PROFILE, PROFILES, ffmpeg_video_options, in_use
+from progress import FfmpegParser
+from utils import which, launch_process_with_progress_bar
+
+# List of required executables on a Linux Box used to accomplish
+# hard subbing
+REQUIRED_EXECUTABLES = {
+	'ffmpeg' : FfmpegParser
+}
+
+verbose = False
+
+debug = False
+
+# Settings of each container on the encoding profile in use
+profile = PROFILES[DEFAULT_PROFILE]
+
+def font_size(scale):
+	"""
+		Convert the mencoder subtitle scale into a font size for the subtitles filter.
+		mencoder scales text on the movie diagonal, libass on a 288 rows high script:
+		on a 16:9 movie the diagonal is about 2.04 times the height.
+		:param scale: Subtitle font scale
+		:type a: int
+		:returns: float -- Font size
+	"""
+	return float(scale) * 288 * 2.04 / 100
+
+def ffmpeg_command(input_file, sub_file, output_file, kind, scale, encoding_settings=None):
+	"""
+		Build the ffmpeg command that decodes, burns subtitles, encodes and muxes a video
+		:param input_file: Name of the file that had to be reencoded
+		:type input_file: str
+		:param sub_file: .srt file with subtitles to burn, its path must not need escaping
+		:type sub_file: str
+		:param output_file: Where to write the hardsubbed video
+		:type output_file: str
+		:param kind: Container of the video
+		:type kind: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param encoding_settings: Settings of the container on an encoding profile, None for the ones in use
+		:type encoding_settings: dict
+		:returns: str -- ffmpeg command
+	"""
+	return '{ffmpeg} -y -nostats -progress pipe:1 -i "{input_file}" -map 0:v:0 -map 0:a? -sn -vf subtitles={sub_file}:force_style=FontSize={font_size:.1f} {video_opts} -c:a copy "{output_file}"'.format(
+		ffmpeg = which('ffmpeg')[0],
+		input_file = input_file,
+		sub_file = sub_file,
+		font_size = font_size(scale),
+		video_opts = ffmpeg_video_options(encoding_settings or in_use(kind, profile[kind])),
+		output_file = output_file
+	)
+
+def hardsub(media, output_dir, scale):
+	"""
+		Hardsub a video and rebuild its container with a single ffmpeg run,
+		audio tracks are copied from the source without reencoding
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+	"""
+	file_name = media.file_name
+	# The subtitles filter needs heavy escaping for paths with special characters:
+	# link the .srt file in a temporary directory with a plain name instead
+	sub_dir = tempfile.mkdtemp(prefix='hs-')
+	try:
+		sub_file = os.path.join(sub_dir, 'subtitles.srt')
+		os.symlink(os.path.abspath(os.path.splitext(file_name)[0] + ".srt"), sub_file)
+		command = ffmpeg_command(file_name, sub_file, output_dir + os.sep + os.path.basename(file_name), media.kind, scale)
+		launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['ffmpeg'], media.frames or sys.maxint, 'Hardsubbing: ', verbose, debug)
+	finally:
+		shutil.rmtree(sub_dir)
+
+def languages_command(input_file, outputs, kind, scale, encoding_settings=None):
+	"""
+		Build the ffmpeg command that decodes a video once and splits its frames in a branch
+		for each subtitle file, each one burning its subtitles, encoding and muxing on its own
+		:param input_file: Name of the file that had to be reencoded
+		:type input_file: str
+		:param outputs: (subtitle file, output file) of each branch, subtitle paths must not need escaping
+		:type outputs: list
+		:param kind: Container of the video
+		:type kind: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param encoding_settings: Settings of the container on an encoding profile, None for the ones in use
+		:type encoding_settings: dict
+		:returns: str -- ffmpeg command
+	"""
+	video_opts = ffmpeg_video_options(encoding_settings or in_use(kind, profile[kind]))
+	graph = ['[0:v:0]split={}{}'.format(len(outputs), ''.join(['[v{}]'.format(i) for i in range(len(outputs))]))]
+	branches = []
+	for i, (sub_file, output_file) in enumerate(outputs):
+		graph.append('[v{i}]subtitles={sub_file}:force_style=FontSize={font_size:.1f}[o{i}]'.format(i=i, sub_file=sub_file, font_size=font_size(scale)))
+		branches.append('-map [o{}] -map 0:a? -sn {} -c:a copy "{}"'.format(i, video_opts, output_file))
+	return '{ffmpeg} -y -nostats -progress pipe:1 -i "{input_file}" -filter_complex "{graph}" {branches}'.format(
+		ffmpeg = which('ffmpeg')[0],
+		input_file = input_file,
+		graph = ';'.join(graph),
+		branches = ' '.join(branches)
+	)
+
+def hardsub_languages(media, outputs, scale):
+	"""
+		Hardsub a video once for each subtitle file with a single ffmpeg run, so the source is decoded only once
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param outputs: (subtitle file, output file) of each hardsubbed video
+		:type outputs: list
+		:param scale: Subtitle font scale
+		:type a: int
+	"""
+	sub_dir = tempfile.mkdtemp(prefix='hs-')
+	try:
+		links = []
+		for i, (sub_file, output_file) in enumerate(outputs):
+			link = os.path.join(sub_dir, 'subtitles_{}.srt'.format(i))
+			os.symlink(os.path.abspath(sub_file), link)
+			links.append((link, output_file))
+		command = languages_command(media.file_name, links, media.kind, scale)
+		launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['ffmpeg'], media.frames or sys.maxint, 'Hardsubbing {} languages: '.format(len(outputs)), verbose, debug)
+	finally:
+		shutil.rmtree(sub_dir)
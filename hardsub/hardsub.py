@@ -7,16 +7,38 @@
 """
 
 import argparse
+import hashlib
+import json
+import multiprocessing
 import os
 import platform
 import re
+import shutil
+import signal
 import subprocess
 import sys
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
 
 import colorama
-import magic
 
-from utils import which
+import batchprogress
+import journal
+import loadcontrol
+import preview
+import profiles
+import report
+import runner
+import scanner
+import smartrender
+import streaming
+from outputcache import OutputCache, parse_size
+from journal import Journal
+from report import BatchReport, JobReport, set_job_report
+from mediainfo import ALLOWED_MAGIC_SIG, MediaInfo, ProbeCache, default_cache_file, get_backend, probe
+from utils import HardsubError, ToolError, which, get_base_file_name, move_file, free_space, ProgressLine, reserve_progress_board, set_progress_output, get_progress_output
 
 __author__ = "Gian Luca Dalla Torre, Luigi Bellagotti"
 __copyright__ = "Copyright 2013, Gian Luca Dalla Torre and Luigi Bellagotti"
@@ -27,14 +49,35 @@ __maintainer__ = "Gian Luca Dalla Torre"
 __email__ = "gianluca.dallatorre@gmail.com"
 __status__ = "Alpha"
 
-# List of magic signatures for video files
-ALLOWED_MAGIC_SIG = {
-	'AVI': 'avi',
-	'MPEG v4': 'mp4',
-	#'ISO Media, MPEG v4 system, version 1': 'mp4',
-	#'ISO Media, MPEG v4 system, version 2': 'mp4',
-	'Matroska': 'matroska' 
-}
+# Name of the directory of job workspaces inside the output directory, when no scratch directory is given
+SCRATCH_DIR = '.hs-scratch'
+
+# Threads that sniff and probe files while scanning a library
+SCAN_THREADS = 8
+
+# Engines that can hardsub a file: mencoder uses the container modules, the others are modules on their own
+ENGINES = ('mencoder', 'ffmpeg')
+
+# Seconds between two updates of the batch progress line, on a terminal and on a log
+BATCH_REFRESH = 2
+BATCH_LOG_REFRESH = 60
+
+# Batch progress and slot of a process of the batch pool
+_batch = None
+_slot = None
+
+class NotEnoughSpace(HardsubError):
+	"""
+		The workspace of a job or the output directory is short of space
+		:param directory: Directory short of space
+		:type directory: str
+		:param file_name: File of the job
+		:type file_name: str
+	"""
+
+	def __init__(self, directory, file_name):
+		HardsubError.__init__(self, "Not enough free space on {} for {}.".format(directory, os.path.basename(file_name)))
+		self.directory = directory
 
 def header():
 	"""
@@ -51,22 +94,35 @@ def check_platform():
 	"""
 	return platform.system() == "Linux"
 
-def check_prerequisites(file_name):
+def check_prerequisites(media, stream=False, engine='mencoder', smart_render=False, preview_only=False):
 	"""
 		Check if all executables required by this script
 		are present on the Linux Box.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param stream: True if the video is streamed into the muxer
+		:type stream: bool
+		:param engine: Engine that hardsubs the file
+		:type engine: str
+		:param smart_render: True if only GOPs with subtitles are reencoded
+		:type smart_render: bool
+		:param preview_only: True if only a preview of the file is made
+		:type preview_only: bool
 		:returns: (Boolean, tuple) -- True if all required executables are present, False otherwhise. Second tuple value contains all missing executables
 	"""
 	missing_executables = []
-	magic_sig = magic.from_file(file_name)
-	kind = None
-	for ms in ALLOWED_MAGIC_SIG:
-		if ms in magic_sig:  
-			kind = ALLOWED_MAGIC_SIG[ms]
-			break
-	if kind is not None:
-		movie_type = __import__('hardsub.'+kind, fromlist=["x"])
-		for executable in movie_type.REQUIRED_EXECUTABLES:
+	if media.kind is not None:
+		movie_type = get_backend(media.kind)
+		executables = movie_type.REQUIRED_EXECUTABLES.keys()
+		if engine != 'mencoder':
+			executables = get_backend(engine).REQUIRED_EXECUTABLES.keys() + [movie_type.PROBE_EXECUTABLE]
+		elif stream:
+			executables = executables + streaming.REQUIRED_EXECUTABLES.keys()
+		if smart_render:
+			executables = executables + smartrender.REQUIRED_EXECUTABLES.keys()
+		if preview_only:
+			executables = executables + preview.REQUIRED_EXECUTABLES.keys()
+		for executable in sorted(set(executables)):
 			if len(which(executable)) == 0:
 				missing_executables.append(executable)
 	return (len(missing_executables) == 0, tuple(missing_executables))
@@ -85,7 +141,29 @@ def build_argument_parser():
 	ap.add_argument("-s", "--subtitle-scale", default=2.5, help="Set the font scale (between 1 and 100)", metavar="<subtitle_scale>")
 	ap.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
 	ap.add_argument("-f", "--force", help="write to output directory even if it is not empty", action="store_true")
+	ap.add_argument("-r", "--recursive", help="look for videos in subdirectories of the source directory too, mirroring them on the output directory", action="store_true")
+	ap.add_argument("-j", "--jobs", default=1, type=int, help="number of files hardsubbed at the same time", metavar="<jobs>")
+	ap.add_argument("--engine", default="mencoder", choices=ENGINES, help="mencoder runs a tool for each stage, ffmpeg hardsubs each file with a single run", metavar="<engine>")
+	ap.add_argument("--profile", default=profiles.DEFAULT_PROFILE, help="encoding profile: fast, balanced, archival or one defined on the profiles file", metavar="<profile>")
+	ap.add_argument("--profile-file", default=profiles.default_config_file(), help="JSON file with user defined encoding profiles", metavar="<profile_file>")
+	ap.add_argument("--threads", type=int, help="encoder threads, 0 to let the encoder choose, overrides the profile", metavar="<threads>")
+	ap.add_argument("--preview", help="only hardsub a few seconds around some subtitles spread across each video and join them in a small <name>.preview file, to check subtitle scale and placement", action="store_true")
+	ap.add_argument("--preview-events", default=preview.DEFAULT_EVENTS, type=int, help="number of subtitles shown by each preview", metavar="<subtitles>")
+	ap.add_argument("--smart-render", help="reencode only the GOPs that show subtitles, copying the others as they are", action="store_true")
+	ap.add_argument("--passthrough", help="take audio tracks straight from the source file instead of extracting them", action="store_true")
+	ap.add_argument("--languages", help="hardsub a video once for each language tagged srt file (e.g. movie.en.srt, movie.it.srt) decoding it only once, needs the ffmpeg engine", action="store_true")
+	ap.add_argument("--stream", help="pipe the hardsubbed video straight into the muxer instead of writing it on the output directory", action="store_true")
+	ap.add_argument("--adaptive", help="start encodes, extractions and muxes according to the CPU, memory and disk load of the host, with -j as the most files at once", action="store_true")
+	ap.add_argument("--min-free-memory", default="1G", help="memory that must be available to start an encode with --adaptive (e.g. 2G)", metavar="<size>")
+	ap.add_argument("--segments", default=1, type=int, help="split each matroska video in segments encoded at the same time", metavar="<segments>")
+	ap.add_argument("--report", help="write wall time, CPU time and I/O of every stage of every file as JSON", metavar="<report_file>")
+	ap.add_argument("--scratch-dir", help="directory where each job writes its intermediate files, e.g. on a fast local disk or a tmpfs", metavar="<scratch_dir>")
+	ap.add_argument("--tool-timeout", default=runner.tool_timeout, type=float, help="seconds a tool may go without printing anything before it is killed as stuck, 0 to wait forever", metavar="<seconds>")
 	ap.add_argument("--debug", help="save stdout and stderr on /tmp/hs.log", action="store_true")
+	ap.add_argument("--cache-dir", help="directory where hardsubbed files are cached, so identical jobs are not encoded again", metavar="<cache_dir>")
+	ap.add_argument("--cache-size", help="maximum size of the cache directory (e.g. 500G), least recently used files are evicted", metavar="<cache_size>")
+	ap.add_argument("--probe-cache", default=default_cache_file(), help="file where probed media information is cached", metavar="<cache_file>")
+	ap.add_argument("--no-probe-cache", help="probe every file again without using the cache", action="store_true")
 	return ap
 
 def check_arguments(args):
@@ -100,93 +178,763 @@ def check_arguments(args):
 		errors.append( colorama.Style.BRIGHT + "output directory" +  colorama.Style.NORMAL + " is not a valid directory");
 	if not os.path.isdir(args['source_dir']):
 		errors.append( colorama.Style.BRIGHT + "source directory" +  colorama.Style.NORMAL + " is not a valid directory");
+	if args['jobs'] < 1:
+		errors.append( colorama.Style.BRIGHT + "jobs" +  colorama.Style.NORMAL + " must be at least 1");
+	if args['segments'] < 1:
+		errors.append( colorama.Style.BRIGHT + "segments" +  colorama.Style.NORMAL + " must be at least 1");
+	if args['scratch_dir'] is not None and not os.path.isdir(args['scratch_dir']):
+		errors.append( colorama.Style.BRIGHT + "scratch directory" +  colorama.Style.NORMAL + " is not a valid directory");
+	if args['preview_events'] < 1:
+		errors.append( colorama.Style.BRIGHT + "preview events" +  colorama.Style.NORMAL + " must show at least 1 subtitle");
+	if args['tool_timeout'] < 0:
+		errors.append( colorama.Style.BRIGHT + "tool timeout" +  colorama.Style.NORMAL + " cannot be negative");
+	if args['threads'] is not None and args['threads'] < 0:
+		errors.append( colorama.Style.BRIGHT + "threads" +  colorama.Style.NORMAL + " cannot be negative");
+	try:
+		profiles.get_profile(args['profile'], args['profile_file'])
+	except ValueError as e:
+		errors.append( colorama.Style.BRIGHT + "profile" +  colorama.Style.NORMAL + " is not valid: {}".format(e));
+	if args['cache_size'] is not None:
+		try:
+			parse_size(args['cache_size'])
+		except ValueError:
+			errors.append( colorama.Style.BRIGHT + "cache size" +  colorama.Style.NORMAL + " is not a valid size");
+	try:
+		parse_size(args['min_free_memory'])
+	except ValueError:
+		errors.append( colorama.Style.BRIGHT + "minimum free memory" +  colorama.Style.NORMAL + " is not a valid size");
+	if args['segments'] > 1 and args['stream']:
+		errors.append( colorama.Style.BRIGHT + "segments" +  colorama.Style.NORMAL + " cannot be used with " + colorama.Style.BRIGHT + "stream" +  colorama.Style.NORMAL);
+	if args['smart_render'] and (args['segments'] > 1 or args['stream'] or args['engine'] != 'mencoder'):
+		errors.append( colorama.Style.BRIGHT + "smart render" +  colorama.Style.NORMAL + " cannot be used with segments, stream or engines other than mencoder");
+	if args['engine'] != 'mencoder' and (args['segments'] > 1 or args['stream']):
+		errors.append( colorama.Style.BRIGHT + "segments" +  colorama.Style.NORMAL + " and " + colorama.Style.BRIGHT + "stream" +  colorama.Style.NORMAL + " can only be used with the mencoder engine");
+	if args['languages'] and args['engine'] != 'ffmpeg':
+		errors.append( colorama.Style.BRIGHT + "languages" +  colorama.Style.NORMAL + " can only be used with the ffmpeg engine");
 	return (len(errors) == 0, errors)
 
-def find_candidates(directory):
+def find_candidates(directory, cache=None, recursive=False, languages=False):
 	"""
-		Find all video container file that have an srt associated for hardsubbing
+		Find all video container file that have an srt associated for hardsubbing.
+		Files are paired with their srt by name first, then only paired files are
+		sniffed and probed, on a pool of threads.
 		:param directory: Directory where to find candidates
 		:type directory: str
-		:returns: list -- list of file that hat to be hardsubbed
-	"""
-	candidates = {}
-	for f in os.listdir(directory):
-		if os.path.isfile(directory + os.sep + f):
-			for m in ALLOWED_MAGIC_SIG:
-				if m in magic.from_file(directory + os.sep + f):
-					candidates[directory + os.sep + f] = ALLOWED_MAGIC_SIG[m]
-	# Check if there is a srt companion file, if not, remove element from candidates
+		:param cache: Cache of probed files
+		:type cache: ProbeCache
+		:param recursive: True to look into subdirectories too
+		:type recursive: bool
+		:param languages: True to pair videos with language tagged srt files too
+		:type languages: bool
+		:returns: list -- MediaInfo of each file that has to be hardsubbed, sorted by file name
+	"""
+	paired = scanner.scan(directory, recursive, languages)
 	final_candidates = []
-	for f in candidates:
-		sub_file = os.path.splitext(f)[0] + ".srt"
-		if os.path.isfile(sub_file):
-			movie_type = __import__('hardsub.'+candidates[f], fromlist=["x"])
-			if movie_type.check_video(f):
-				final_candidates.append(f)
-	final_candidates.sort()
+	if len(paired) > 0:
+		pool = ThreadPool(min(SCAN_THREADS, len(paired)))
+		try:
+			probed = pool.map(lambda file_name: probe(file_name, cache), paired)
+		finally:
+			pool.close()
+			pool.join()
+		final_candidates = [media for media in probed if media.kind is not None and media.has_video]
+	if cache is not None:
+		cache.save()
+	final_candidates.sort(key=lambda m: m.file_name)
 	return final_candidates
 
-def extract_audio(file_name, output_dir, verbose=False, debug=False):
+def job_output_dir(media, output_dir, source_dir=None):
+	"""
+		Get where the hardsubbed file of a job is placed: when a library is scanned
+		recursively, its tree is mirrored on the output directory
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Output directory of the batch
+		:type output_dir: str
+		:param source_dir: Root of the scanned library, None if it has not been scanned recursively
+		:type source_dir: str
+		:returns: str -- Output directory of the job
+	"""
+	if source_dir is None:
+		return output_dir
+	relative_dir = os.path.relpath(os.path.dirname(media.file_name), os.path.abspath(source_dir))
+	return os.path.normpath(os.path.join(output_dir, relative_dir))
+
+def job_output_names(media, languages=False):
+	"""
+		Get the subtitles of a job and the name of the hardsubbed file made with each of them
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param languages: True to make a file for each language tagged srt file too
+		:type languages: bool
+		:returns: list -- (subtitle file, output file name), <name>.<tag><extension> for language tagged subtitles
+	"""
+	stem, extension = os.path.splitext(media.file_name)
+	if not languages:
+		return [(stem + scanner.SUBTITLE_EXTENSION, os.path.basename(media.file_name))]
+	names = []
+	for tag, sub_file in scanner.subtitle_files(stem, languages):
+		if tag is None:
+			names.append((sub_file, os.path.basename(media.file_name)))
+		else:
+			names.append((sub_file, "{}.{}{}".format(os.path.basename(stem), tag, extension)))
+	return names
+
+def _prepare_backend(media, verbose, debug):
+	"""
+		Get the container module of a file, configured for the current run
+	"""
+	movie_type = get_backend(media.kind)
+	movie_type.verbose = verbose
+	movie_type.debug = debug
+	return movie_type
+
+def extract_audio(media, output_dir, verbose=False, debug=False):
 	"""
 		Extract all audio tracks from a container
-		:param filename: Name of the file that contains audio track
-		:type filename: str 
+		:param media: File that contains audio track
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw audio track
 		:type output_dir: str	
 	"""
-	magic_sig = magic.from_file(file_name)
-	kind = None
-	for ms in ALLOWED_MAGIC_SIG:
-		if ms in magic_sig:  
-			kind = ALLOWED_MAGIC_SIG[ms]
-			break
-	if kind is not None:
-		movie_type = __import__('hardsub.'+kind, fromlist=["x"])
-		movie_type.verbose = verbose
-		movie_type.debug = debug
-		movie_type.extract_audio(file_name, output_dir)
+	if media.kind is not None:
+		_prepare_backend(media, verbose, debug).extract_audio(media, output_dir)
 
-def hardsub_video(file_name, output_dir, scale, verbose=False, debug=False):
+def hardsub_video(media, output_dir, scale, verbose=False, debug=False, segments=1, smart_render=False):
 	"""
 		Hardsub a video reencoding it using a .srt file for Subititles
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw hardsubbed video
 		:type output_dir: str
 		:param scale: Subtitle font scale
 		:type a: int
+		:param segments: Number of segments encoded at the same time, if supported by the container
+		:type segments: int
+		:param smart_render: Reencode only the GOPs that show subtitles, when the source codec allows it
+		:type smart_render: bool
 	"""
-	magic_sig = magic.from_file(file_name)
-	kind = None
-	for ms in ALLOWED_MAGIC_SIG:
-		if ms in magic_sig:  
-			kind = ALLOWED_MAGIC_SIG[ms]
-			break
-	if kind is not None:
-		movie_type = __import__('hardsub.'+kind, fromlist=["x"])
-		movie_type.verbose = verbose
-		movie_type.debug = debug
-		movie_type.hardsub_video(file_name, output_dir, scale)
+	if media.kind is not None:
+		movie_type = _prepare_backend(media, verbose, debug)
+		if smart_render:
+			smartrender.verbose = verbose
+			smartrender.debug = debug
+			if smartrender.smart_render_video(media, output_dir, scale):
+				return
+		if segments > 1 and hasattr(movie_type, 'hardsub_video_segmented'):
+			movie_type.hardsub_video_segmented(media, output_dir, scale, segments)
+		else:
+			movie_type.hardsub_video(media, output_dir, scale)
 
-def build_final_file(file_name, output_dir, verbose=False, debug=False):
+def build_final_file(media, output_dir, verbose=False, debug=False, passthrough=False):
 	"""
 		Rebuild the container for source file with hardsubbed video track
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw hardsubbed video
 		:type output_dir: str
+		:param passthrough: Take audio tracks straight from the source file instead of the extracted ones
+		:type passthrough: bool
 	"""
-	magic_sig = magic.from_file(file_name)
-	kind = None
-	for ms in ALLOWED_MAGIC_SIG:
-		if ms in magic_sig:  
-			kind = ALLOWED_MAGIC_SIG[ms]
-			break
-	if kind is not None:
-		movie_type = __import__('hardsub.'+kind, fromlist=["x"])
+	if media.kind is not None:
+		_prepare_backend(media, verbose, debug).mux_audio_video(media, output_dir, passthrough)
+
+def stream_video(media, output_dir, scale, verbose=False, debug=False, passthrough=False):
+	"""
+		Hardsub a video piping it straight into the muxer that rebuilds the container
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param passthrough: Take audio tracks straight from the source file instead of the extracted ones
+		:type passthrough: bool
+	"""
+	if media.kind is not None:
+		streaming.verbose = verbose
+		streaming.debug = debug
+		streaming.stream_video(media, _prepare_backend(media, verbose, debug), output_dir, scale, passthrough)
+
+def hardsub_with_engine(media, output_dir, scale, engine, verbose=False, debug=False):
+	"""
+		Hardsub a video and rebuild its container with an engine that does every stage at once
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param engine: Name of the engine module
+		:type engine: str
+	"""
+	if media.kind is not None:
+		movie_type = get_backend(engine)
 		movie_type.verbose = verbose
 		movie_type.debug = debug
-		movie_type.mux_audio_video(file_name, output_dir)
+		movie_type.hardsub(media, output_dir, scale)
+
+def hardsub_languages(media, outputs, scale, engine, verbose=False, debug=False):
+	"""
+		Hardsub a video once for each of its subtitle files, decoding it only once
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param outputs: (subtitle file, output file) of each hardsubbed video
+		:type outputs: list
+		:param scale: Subtitle font scale
+		:type a: int
+		:param engine: Name of the engine module
+		:type engine: str
+	"""
+	if media.kind is not None:
+		movie_type = get_backend(engine)
+		movie_type.verbose = verbose
+		movie_type.debug = debug
+		movie_type.hardsub_languages(media, outputs, scale)
+
+def use_profile(profile):
+	"""
+		Make every container module and engine encode with the settings of a profile
+		:param profile: Settings of each container, see profiles.get_profile
+		:type profile: dict
+	"""
+	for kind in profiles.CONTAINER_CODECS:
+		get_backend(kind).encoding = profile[kind]
+	for engine in ENGINES:
+		if engine != 'mencoder':
+			get_backend(engine).profile = profile
+
+def rows_per_job(segments=1):
+	"""
+		Get how many rows of the progress board are used by each file:
+		one for each video segment and one for audio extraction
+		:param segments: Number of segments encoded at the same time
+		:type segments: int
+		:returns: int -- Number of rows
+	"""
+	return segments + 1
+
+def _run_stage(stage, args, progress_output, context, errors):
+	"""
+		Run an I/O bound stage of the pipeline on a separate thread, keeping track of its failure
+		:param stage: Function that implements the stage
+		:param args: Arguments of the stage
+		:type args: tuple
+		:param progress_output: Where the progress bars of the stage are drawn
+		:param context: Report context of the job, see report.get_context
+		:type context: tuple
+		:param errors: List where the exception info of a failed stage is appended
+		:type errors: list
+	"""
+	set_progress_output(progress_output)
+	report.set_context(context)
+	try:
+		with loadcontrol.stage(loadcontrol.IO), report.stage(stage.__name__):
+			stage(*args)
+	except (SystemExit, Exception):
+		errors.append(sys.exc_info())
+		# The job is lost, do not let the other stages run to their end
+		runner.cancel_all()
+
+def job_settings(scale, segments=1, stream=False, passthrough=False, engine='mencoder', smart_render=False, profile=None, languages=False):
+	"""
+		Get the settings of a job that affect its output, used to fingerprint it
+		:returns: dict -- Settings of the job
+	"""
+	if profile is None:
+		profile = profiles.PROFILES[profiles.DEFAULT_PROFILE]
+	settings = {'scale': str(scale), 'segments': segments, 'stream': stream, 'passthrough': passthrough, 'engine': engine, 'smart_render': smart_render, 'profile': profile}
+	if languages:
+		# Only when set, so jobs journaled before it existed keep their fingerprint
+		settings['languages'] = True
+	return settings
+
+def encoder_settings(media, settings):
+	"""
+		Describe everything that affects the encoded output of a job
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param settings: Settings of the job, see job_settings
+		:type settings: dict
+		:returns: str -- Description of the encoder settings
+	"""
+	if settings['engine'] == 'mencoder':
+		command = get_backend(media.kind).mencoder_command('', '', '', settings['scale'], encoding_settings=settings['profile'][media.kind])
+		if settings['smart_render']:
+			# Ranges that show subtitles are encoded by ffmpeg with the codec of the source, whatever it is;
+			# sources that cannot be smart rendered fall back to mencoder
+			command = ' '.join([command] + [profiles.ffmpeg_video_options(smartrender.range_encoding(media.kind, codec, settings['profile'])) for codec in sorted(smartrender.SOURCE_CODECS)])
+	else:
+		command = get_backend(settings['engine']).ffmpeg_command('', '', '', media.kind, settings['scale'], settings['profile'][media.kind])
+	return json.dumps([media.kind, command, sorted(settings.items())])
+
+def _has_outputs(media, output_dir, stage, work_dir=None, languages=False):
+	"""
+		Check if the files written by a stage are still there
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where hardsubbed files are placed
+		:type output_dir: str
+		:param stage: Completed stage
+		:type stage: str
+		:param work_dir: Directory where intermediate files are placed, None if they are on the output directory
+		:type work_dir: str
+		:param languages: True if a file is made for each language tagged srt file too
+		:type languages: bool
+		:returns: boolean -- True if the files of the stage are there
+	"""
+	base_file_name = get_base_file_name(media.file_name)
+	if stage == journal.MUXED:
+		return all([os.path.isfile(output_dir + os.sep + name) for sub_file, name in job_output_names(media, languages)])
+	work_dir = work_dir or output_dir
+	if not os.path.isdir(work_dir):
+		return False
+	if stage == journal.ENCODED:
+		return os.path.isfile(work_dir + os.sep + base_file_name + '.' + get_backend(media.kind).VIDEO_EXTENSION)
+	audio_files = [f for f in os.listdir(work_dir) if re.match(re.escape(base_file_name) + r'_\d+\.(aac|audio)$', f)]
+	return len(audio_files) == len(media.audio_tracks)
+
+def completed_stages(media, output_dir, resume, settings, work_dir=None):
+	"""
+		Get the stages of a job completed by a previous run, whose files are still there
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param resume: Journal of the batch
+		:type resume: Journal
+		:param settings: Settings of the job, see job_settings
+		:type settings: dict
+		:param work_dir: Workspace of the job, None if intermediate files are on the output directory
+		:type work_dir: str
+		:returns: (str, list) -- Fingerprint of the job and completed stages
+	"""
+	fingerprint = resume.fingerprint(media, settings)
+	return (fingerprint, [s for s in resume.stages(media, fingerprint) if _has_outputs(media, output_dir, s, work_dir, settings.get('languages', False))])
+
+def job_work_dir(media, output_dir, scratch_dir=None):
+	"""
+		Get the private workspace of a job. It does not change between runs,
+		so an interrupted job finds its intermediate files again.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param scratch_dir: Directory of job workspaces, None to keep them on the output directory
+		:type scratch_dir: str
+		:returns: str -- Workspace of the job
+	"""
+	if scratch_dir is None:
+		scratch_dir = os.path.join(output_dir, SCRATCH_DIR)
+	digest = hashlib.sha1(os.path.abspath(media.file_name)).hexdigest()[:8]
+	return os.path.join(scratch_dir, "{}-{}".format(get_base_file_name(media.file_name), digest))
+
+def estimate_scratch_size(media, segments=1, stream=False, passthrough=False, engine='mencoder', outputs=1):
+	"""
+		Estimate the space taken by the intermediate files of a job, final containers
+		included. Hardsubbed tracks are supposed as big as the source, audio tracks a
+		tenth of it.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param outputs: Number of hardsubbed files made by the job
+		:type outputs: int
+		:returns: int -- Estimated bytes
+	"""
+	size = media.size * outputs
+	if engine == 'mencoder':
+		if not stream:
+			size = size + media.size
+		if segments > 1:
+			# Split source and hardsubbed segments
+			size = size + 2 * media.size
+		if not passthrough:
+			size = size + media.size / 10
+	return size
+
+def check_free_space(media, output_dir, work_dir, needed):
+	"""
+		Check that the workspace of a job and the output directory have room for it
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param work_dir: Workspace of the job
+		:type work_dir: str
+		:param needed: Bytes needed on the workspace, see estimate_scratch_size
+		:type needed: int
+		:returns: (boolean, str) -- True if there is enough space, otherwise False and the directory short of it
+	"""
+	if free_space(work_dir) < needed:
+		return (False, work_dir)
+	# A final container on another file system is copied to the output directory
+	if os.stat(work_dir).st_dev != os.stat(output_dir).st_dev and free_space(output_dir) < media.size:
+		return (False, output_dir)
+	return (True, None)
+
+def run_job(media, output_dir, scale, verbose=False, debug=False, segments=1, stream=False, passthrough=False, engine='mencoder', smart_render=False, profile=None, scratch_dir=None, source_dir=None, resume=None, cache=None, languages=False):
+	"""
+		Run every stage needed to hardsub a single file.
+		Audio tracks are extracted while the video is being encoded, the
+		container is rebuilt once both stages are over. When streaming,
+		audio tracks are extracted first and the video is muxed while it
+		is being encoded. With passthrough, audio tracks are not extracted
+		at all and the muxer takes them from the source file. Engines
+		other than mencoder do everything at once. With languages, the
+		video is decoded once and hardsubbed with each of its subtitle
+		files, every language on its own file; those jobs skip the cache.
+		Intermediate files are written on a private workspace of the job,
+		only the final container is moved on the output directory. The job
+		does not start if the workspace is short of space.
+		Completed stages are recorded on the journal, stages already
+		completed by a previous run of the same job are skipped. When the
+		same job is found on the output cache, nothing is encoded at all.
+		The progress output of the calling thread must be a ProgressLine 
+		followed by the free rows stated by rows_per_job.
+		Failures raise NotEnoughSpace or ToolError. Encoders use the profile
+		of the job context of the calling thread, if any, or the one set by
+		use_profile; tools are supervised as stated by runner.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param segments: Number of segments encoded at the same time, if supported by the container
+		:type segments: int
+		:param stream: True to pipe the video straight into the muxer
+		:type stream: bool
+		:param passthrough: True to take audio tracks straight from the source file
+		:type passthrough: bool
+		:param engine: Engine that hardsubs the file
+		:type engine: str
+		:param smart_render: True to reencode only the GOPs that show subtitles
+		:type smart_render: bool
+		:param profile: Encoding profile the job is fingerprinted with, see profiles.get_profile, None for the default one
+		:type profile: dict
+		:param scratch_dir: Directory of job workspaces, None to keep them on the output directory
+		:type scratch_dir: str
+		:param source_dir: Root of the library scanned recursively, whose tree is mirrored on the output directory
+		:type source_dir: str
+		:param resume: Journal of the batch, None to run every stage
+		:type resume: Journal
+		:param cache: Cache of hardsubbed files, None to always encode
+		:type cache: OutputCache
+		:param languages: True to make a file for each language tagged srt file too, see job_output_names
+		:type languages: bool
+	"""
+	completed = []
+	settings = job_settings(scale, segments, stream, passthrough, engine, smart_render, profile, languages)
+	work_dir = job_work_dir(media, output_dir, scratch_dir)
+	output_dir = job_output_dir(media, output_dir, source_dir)
+	if resume is not None:
+		fingerprint, completed = completed_stages(media, output_dir, resume, settings, work_dir)
+		mark = lambda stage: resume.mark(media, fingerprint, stage)
+	else:
+		mark = lambda stage: None
+	if journal.MUXED in completed:
+		return
+	output_file = output_dir + os.sep + os.path.basename(media.file_name)
+	output_names = job_output_names(media, languages)
+	if languages:
+		# The cache keeps a single file for each job
+		cache = None
+	# With -r the output directory of the job is a mirrored subdirectory, new on a fresh tree
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	if cache is not None:
+		cache_key = cache.key(media, encoder_settings(media, settings))
+		with report.stage('cache_fetch'):
+			fetched = cache.fetch(cache_key, output_file)
+		if fetched:
+			mark(journal.MUXED)
+			return
+	if not os.path.isdir(work_dir):
+		os.makedirs(work_dir)
+	enough_space, short_dir = check_free_space(media, output_dir, work_dir, estimate_scratch_size(media, segments, stream, passthrough, engine, len(output_names)))
+	if not enough_space:
+		raise NotEnoughSpace(short_dir, media.file_name)
+	errors = []
+	if languages:
+		with loadcontrol.stage(loadcontrol.CPU), report.stage('hardsub_languages'):
+			hardsub_languages(media, [(sub_file, work_dir + os.sep + name) for sub_file, name in output_names], scale, engine, verbose, debug)
+	elif engine != 'mencoder':
+		with loadcontrol.stage(loadcontrol.CPU), report.stage('hardsub_with_engine'):
+			hardsub_with_engine(media, work_dir, scale, engine, verbose, debug)
+	elif stream:
+		if not passthrough and journal.AUDIO_EXTRACTED not in completed:
+			with loadcontrol.stage(loadcontrol.IO), report.stage('extract_audio'):
+				extract_audio(media, work_dir, verbose, debug)
+			mark(journal.AUDIO_EXTRACTED)
+		with loadcontrol.stage(loadcontrol.CPU), report.stage('stream_video'):
+			stream_video(media, work_dir, scale, verbose, debug, passthrough)
+	else:
+		audio = threading.Thread(target=_run_stage, args=(extract_audio, (media, work_dir, verbose, debug), get_progress_output().next_row(segments), report.get_context(), errors))
+		if not passthrough and journal.AUDIO_EXTRACTED not in completed:
+			audio.start()
+		try:
+			if journal.ENCODED not in completed:
+				with loadcontrol.stage(loadcontrol.CPU), report.stage('hardsub_video'):
+					hardsub_video(media, work_dir, scale, verbose, debug, segments, smart_render)
+				mark(journal.ENCODED)
+		except BaseException:
+			# Stop extracting audio instead of waiting for it
+			runner.cancel_all()
+			raise
+		finally:
+			if audio.is_alive():
+				audio.join()
+		if len(errors) > 0:
+			raise errors[0][0], errors[0][1], errors[0][2]
+		if audio.ident is not None:
+			mark(journal.AUDIO_EXTRACTED)
+		with loadcontrol.stage(loadcontrol.IO), report.stage('mux_audio_video'):
+			build_final_file(media, work_dir, verbose, debug, passthrough)
+	for sub_file, name in output_names:
+		move_file(work_dir + os.sep + name, output_dir + os.sep + name)
+	shutil.rmtree(work_dir)
+	mark(journal.MUXED)
+	if cache is not None and os.path.isfile(output_file):
+		cache.store(cache_key, output_file)
+
+def hardsub_file(media, output_dir, scale, verbose=False, debug=False, segments=1, stream=False, passthrough=False, engine='mencoder', smart_render=False, profile=None, scratch_dir=None, source_dir=None, resume=None, cache=None, tool_timeout=None, languages=False):
+	"""
+		Hardsub a single file with run_job, configuring the whole process for it, and print why it failed, if it does
+		:param profile: Encoding profile, see profiles.get_profile, None for the default one
+		:type profile: dict
+		:param tool_timeout: Seconds a tool may go without printing anything, 0 to wait forever, None to keep runner.tool_timeout
+		:type tool_timeout: float
+		:returns: boolean -- True if the file has been hardsubbed, False otherwise
+	"""
+	if profile is not None:
+		use_profile(profile)
+	if tool_timeout is not None:
+		runner.tool_timeout = tool_timeout or None
+	# Tools of the previous job may have been cancelled
+	runner.reset()
+	try:
+		run_job(media, output_dir, scale, verbose, debug, segments, stream, passthrough, engine, smart_render, profile, scratch_dir, source_dir, resume, cache, languages)
+	except NotEnoughSpace as e:
+		print (colorama.Fore.RED + "{}".format(e) + colorama.Fore.RESET)
+		return False
+	except ToolError as e:
+		print (colorama.Fore.RED + "Error in execution of command: {}. ".format(e) + colorama.Fore.RESET + "Try again with -v switch to see the executed command.")
+		return False
+	return True
+
+def _init_worker(slots, lock, rows, job_rows, batch):
+	"""
+		Initialize a process of the batch pool, giving it its own progress line and slot on the batch progress
+	"""
+	global _batch, _slot
+	# Ctrl-C is handled by the parent process, which terminates the pool
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	_batch = batch
+	_slot = slots.get()
+	batchprogress.track(_batch, _slot)
+	set_progress_output(ProgressLine(_slot * job_rows, rows, lock))
+
+def _hardsub_worker(job):
+	"""
+		Hardsub a file inside a process of the batch pool
+		:param job: MediaInfo, output directory, subtitle scale and keyword arguments of hardsub_file
+		:type job: tuple
+		:returns: (str, boolean, float, dict) -- file name, True if it has been hardsubbed, elapsed seconds and report of the job
+	"""
+	media, output_dir, scale, options = job
+	get_progress_output().prefix = "{:<24.24} ".format(os.path.basename(media.file_name))
+	job_report = JobReport(media.file_name)
+	set_job_report(job_report)
+	_batch.start_job(_slot, media)
+	try:
+		done = hardsub_file(media, output_dir, scale, **options)
+	finally:
+		_batch.end_job(_slot)
+	job_report.finish()
+	return (media.file_name, done, job_report.wall, job_report.to_dict())
+
+def _show_batch_progress(batch, output, stop):
+	"""
+		Draw the progress of the whole batch until stop is set
+		:param batch: Progress of the batch
+		:type batch: BatchProgress
+		:param output: Where the batch progress line is drawn
+		:param stop: Event set when the batch is over
+		:type stop: threading.Event
+	"""
+	refresh = BATCH_REFRESH if sys.stderr.isatty() else BATCH_LOG_REFRESH
+	while not stop.wait(refresh):
+		output.write(batch.describe())
+
+def hardsub_batch(files, output_dir, scale, jobs, **options):
+	"""
+		Hardsub many files at once using a pool of processes. The longest files
+		start first and a line below the board shows the progress of the batch.
+		:param files: MediaInfo of the files that had to be reencoded
+		:type files: list
+		:param output_dir: Directory where to place hardsubbed videos
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param jobs: Number of files hardsubbed at the same time
+		:type jobs: int
+		:param options: Keyword arguments of hardsub_file, applied to every file
+		:returns: list -- (file name, done, elapsed seconds, job report) for every file
+	"""
+	jobs = min(jobs, len(files))
+	files = batchprogress.longest_first(files)
+	slots = multiprocessing.Queue()
+	for slot in range(jobs):
+		slots.put(slot)
+	job_rows = rows_per_job(options.get('segments', 1))
+	rows = jobs * job_rows + 1
+	reserve_progress_board(rows)
+	lock = multiprocessing.Lock()
+	batch = batchprogress.BatchProgress(files, jobs)
+	pool = multiprocessing.Pool(jobs, _init_worker, (slots, lock, rows, job_rows, batch))
+	stop = threading.Event()
+	batch_line = threading.Thread(target=_show_batch_progress, args=(batch, ProgressLine(rows - 1, rows, lock), stop))
+	batch_line.daemon = True
+	batch_line.start()
+	by_name = dict([(f.file_name, f) for f in files])
+	results = []
+	try:
+		for result in pool.imap_unordered(_hardsub_worker, [(f, output_dir, scale, options) for f in files]):
+			batch.job_done(by_name[result[0]])
+			results.append(result)
+		pool.close()
+	except KeyboardInterrupt:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+		stop.set()
+		# Do not let a late batch line be drawn on whatever comes next
+		batch_line.join()
+	return results
+
+def preview_files(files, output_dir, scale, events, engine='mencoder', source_dir=None, languages=False, verbose=False, debug=False):
+	"""
+		Make a preview of each file instead of hardsubbing it, next to where its hardsubbed file would be placed
+		:param files: MediaInfo of the files that had to be reencoded
+		:type files: list
+		:param output_dir: Directory where to place previews
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param events: Number of subtitles shown by each preview
+		:type events: int
+		:param engine: Engine that hardsubs the files
+		:type engine: str
+		:param source_dir: Root of the library scanned recursively, whose tree is mirrored on the output directory
+		:type source_dir: str
+		:param languages: True to make a preview for each language tagged srt file too
+		:type languages: bool
+		:returns: list -- (file name, done, elapsed seconds, job report) for every file
+	"""
+	preview.verbose = verbose
+	preview.debug = debug
+	results = []
+	for f in files:
+		print ("\nPreview of " + colorama.Fore.GREEN + colorama.Style.BRIGHT + "{}".format(os.path.basename(f.file_name)) + colorama.Style.NORMAL + colorama.Fore.RESET + ".")
+		print ("")
+		reserve_progress_board(1)
+		set_progress_output(ProgressLine(0, 1, threading.Lock()))
+		job_report = JobReport(f.file_name)
+		set_job_report(job_report)
+		job_dir = job_output_dir(f, output_dir, source_dir)
+		if not os.path.isdir(job_dir):
+			os.makedirs(job_dir)
+		done = True
+		try:
+			for sub_file, name in job_output_names(f, languages):
+				with report.stage('preview'):
+					if not preview.make_preview(f, sub_file, os.path.join(job_dir, preview.preview_name(name)), scale, events, engine):
+						print (colorama.Fore.RED + "{} has no subtitle to show.".format(os.path.basename(sub_file)) + colorama.Fore.RESET)
+						done = False
+		except ToolError as e:
+			print (colorama.Fore.RED + "Error in execution of command: {}. ".format(e) + colorama.Fore.RESET + "Try again with -v switch to see the executed command.")
+			done = False
+		job_report.finish()
+		results.append((f.file_name, done, job_report.wall, job_report.to_dict()))
+	return results
+
+def print_summary(results, elapsed):
+	"""
+		Print the outcome of a batch
+		:param results: (file name, done, elapsed seconds, job report) for every processed file
+		:type results: list
+		:param elapsed: Seconds taken by the whole batch
+		:type elapsed: float
+	"""
+	print ("\n" + colorama.Style.BRIGHT + "Summary" + colorama.Style.NORMAL)
+	for file_name, done, seconds, job_report in sorted(results):
+		if done:
+			outcome = colorama.Fore.GREEN + "done" + colorama.Fore.RESET
+		else:
+			outcome = colorama.Fore.RED + "failed" + colorama.Fore.RESET
+		print ("\t- {} {} in {}".format(os.path.basename(file_name), outcome, time.strftime("%H:%M:%S", time.gmtime(seconds))))
+	failed = len([r for r in results if not r[1]])
+	print ("{} file(s) hardsubbed, {} failed in {}.".format(len(results) - failed, failed, time.strftime("%H:%M:%S", time.gmtime(elapsed))))
+
+def build_file_options(arguments):
+	"""
+		Build the keyword arguments of hardsub_file out of the script parameters
+		:param arguments: Parsed script parameters
+		:type arguments: Namespace
+		:returns: dict -- Keyword arguments of hardsub_file
+	"""
+	file_options = {
+		'verbose': arguments.verbose,
+		'debug': arguments.debug,
+		'segments': arguments.segments,
+		'stream': arguments.stream,
+		'passthrough': arguments.passthrough,
+		'engine': arguments.engine,
+		'smart_render': arguments.smart_render,
+		'profile': profiles.get_profile(arguments.profile, arguments.profile_file, arguments.threads),
+		'scratch_dir': arguments.scratch_dir,
+		'source_dir': arguments.source_dir if arguments.recursive else None,
+		'resume': Journal(arguments.output),
+		'cache': None,
+		'tool_timeout': arguments.tool_timeout,
+		'languages': arguments.languages
+	}
+	if arguments.cache_dir is not None:
+		file_options['cache'] = OutputCache(arguments.cache_dir, None if arguments.cache_size is None else parse_size(arguments.cache_size))
+	return file_options
+
+def check_output_dir(arguments):
+	"""
+		Quit unless the output directory is empty, -f was specified or it holds the journal of a previous run
+		:param arguments: Parsed script parameters
+		:type arguments: Namespace
+	"""
+	if os.listdir(arguments.output) == [] or arguments.force or Journal.exists(arguments.output):
+		if Journal.exists(arguments.output):
+			print "Output directory holds the journal of a previous run. Completed stages will be skipped"
+		elif os.listdir(arguments.output) != [] and arguments.verbose :
+			print "Output directory not empty. Proceeding because -f was specified"
+	else :
+		print (colorama.Style.BRIGHT + "The output directory is not empty." + colorama.Style.NORMAL + 
+			" If you still want to proceed use the " + colorama.Style.BRIGHT + "-f" + colorama.Style.NORMAL + " parameter")
+		sys.exit(5)
+
+def skip_completed(files, arguments, file_options):
+	"""
+		Leave out the files hardsubbed by a previous run, as recorded on the journal
+		:param files: MediaInfo of the files that had to be reencoded
+		:type files: list
+		:param arguments: Parsed script parameters
+		:type arguments: Namespace
+		:param file_options: Keyword arguments of hardsub_file
+		:type file_options: dict
+		:returns: list -- MediaInfo of the files still to hardsub
+	"""
+	settings = job_settings(arguments.subtitle_scale, arguments.segments, arguments.stream, arguments.passthrough, arguments.engine, arguments.smart_render, file_options['profile'], arguments.languages)
+	already_done = [f for f in files if journal.MUXED in completed_stages(f, job_output_dir(f, arguments.output, file_options['source_dir']), file_options['resume'], settings)[1]]
+	if len(already_done) > 0:
+		print ("\n{} file(s) already hardsubbed by a previous run will be skipped.".format(len(already_done)))
+	return [f for f in files if f not in already_done]
 
 def hardsub_main():
 	"""
@@ -198,6 +946,18 @@ def hardsub_main():
 	if not check_platform():
 		print ("Sorry but, for now, only" + colorama.Style.BRIGHT + " Linux " + colorama.Style.NORMAL + "platform is supported.")
 		sys.exit(1)
+	if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+		import watch
+		watch.watch_main(sys.argv[2:])
+		return
+	if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+		import cluster
+		cluster.serve_main(sys.argv[2:])
+		return
+	if len(sys.argv) > 1 and sys.argv[1] == 'work':
+		import cluster
+		cluster.work_main(sys.argv[2:])
+		return
 	# Check for script parameters
 	ap = build_argument_parser()
 	arguments = ap.parse_args(sys.argv[1:])
@@ -207,36 +967,91 @@ def hardsub_main():
 		for pe in param_errors:
 			print ("\t- {}".format(pe) );
 		sys.exit(3)
-	# Check if dest dir is empty or force was specified
-	if os.listdir(arguments.output) == [] or arguments.force :
-		if os.listdir(arguments.output) != [] and arguments.verbose :
-			print "Output directory not empty. Proceeding because -f was specified"
-	else :
-		print (colorama.Style.BRIGHT + "The output directory is not empty." + colorama.Style.NORMAL + 
-			" If you still want to proceed use the " + colorama.Style.BRIGHT + "-f" + colorama.Style.NORMAL + " parameter")
-		sys.exit(5)
+	if not arguments.preview:
+		# Previews never overwrite hardsubbed files
+		check_output_dir(arguments)
+	runner.tool_timeout = arguments.tool_timeout or None
 	# Get Files to hardsub
-	files_to_hardsub = find_candidates(arguments.source_dir)
+	batch_report = BatchReport()
+	cache = None if arguments.no_probe_cache else ProbeCache(arguments.probe_cache)
+	with batch_report.stage('probe'):
+		files_to_hardsub = find_candidates(arguments.source_dir, cache, arguments.recursive, arguments.languages)
 	if len(files_to_hardsub) == 0:
 		print ("There are no video files to hardsub on the source directory.")
 		sys.exit(4)
 	print ("Those files will be hardsubbed (i.e. they are video file and they have a corresponding .srt file):")	
 	for f in files_to_hardsub:
-		print ("\t- "  + colorama.Fore.GREEN + colorama.Style.BRIGHT + "{}".format(os.path.basename(f)) + colorama.Style.NORMAL + colorama.Fore.RESET)
-	current_file = 1
+		print ("\t- "  + colorama.Fore.GREEN + colorama.Style.BRIGHT + "{}".format(os.path.basename(f.file_name)) + colorama.Style.NORMAL + colorama.Fore.RESET)
+	# Check for all executables that are required by this script
 	for f in files_to_hardsub:
-		print ("\nStart work on " + colorama.Fore.GREEN + colorama.Style.BRIGHT + "{}".format(os.path.basename(f)) + colorama.Style.NORMAL + colorama.Fore.RESET + 
-			" ("  + colorama.Style.BRIGHT + "{}/{}".format(current_file, len(files_to_hardsub)) + colorama.Style.NORMAL + ").")
-		print ("")
-		# Check for all executables that are required by this script
-		executables_found, missing_executables = check_prerequisites(f)
+		executables_found, missing_executables = check_prerequisites(f, arguments.stream, arguments.engine, arguments.smart_render, arguments.preview)
 		if not executables_found:
 			print (colorama.Style.BRIGHT + "Some dependencies for this script are missing. "  + colorama.Style.NORMAL + 
 				"Please check that the following packages are installed on this Linux Box:")
 			for me in missing_executables:
 				print ("\t- "  + colorama.Style.BRIGHT + "{}".format(me)  + colorama.Style.NORMAL);
 			sys.exit(2)
-		hardsub_video(f, arguments.output, arguments.subtitle_scale, arguments.verbose, arguments.debug)
-		extract_audio(f, arguments.output, arguments.verbose, arguments.debug)
-		build_final_file(f, arguments.output, arguments.verbose, arguments.debug)
-		current_file = current_file + 1
+	if arguments.preview:
+		use_profile(profiles.get_profile(arguments.profile, arguments.profile_file, arguments.threads))
+		start = time.time()
+		results = preview_files(files_to_hardsub, arguments.output, arguments.subtitle_scale, arguments.preview_events, arguments.engine,
+			arguments.source_dir if arguments.recursive else None, arguments.languages, arguments.verbose, arguments.debug)
+		print_summary(results, time.time() - start)
+		if len([r for r in results if not r[1]]) > 0:
+			sys.exit(6)
+		return
+	file_options = build_file_options(arguments)
+	files_to_hardsub = skip_completed(files_to_hardsub, arguments, file_options)
+	if len(files_to_hardsub) == 0:
+		sys.exit(0)
+	if arguments.adaptive:
+		# Created before the pool, so that its processes share it
+		loadcontrol.controller = loadcontrol.LoadController(parse_size(arguments.min_free_memory))
+	start = time.time()
+	if arguments.jobs > 1:
+		print ("\nWorking on " + colorama.Style.BRIGHT + "{}".format(min(arguments.jobs, len(files_to_hardsub))) + colorama.Style.NORMAL + " files at once.\n")
+		results = hardsub_batch(files_to_hardsub, arguments.output, arguments.subtitle_scale, arguments.jobs, **file_options)
+	else:
+		results = []
+		current_file = 1
+		batch = batchprogress.BatchProgress(files_to_hardsub, 1)
+		batchprogress.track(batch, 0)
+		for f in files_to_hardsub:
+			print ("\nStart work on " + colorama.Fore.GREEN + colorama.Style.BRIGHT + "{}".format(os.path.basename(f.file_name)) + colorama.Style.NORMAL + colorama.Fore.RESET + 
+				" ("  + colorama.Style.BRIGHT + "{}/{}".format(current_file, len(files_to_hardsub)) + colorama.Style.NORMAL + ").")
+			print ("")
+			rows = rows_per_job(arguments.segments) + 1
+			reserve_progress_board(rows)
+			lock = threading.Lock()
+			set_progress_output(ProgressLine(0, rows, lock))
+			job_report = JobReport(f.file_name)
+			set_job_report(job_report)
+			batch.start_job(0, f)
+			stop = threading.Event()
+			batch_line = threading.Thread(target=_show_batch_progress, args=(batch, ProgressLine(rows - 1, rows, lock), stop))
+			batch_line.daemon = True
+			batch_line.start()
+			try:
+				done = hardsub_file(f, arguments.output, arguments.subtitle_scale, **file_options)
+			finally:
+				stop.set()
+				batch_line.join()
+				batch.end_job(0)
+			batch.job_done(f)
+			job_report.finish()
+			results.append((f.file_name, done, job_report.wall, job_report.to_dict()))
+			if not done:
+				break
+			current_file = current_file + 1
+	print_summary(results, time.time() - start)
+	try:
+		# Workspaces of completed jobs are gone, drop their directory too
+		os.rmdir(os.path.join(arguments.output, SCRATCH_DIR))
+	except OSError:
+		pass
+	if arguments.report is not None:
+		for file_name, done, seconds, job_report in results:
+			batch_report.add_job(job_report, done)
+		batch_report.write(arguments.report)
+	if len([r for r in results if not r[1]]) > 0:
+		sys.exit(6)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: inotify
+
+    :synopsis: Minimal binding of the Linux inotify API through ctypes
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+# Events, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# Header of each event: watch descriptor, mask, cookie and length of the name
+_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+def _check(result):
+	if result < 0:
+		error = ctypes.get_errno()
+		raise OSError(error, os.strerror(error))
+	return result
+
+class Inotify(object):
+	"""
+		inotify instance, events are read from its file descriptor
+	"""
+
+	def __init__(self):
+		self.fd = _check(_libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK))
+		self.watches = {}
+
+	def add_watch(self, path, mask):
+		"""
+			Watch a directory
+			:param path: Directory to watch
+			:type path: str
+			:param mask: Events to report
+			:type mask: int
+			:returns: int -- Watch descriptor
+		"""
+		wd = _check(_libc.inotify_add_watch(self.fd, path.encode('utf-8') if isinstance(path, unicode) else path, mask))
+		self.watches[wd] = path
+		return wd
+
+	def read_events(self, timeout=None):
+		"""
+			Wait for events and read every event available
+			:param timeout: Seconds to wait, None to wait forever
+			:type timeout: float
+			:returns: list -- (path, mask, cookie) of each event, path is the watched directory joined with the name of the event
+		"""
+		try:
+			ready, _, _ = select.select([self.fd], [], [], timeout)
+		except select.error as e:
+			if e.args[0] == errno.EINTR:
+				return []
+			raise
+		if len(ready) == 0:
+			return []
+		try:
+			data = os.read(self.fd, 1 << 16)
+		except OSError as e:
+			if e.errno in (errno.EAGAIN, errno.EINTR):
+				return []
+			raise
+		events = []
+		offset = 0
+		while offset < len(data):
+			wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+			offset = offset + _EVENT_HEADER.size
+			name = data[offset:offset + length].rstrip('\0')
+			offset = offset + length
+			directory = self.watches.get(wd)
+			if mask & IN_IGNORED:
+				self.watches.pop(wd, None)
+			if directory is None and not mask & IN_Q_OVERFLOW:
+				continue
+			events.append((os.path.join(directory, name) if directory is not None else None, mask, cookie))
+		return events
+
+	def close(self):
+		os.close(self.fd)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: jobcontext
+
+    :synopsis: Module that keeps the settings of the job running on each thread, so jobs run by the same process do not share them
+"""
+
+import threading
+
+# Per thread job and its settings
+_current = threading.local()
+
+class JobContext(object):
+	"""
+		Settings of a job run in process and the tools it launches. Threads started
+		by a job carry its context (see report.get_context), jobs on other threads
+		have their own. Settings left to None fall back to the module globals.
+		:param verbose: True to print every launched command
+		:type verbose: bool
+		:param debug: True to save the output of every tool on /tmp/hs.log
+		:type debug: bool
+		:param profile: Encoding profile, see profiles.get_profile
+		:type profile: dict
+		:param tool_timeout: Seconds a tool may go without printing anything, None to wait forever
+		:type tool_timeout: float
+		:param callbacks: Functions called with each ProgressEvent of the tools of the job
+		:type callbacks: list
+	"""
+
+	def __init__(self, verbose=False, debug=False, profile=None, tool_timeout=None, callbacks=()):
+		self.verbose = verbose
+		self.debug = debug
+		self.profile = profile
+		self.tool_timeout = tool_timeout
+		self.callbacks = list(callbacks)
+		# Tools of the job running right now, by pid, see runner
+		self.children = {}
+		self.children_lock = threading.Lock()
+		self.cancelled = threading.Event()
+
+def set_job_context(context):
+	"""
+		Set the job running on the current thread
+		:param context: Context of the job, None for the settings of the process
+		:type context: JobContext
+	"""
+	_current.context = context
+
+def get_job_context():
+	"""
+		Get the job running on the current thread
+		:returns: JobContext -- Context of the job, None if the settings of the process apply
+	"""
+	return getattr(_current, 'context', None)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: journal
+
+    :synopsis: Module that records the stages completed on each file, so that a batch can be resumed
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+
+import scanner
+
+# Name of the journal inside the output directory
+JOURNAL_FILE = '.hs-journal.json'
+
+# Stages recorded on the journal, in the order they are completed
+ENCODED = 'encoded'
+AUDIO_EXTRACTED = 'audio extracted'
+MUXED = 'muxed'
+
+def _file_digest(file_name):
+	sha1 = hashlib.sha1()
+	with open(file_name, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			sha1.update(chunk)
+	return sha1.hexdigest()
+
+class Journal(object):
+	"""
+		Journal of a batch, stored in its output directory.
+		Every update is done under an exclusive lock, so processes
+		working on the same output directory can share it.
+		:param output_dir: Output directory of the batch
+		:type output_dir: str
+	"""
+
+	def __init__(self, output_dir):
+		self.journal_file = os.path.join(output_dir, JOURNAL_FILE)
+
+	@staticmethod
+	def exists(output_dir):
+		"""
+			Check if an output directory holds a journal
+			:returns: boolean -- True if there is a journal
+		"""
+		return os.path.isfile(os.path.join(output_dir, JOURNAL_FILE))
+
+	def fingerprint(self, media, settings):
+		"""
+			Fingerprint a job: source file, subtitles and settings that affect the output
+			:param media: File that had to be reencoded
+			:type media: MediaInfo
+			:param settings: Settings of the job
+			:type settings: dict
+			:returns: str -- Fingerprint of the job
+		"""
+		stem = os.path.splitext(media.file_name)[0]
+		if settings.get('languages'):
+			subtitles = [[tag, _file_digest(sub_file)] for tag, sub_file in scanner.subtitle_files(stem, True)]
+		else:
+			subtitles = _file_digest(stem + scanner.SUBTITLE_EXTENSION)
+		data = [media.file_name, media.size, media.mtime, subtitles, sorted(settings.items())]
+		return hashlib.sha1(json.dumps(data)).hexdigest()
+
+	def _load(self):
+		try:
+			with open(self.journal_file) as f:
+				return json.load(f)
+		except (IOError, OSError, ValueError):
+			return {}
+
+	def stages(self, media, fingerprint):
+		"""
+			Get the stages completed on a file
+			:param media: File that had to be reencoded
+			:type media: MediaInfo
+			:param fingerprint: Fingerprint of the job
+			:type fingerprint: str
+			:returns: list -- Completed stages, empty if the job changed since they were recorded
+		"""
+		entry = self._load().get(media.file_name)
+		if entry is None or entry['fingerprint'] != fingerprint:
+			return []
+		return entry['stages']
+
+	def mark(self, media, fingerprint, stage):
+		"""
+			Record that a stage has been completed on a file
+			:param media: File that had to be reencoded
+			:type media: MediaInfo
+			:param fingerprint: Fingerprint of the job
+			:type fingerprint: str
+			:param stage: Completed stage
+			:type stage: str
+		"""
+		with open(self.journal_file + '.lock', 'a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				entries = self._load()
+				entry = entries.get(media.file_name)
+				if entry is None or entry['fingerprint'] != fingerprint:
+					entry = {'fingerprint': fingerprint, 'stages': []}
+					entries[media.file_name] = entry
+				if stage not in entry['stages']:
+					entry['stages'].append(stage)
+				# Write on a temporary file and rename it, a crash never leaves half a journal
+				tmp_file = "{}.{}.tmp".format(self.journal_file, os.getpid())
+				with open(tmp_file, 'w') as f:
+					json.dump(entries, f, indent=1)
+				os.rename(tmp_file, self.journal_file)
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: loadcontrol
+
+    :synopsis: Module that starts stages according to the load of the host: CPU, load average, free memory and disk activity
+"""
+
+import contextlib
+import multiprocessing
+import os
+import time
+
+from utils import get_progress_output
+
+# Kinds of stages: encoders saturate cores, extractors and muxers mostly move bytes
+CPU = 'cpu'
+IO = 'io'
+
+# A CPU bound stage starts only while the CPUs are busy for less than this part of the time
+MAX_CPU = 0.9
+
+# ...and while the load average per CPU is below this
+MAX_LOAD = 1.5
+
+# An I/O bound stage starts only while no disk is busy for more than this part of the time
+MAX_DISK = 0.9
+
+# Memory that must be available to start a CPU bound stage, I/O bound stages need a quarter of it
+MIN_MEMORY = 1 << 30
+
+# Seconds the load is sampled over
+SAMPLE_INTERVAL = 0.5
+
+# Seconds between two admissions of the same kind, so the load shows the stage started last
+RAMP_TIME = 5
+
+# Seconds between two checks while a stage is waiting
+POLL_INTERVAL = 2
+
+# Block devices that are not disks
+VIRTUAL_DEVICES = ('loop', 'ram', 'zram')
+
+# Controller of the stages of this process and of the ones forked from it, None to start stages at once
+controller = None
+
+def read_cpu_times():
+	"""
+		:returns: (int, int) -- Total and idle CPU time since boot, in ticks
+	"""
+	with open('/proc/stat') as f:
+		values = [int(v) for v in f.readline().split()[1:9]]
+	# Idle and waiting for I/O
+	return (sum(values), values[3] + values[4])
+
+def read_load_average():
+	"""
+		:returns: float -- Load average of the last minute
+	"""
+	with open('/proc/loadavg') as f:
+		return float(f.read().split()[0])
+
+def read_available_memory():
+	"""
+		:returns: int -- Bytes of memory available without swapping
+	"""
+	with open('/proc/meminfo') as f:
+		for line in f:
+			if line.startswith('MemAvailable:'):
+				return int(line.split()[1]) * 1024
+	return None
+
+def read_disk_ticks():
+	"""
+		:returns: dict -- Milliseconds each disk has spent doing I/O since boot
+	"""
+	disks = set(d for d in os.listdir('/sys/block') if not d.startswith(VIRTUAL_DEVICES))
+	ticks = {}
+	with open('/proc/diskstats') as f:
+		for line in f:
+			fields = line.split()
+			if len(fields) >= 13 and fields[2] in disks:
+				ticks[fields[2]] = int(fields[12])
+	return ticks
+
+def sample_load(interval=SAMPLE_INTERVAL):
+	"""
+		Sample the load of the host
+		:param interval: Seconds to sample CPU and disk activity over
+		:type interval: float
+		:returns: dict -- Busy part of CPU time, load average per CPU, available memory and busy part of the busiest disk
+	"""
+	total_before, idle_before = read_cpu_times()
+	disks_before = read_disk_ticks()
+	start = time.time()
+	time.sleep(interval)
+	total_after, idle_after = read_cpu_times()
+	disks_after = read_disk_ticks()
+	elapsed = (time.time() - start) * 1000
+	total = total_after - total_before
+	disk = [(disks_after[d] - disks_before[d]) / elapsed for d in disks_after if d in disks_before]
+	return {
+		'cpu': 1.0 - float(idle_after - idle_before) / total if total > 0 else 0.0,
+		'load': read_load_average() / multiprocessing.cpu_count(),
+		'memory': read_available_memory(),
+		'disk': min(max(disk), 1.0) if len(disk) > 0 else 0.0
+	}
+
+def describe(load):
+	return "cpu {:.0%}, load {:.2f} per cpu, {}M available, disk {:.0%}".format(load['cpu'], load['load'], (load['memory'] or 0) >> 20, load['disk'])
+
+class LoadController(object):
+	"""
+		Admission of stages shared by the processes forked after it is created.
+		A stage waits until the host has room for its kind, unless no stage
+		of that kind is running, so that work always goes on.
+		:param min_memory: Bytes of memory that must be available to start a CPU bound stage
+		:type min_memory: int
+	"""
+
+	def __init__(self, min_memory=MIN_MEMORY):
+		self.min_memory = min_memory
+		self.lock = multiprocessing.Lock()
+		self.running = {CPU: multiprocessing.Value('i', 0), IO: multiprocessing.Value('i', 0)}
+		self.last_admission = {CPU: multiprocessing.Value('d', 0.0), IO: multiprocessing.Value('d', 0.0)}
+
+	def has_room(self, kind, load):
+		"""
+			Check if the host can take one more stage of a kind
+			:param kind: CPU or IO
+			:type kind: str
+			:param load: Load of the host, see sample_load
+			:type load: dict
+			:returns: boolean -- True if the stage can start
+		"""
+		if kind == CPU:
+			return load['cpu'] < MAX_CPU and load['load'] < MAX_LOAD and (load['memory'] is None or load['memory'] >= self.min_memory)
+		# I/O bound stages run alongside encodes, unless the box is swamped
+		return load['disk'] < MAX_DISK and load['load'] < 2 * MAX_LOAD and (load['memory'] is None or load['memory'] >= self.min_memory / 4)
+
+	def admit(self, kind):
+		"""
+			Wait until a stage of a kind can start and count it as running
+			:param kind: CPU or IO
+			:type kind: str
+		"""
+		waiting = False
+		while True:
+			with self.lock:
+				admitted = self.running[kind].value == 0
+				if not admitted and time.time() - self.last_admission[kind].value >= RAMP_TIME:
+					load = sample_load()
+					admitted = self.has_room(kind, load)
+					if not admitted and not waiting:
+						get_progress_output().write("Waiting for room on the host ({})".format(describe(load)))
+						waiting = True
+				if admitted:
+					with self.running[kind].get_lock():
+						self.running[kind].value = self.running[kind].value + 1
+					self.last_admission[kind].value = time.time()
+					return
+			time.sleep(POLL_INTERVAL)
+
+	def release(self, kind):
+		"""
+			Count a stage as over
+			:param kind: CPU or IO
+			:type kind: str
+		"""
+		with self.running[kind].get_lock():
+			self.running[kind].value = self.running[kind].value - 1
+
+@contextlib.contextmanager
+def stage(kind):
+	"""
+		Run a stage once the controller admits it, at once if there is no controller
+		:param kind: CPU or IO
+		:type kind: str
+	"""
+	if controller is None:
+		yield
+		return
+	controller.admit(kind)
+	try:
+		yield
+	finally:
+		controller.release(kind)
@@ -2,102 +2,243 @@
 
 import os
 import re
+from multiprocessing.pool import ThreadPool
 
-import pexpect
-
-from utils import which, launch_process_with_progress_bar, get_base_file_name
+import report
+import runner
+from profiles import DEFAULT_PROFILE, PROFILES, in_use, mencoder_video_options
+from progress import MencoderParser, MkvmergeParser
+from srt import read_subtitles, write_subtitles, slice_subtitles
+from utils import ToolError, which, launch_process_with_progress_bar, get_base_file_name, run_command, set_progress_output, get_progress_output
 
 # List of required executables on a Linux Box used to accomplish
 # hard subbing
 REQUIRED_EXECUTABLES = {
-	'mencoder'   : '.*\((.*)%\).*',
-	'mkvextract' : '.*: (\d+)%.*',
-	'mkvmerge'   : '.*: (\d+)%.*',
+	'mencoder'   : MencoderParser,
+	'mkvextract' : MkvmergeParser,
+	'mkvmerge'   : MkvmergeParser,
+	'mkvinfo'    : None,
 }
 
+# Executable used by probe, needed whatever engine hardsubs the file
+PROBE_EXECUTABLE = 'mkvinfo'
+
+# Extension of the hardsubbed video track written by hardsub_video
+VIDEO_EXTENSION = '264'
+
 verbose = False
 
 debug = False
 
-def check_video(file_name):
+# Settings of this container on the encoding profile in use
+encoding = PROFILES[DEFAULT_PROFILE]['matroska']
+
+def _parse_duration(output):
 	"""
-		Checks if the file has a video track
-		:param file_name: file to check
+		Get the segment duration from mkvinfo output, older versions print seconds, newer ones a timestamp
+	"""
+	match = re.search(r'Duration: (?:(\d+(?:\.\d+)?)s|(\d+):(\d+):(\d+(?:\.\d+)?))', output)
+	if match is None:
+		return None
+	if match.group(1) is not None:
+		return float(match.group(1))
+	return int(match.group(2)) * 3600 + int(match.group(3)) * 60 + float(match.group(4))
+
+def probe(file_name):
+	"""
+		Read tracks, duration and frames of a matroska file with a single mkvinfo run
+		:param file_name: file to probe
 		:type fille_name: string
-		:returns: boolean -- True if the file has a video track, False otherwise. 
-	"""
-	found = False
-	command = '{mkvmerge} -i "{input_file}"'.format(mkvmerge=which('mkvmerge')[0], input_file=file_name)
-	if verbose:
-		print command
-	thread = pexpect.spawn(command)
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		".*video.*"
-		])
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0: # EOF, Process exited
-			break
-		if i == 1: # Status
-			found = True	
-	thread.close()	 
-	return found
-
-def hardsub_video(file_name, output_dir, scale):
+		:returns: dict -- has_video, audio_tracks, duration and frames of the file
+	"""
+	command = '{mkvinfo} "{input_file}"'.format(mkvinfo=which('mkvinfo')[0], input_file=file_name)
+	output = run_command(command, verbose)
+	tracks = []
+	for line in output.splitlines():
+		if re.search(r'\+ (A track|Track)\s*$', line):
+			tracks.append({})
+		elif len(tracks) > 0:
+			number = re.search(r'Track number: (\d+)(?: \(track ID for mkvmerge & mkvextract: (\d+)\))?', line)
+			if number is not None:
+				# Older mkvtoolnix uses the track number as track ID
+				tracks[-1]['id'] = int(number.group(2) or number.group(1))
+			track_type = re.search(r'Track type: (\w+)', line)
+			if track_type is not None:
+				tracks[-1]['type'] = track_type.group(1)
+			codec = re.search(r'Codec ID: (\S+)', line)
+			if codec is not None:
+				tracks[-1]['codec'] = codec.group(1)
+			fps = re.search(r'\((\d+(?:\.\d+)?) frames/fields per second', line)
+			if fps is not None:
+				tracks[-1]['fps'] = float(fps.group(1))
+	video_tracks = [t for t in tracks if t.get('type') == 'video']
+	info = {
+		'has_video': len(video_tracks) > 0,
+		'audio_tracks': [(t['id'], t.get('codec', '')) for t in tracks if t.get('type') == 'audio' and 'id' in t],
+		'duration': _parse_duration(output),
+		'frames': None
+	}
+	if info['duration'] is not None and len(video_tracks) > 0 and 'fps' in video_tracks[0]:
+		info['frames'] = int(round(info['duration'] * video_tracks[0]['fps']))
+	return info
+
+def mencoder_command(input_file, sub_file, output_file, scale, raw=False, encoding_settings=None):
+	"""
+		Build the mencoder command that hardsubs a matroska video
+		:param input_file: Name of the file that had to be reencoded
+		:type input_file: str
+		:param sub_file: .srt file with subtitles to burn
+		:type sub_file: str
+		:param output_file: Where to write the hardsubbed video track
+		:type output_file: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param raw: Write a raw elementary stream instead of a container
+		:type raw: bool
+		:param encoding_settings: Settings of this container on an encoding profile, None for the ones in use
+		:type encoding_settings: dict
+		:returns: str -- mencoder command
+	"""
+	return '{mencoder} -o "{output_file}"{raw} -nosound -noautosub -noskip -mc 0 -sub "{sub_file}" -subfont-text-scale "{subtitle_scale}" {video_opts} "{input_file}"'.format(
+		mencoder = which("mencoder")[0],
+		output_file = output_file,
+		raw = ' -of rawvideo' if raw else '',
+		sub_file = sub_file,
+		subtitle_scale = scale,
+		video_opts = mencoder_video_options(encoding_settings or in_use('matroska', encoding)),
+		input_file = input_file
+	)
+
+def hardsub_video(media, output_dir, scale):
 	"""
 		Hardsub a matroska video reencoding it using a .srt file for Subititles
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw hardsubbed video
 		:type output_dir: str
 		:param scale: Subtitle font scale
 		:type a: int
 	"""
-        base_file_name = get_base_file_name(file_name)
-	# Build MEncoder command
-	command = '{mencoder} -o "{output_file}" -nosound -noautosub -noskip -mc 0 -sub "{sub_file}" -subfont-text-scale "{subtitle_scale}" -ovc x264 -x264encopts crf=21:preset=slow:level_idc=31 "{input_file}"'.format(
-		mencoder = which("mencoder")[0],
-		output_file = "{}/{}.264".format(output_dir, base_file_name),
-		sub_file = os.path.splitext(file_name)[0] + ".srt",
-		subtitle_scale = scale,
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
+	command = mencoder_command(file_name, os.path.splitext(file_name)[0] + ".srt", "{}/{}.264".format(output_dir, base_file_name), scale)
+	launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mencoder'], 100, 'Video Encoding: ', verbose, debug)
+
+def get_duration(file_name):
+	"""
+		Get the duration of a matroska file
+		:param file_name: file to check
+		:type fille_name: string
+		:returns: float -- Duration in seconds, None if it is unknown
+	"""
+	command = '{mkvinfo} "{input_file}"'.format(mkvinfo=which('mkvinfo')[0], input_file=file_name)
+	return _parse_duration(run_command(command, verbose))
+
+def _encode_segment(job):
+	"""
+		Encode a segment of a video on a thread of the segment pool
+		:param job: mencoder command, progress bar message, where the progress bar is drawn and report context
+		:type job: tuple
+		:returns: ToolError -- Failure of the encoder, None if the segment has been encoded
+	"""
+	command, message, progress_output, context = job
+	set_progress_output(progress_output)
+	report.set_context(context)
+	try:
+		launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mencoder'], 100, message, verbose, debug)
+	except ToolError as e:
+		# The video is lost, stop the other segments too
+		runner.cancel_all()
+		return e
+	return None
+
+def hardsub_video_segmented(media, output_dir, scale, segments):
+	"""
+		Hardsub a matroska video splitting it in segments that are reencoded at the same time.
+		The source is split at key frames, every segment is hardsubbed with its own slice
+		of the .srt file and then segments are joined again without reencoding.
+		Progress bars of segments are drawn on the rows that follow the current progress line.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place raw hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param segments: Number of segments encoded at the same time
+		:type segments: int
+	"""
+	file_name = media.file_name
+	duration = media.duration
+	if duration is None or segments < 2:
+		hardsub_video(media, output_dir, scale)
+		return
+	base_file_name = get_base_file_name(file_name)
+	segment_prefix = output_dir + os.sep + base_file_name + '_segment'
+	# Split the source without audio and subtitles, mkvmerge cuts on the first key frame after each timecode
+	command = '{mkvmerge} -o "{dest_file}" -A -S --split timecodes:{timecodes} "{input_file}"'.format(
+		mkvmerge = which('mkvmerge')[0],
+		dest_file = segment_prefix + '.mkv',
+		timecodes = ','.join(["{:.3f}s".format(duration * i / segments) for i in range(1, segments)]),
 		input_file = file_name
 	)
-	launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mencoder'], 100, 'Video Encoding: ', verbose, debug)
+	launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mkvmerge'], 100, 'Splitting video: ', verbose, debug, (0, 1))
+	segment_files = sorted([output_dir + os.sep + f for f in os.listdir(output_dir) if re.match(re.escape(base_file_name) + r'_segment-\d+\.mkv$', f)])
+	if len(segment_files) == 0:
+		# mkvmerge may end with warnings (exit status 1) without writing any segment
+		hardsub_video(media, output_dir, scale)
+		return
+	# Give each segment its own slice of subtitles, shifted to the real start of the segment
+	subtitles = read_subtitles(os.path.splitext(file_name)[0] + ".srt")
+	jobs = []
+	start = 0.0
+	for i, segment_file in enumerate(segment_files):
+		if i == len(segment_files) - 1:
+			end = None
+		else:
+			# Fall back to the requested split point if the segment cannot be probed
+			end = start + (get_duration(segment_file) or duration / segments)
+		segment_base = os.path.splitext(segment_file)[0]
+		write_subtitles(slice_subtitles(subtitles, start, end), segment_base + '.srt')
+		command = mencoder_command(segment_file, segment_base + '.srt', segment_base + '.264', scale)
+		jobs.append((command, 'Video Encoding {}/{}: '.format(i + 1, len(segment_files)), get_progress_output().next_row(i), report.get_context()))
+		start = end
+	pool = ThreadPool(len(jobs))
+	try:
+		failures = [e for e in pool.map(_encode_segment, jobs) if e is not None]
+	finally:
+		pool.close()
+		pool.join()
+	if len(failures) == 0:
+		# Append segments one after the other in a single video track
+		command = '{mkvmerge} -o "{dest_file}" {segment_files}'.format(
+			mkvmerge = which('mkvmerge')[0],
+			dest_file = "{}/{}.264".format(output_dir, base_file_name),
+			segment_files = ' + '.join(['"' + os.path.splitext(f)[0] + '.264"' for f in segment_files])
+		)
+		launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mkvmerge'], 100, 'Joining segments: ', verbose, debug, (0, 1))
+	# Cleaning some mess
+	for f in segment_files:
+		segment_base = os.path.splitext(f)[0]
+		for extension in ('.mkv', '.srt', '.264'):
+			if os.path.isfile(segment_base + extension):
+				os.remove(segment_base + extension)
+	if len(failures) > 0:
+		raise failures[0]
 
-def extract_audio(file_name, output_dir):
+def extract_audio(media, output_dir):
 	"""
 		Extract all audio tracks from a matroska container
-		:param filename: Name of the file that contains audio track
-		:type filename: str 
+		:param media: File that contains audio track
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw audio track
 		:type output_dir: str	
 	"""
-	# detect how many audio track
-	command = '{mkvmerge} -i "{input_file}"'.format(mkvmerge=which('mkvmerge')[0], input_file=file_name)
-	if verbose:
-		print command
-	thread = pexpect.spawn(command)
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		".*(\d+): audio.* \((.*)\)"
-		])
-	audio_tracks = {}
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0: # EOF, Process exited
-			break
-		if i == 1: # Status
-			# TODO(gquadro): handle types other than AAC
-			if 'A_AAC' in thread.match.group(2):
-				audio_tracks[int(thread.match.group(1))] = 'aac'
-			else:
-				audio_tracks[int(thread.match.group(1))] = 'audio'
-	thread.close()
-        base_file_name = get_base_file_name(file_name)
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
 	# Now extract each audio track
-	for track in audio_tracks:
-		output_file = output_dir + os.sep + base_file_name + '_' + "{}".format(track) + "." + audio_tracks[track]
+	for track, codec in media.audio_tracks:
+		# TODO(gquadro): handle types other than AAC
+		output_file = output_dir + os.sep + base_file_name + '_' + "{}".format(track) + "." + ('aac' if 'A_AAC' in codec else 'audio')
 		t_command = '{mkvextract} tracks "{input_file}" {track}:"{dest_file}"'.format(
 			mkvextract = which("mkvextract")[0],
 			input_file = file_name,
@@ -106,21 +247,32 @@ def extract_audio(file_name, output_dir):
 		)
 		launch_process_with_progress_bar(t_command, REQUIRED_EXECUTABLES['mkvextract'], 100, 'Extract audio track {}: '.format(track), verbose, debug)
 		
-def mux_audio_video(file_name, output_dir):
+def mux_audio_video(media, output_dir, passthrough=False):
 	"""
 		Rebuild the matroska container for source file with hardsubbed video track
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw hardsubbed video
 		:type output_dir: str
+		:param passthrough: Take audio tracks straight from the source file instead of the extracted ones
+		:type passthrough: bool
 	"""
-        base_file_name = get_base_file_name(file_name)
-	list_of_files = [f for f in os.listdir(output_dir) if re.match(base_file_name + r'.*\.(264|audio)', f)]
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
+	# Only pick the files of this job, other jobs may share the output directory
+	extensions = '264' if passthrough else '264|aac|audio'
+	list_of_files = [f for f in os.listdir(output_dir) if re.match(re.escape(base_file_name) + r'(_\d+)?\.(' + extensions + ')$', f)]
 	count = 0
 	file_param = []
 	for f in reversed(list_of_files):
 		file_param.append('"' + output_dir + os.sep + f + "\" --compression {}:none".format(count))
 		count = count + 1
+	if passthrough and len(media.audio_tracks) > 0:
+		# Only audio tracks of the source, no video, subtitles, attachments or chapters
+		file_param.append('-a {tracks} -D -S -M --no-chapters "{input_file}"'.format(
+			tracks = ','.join([str(track) for track, codec in media.audio_tracks]),
+			input_file = file_name
+		))
 	output_file = output_dir + os.sep + os.path.basename(file_name)
 	command = '{mkvmerge} -o "{dest_file}" {files_opt}'.format(mkvmerge=which('mkvmerge')[0], dest_file = output_file, files_opt = " ".join(file_param))
 	launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mkvmerge'], 100, 'Rebuilding file: ', verbose, debug, (0, 1))
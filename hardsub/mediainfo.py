@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: mediainfo
+
+    :synopsis: Module that probes media files once and caches what has been found
+"""
+
+import json
+import os
+import threading
+
+import colorama
+import magic
+
+from runner import ToolTimeout
+
+# List of magic signatures for video files
+ALLOWED_MAGIC_SIG = {
+	'AVI': 'avi',
+	'MPEG v4': 'mp4',
+	#'ISO Media, MPEG v4 system, version 1': 'mp4',
+	#'ISO Media, MPEG v4 system, version 2': 'mp4',
+	'Matroska': 'matroska'
+}
+
+# Bytes of the header of a file read to detect its container
+SNIFF_SIZE = 16384
+
+# Per thread libmagic handle
+_magic = threading.local()
+
+# Bump when the content of MediaInfo changes, so that old caches are discarded
+CACHE_VERSION = 1
+
+def default_cache_file():
+	"""
+		Get where the probe cache is stored when no file is specified
+		:returns: str -- Path of the cache file
+	"""
+	cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+	return os.path.join(cache_dir, 'hardsub', 'mediainfo.json')
+
+class MediaInfo(object):
+	"""
+		Everything the stages need to know about a media file.
+		:param file_name: Path of the media file
+		:type file_name: str
+		:param size: Size of the file when it has been probed
+		:type size: int
+		:param mtime: Modification time of the file when it has been probed
+		:type mtime: float
+		:param kind: Container module that handles the file, None if it is not a supported video
+		:type kind: str
+		:param has_video: True if the file has a video track
+		:type has_video: bool
+		:param audio_tracks: (track id, codec) for every audio track
+		:type audio_tracks: list
+		:param duration: Duration in seconds, None if unknown
+		:type duration: float
+		:param frames: Number of video frames, None if unknown
+		:type frames: int
+	"""
+
+	FIELDS = ('file_name', 'size', 'mtime', 'kind', 'has_video', 'audio_tracks', 'duration', 'frames')
+
+	def __init__(self, file_name, size, mtime, kind=None, has_video=False, audio_tracks=None, duration=None, frames=None):
+		self.file_name = file_name
+		self.size = size
+		self.mtime = mtime
+		self.kind = kind
+		self.has_video = has_video
+		self.audio_tracks = [tuple(t) for t in audio_tracks or []]
+		self.duration = duration
+		self.frames = frames
+
+	@property
+	def fps(self):
+		"""
+			Frame rate of the video track, None if unknown
+		"""
+		if self.frames is None or not self.duration:
+			return None
+		return self.frames / self.duration
+
+	def to_dict(self):
+		return dict([(f, getattr(self, f)) for f in MediaInfo.FIELDS])
+
+	@staticmethod
+	def from_dict(data):
+		return MediaInfo(**dict([(str(k), v) for k, v in data.items()]))
+
+	def __repr__(self):
+		return "MediaInfo({})".format(', '.join(["{}={!r}".format(f, getattr(self, f)) for f in MediaInfo.FIELDS]))
+
+class ProbeCache(object):
+	"""
+		On disk cache of MediaInfo, an entry is valid as long as the
+		size and the modification time of its file do not change.
+		:param cache_file: JSON file where the cache is stored
+		:type cache_file: str
+	"""
+
+	def __init__(self, cache_file):
+		self.cache_file = cache_file
+		self.lock = threading.Lock()
+		self.dirty = False
+		self.entries = {}
+		try:
+			with open(cache_file) as f:
+				data = json.load(f)
+			if data.get('version') == CACHE_VERSION:
+				self.entries = data['files']
+		except (IOError, OSError, ValueError, KeyError):
+			# Missing or broken cache, it is rebuilt from scratch
+			pass
+
+	def get(self, file_name, size, mtime):
+		"""
+			Get the cached MediaInfo of a file
+			:returns: MediaInfo -- cached information, None if missing or stale
+		"""
+		with self.lock:
+			entry = self.entries.get(file_name)
+		if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+			return None
+		return MediaInfo.from_dict(entry)
+
+	def put(self, info):
+		"""
+			Store the MediaInfo of a file
+		"""
+		with self.lock:
+			self.entries[info.file_name] = info.to_dict()
+			self.dirty = True
+
+	def save(self):
+		"""
+			Write the cache on disk, if something changed
+		"""
+		with self.lock:
+			if not self.dirty:
+				return
+			cache_dir = os.path.dirname(self.cache_file)
+			if cache_dir != '' and not os.path.isdir(cache_dir):
+				os.makedirs(cache_dir)
+			# Write on a temporary file and rename it, so a concurrent run never reads half a cache
+			tmp_file = "{}.{}.tmp".format(self.cache_file, os.getpid())
+			with open(tmp_file, 'w') as f:
+				json.dump({'version': CACHE_VERSION, 'files': self.entries}, f)
+			os.rename(tmp_file, self.cache_file)
+			self.dirty = False
+
+def detect_kind(file_name):
+	"""
+		Detect the container of a file from the magic signature of its header,
+		which is read once. Each thread has its own libmagic handle, since
+		handles cannot be shared between threads.
+		:param file_name: file to check
+		:type fille_name: string
+		:returns: str -- Name of the container module, None if the file is not a supported video
+	"""
+	if getattr(_magic, 'handle', None) is None:
+		_magic.handle = magic.Magic()
+	with open(file_name, 'rb') as f:
+		header = f.read(SNIFF_SIZE)
+	magic_sig = _magic.handle.from_buffer(header)
+	for ms in ALLOWED_MAGIC_SIG:
+		if ms in magic_sig:
+			return ALLOWED_MAGIC_SIG[ms]
+	return None
+
+def get_backend(kind):
+	"""
+		Get the module that handles a container
+		:param kind: Name of the container module
+		:type kind: str
+		:returns: module -- Container module
+	"""
+	return __import__('hardsub.' + kind, fromlist=["x"])
+
+def probe(file_name, cache=None, strict=False):
+	"""
+		Gather everything the stages need to know about a media file.
+		The container is detected from the magic signature, then the
+		container module reads tracks, duration and frames in a single pass.
+		:param file_name: file to probe
+		:type fille_name: string
+		:param cache: Cache to look into before probing and to update after
+		:type cache: ProbeCache
+		:param strict: True to raise ToolTimeout, instead of printing it and leaving the file out as not a video
+		:type strict: bool
+		:returns: MediaInfo -- Information about the file
+	"""
+	file_name = os.path.abspath(file_name)
+	st = os.stat(file_name)
+	if cache is not None:
+		info = cache.get(file_name, st.st_size, st.st_mtime)
+		if info is not None:
+			return info
+	info = MediaInfo(file_name, st.st_size, st.st_mtime, detect_kind(file_name))
+	if info.kind is not None:
+		try:
+			details = get_backend(info.kind).probe(file_name)
+		except ToolTimeout as e:
+			if strict:
+				raise
+			# Left out of this run and not cached, so it is probed again next time
+			print (colorama.Fore.RED + "Cannot probe {}: {}".format(os.path.basename(file_name), e) + colorama.Fore.RESET)
+			info.kind = None
+			return info
+		for k, v in details.items():
+			setattr(info, k, v)
+	if cache is not None:
+		cache.put(info)
+	return info
@@ -4,103 +4,121 @@ import os
 import re
 
 import colorama
-import pexpect
 
-from utils import which, launch_process_with_progress_bar, get_base_file_name
+from profiles import DEFAULT_PROFILE, PROFILES, in_use, mencoder_video_options
+from progress import MencoderParser, MP4BoxParser
+from utils import which, launch_process_with_progress_bar, get_base_file_name, run_command
 
 # List of required executables on a Linux Box used to accomplish
 # hard subbing
 REQUIRED_EXECUTABLES = {
-	'mencoder' : '.*\((.*)%\).*',
-	'MP4Box'   : '.*\((\d+)/100\).*',
+	'mencoder' : MencoderParser,
+	'MP4Box'   : MP4BoxParser,
 	'mp4info'  : None,
 }
 
+# Executable used by probe, needed whatever engine hardsubs the file
+PROBE_EXECUTABLE = 'mp4info'
+
+# Extension of the hardsubbed video track written by hardsub_video
+VIDEO_EXTENSION = '264'
+
 verbose = False
 
 debug = False
 
-def check_video(file_name):
+# Settings of this container on the encoding profile in use
+encoding = PROFILES[DEFAULT_PROFILE]['mp4']
+
+def probe(file_name):
 	"""
-		Checks if the file has a video track
-		:param file_name: file to check
+		Read tracks, duration and frames of a MP4 file with a single mp4info run
+		:param file_name: file to probe
 		:type fille_name: string
-		:returns: boolean -- True if the file has a video track, False otherwise. 
+		:returns: dict -- has_video, audio_tracks, duration and frames of the file
 	"""
-	found = False
 	command = '{mp4info} "{input_file}"'.format(mp4info=which('mp4info')[0], input_file=file_name)
-	if verbose:
-		print command
-	thread = pexpect.spawn(command)
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		".*video.*"
-		])
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0: # EOF, Process exited
-			break
-		if i == 1: # Status
-			found = True	
-	thread.close()	 
-	return found
-
-def hardsub_video(file_name, output_dir, scale):
+	info = {
+		'has_video': False,
+		'audio_tracks': [],
+		'duration': None,
+		'frames': None
+	}
+	for line in run_command(command, verbose).splitlines():
+		track = re.match(r'\s*(\d+)\s+(video|audio)\s+(.*)', line)
+		if track is None:
+			continue
+		if track.group(2) == 'audio':
+			info['audio_tracks'].append((int(track.group(1)), track.group(3).split(',')[0].strip()))
+		elif not info['has_video']:
+			info['has_video'] = True
+			duration = re.search(r'(\d+(?:\.\d+)?) secs', track.group(3))
+			fps = re.search(r'@ (\d+(?:\.\d+)?) fps', track.group(3))
+			if duration is not None:
+				info['duration'] = float(duration.group(1))
+				if fps is not None:
+					info['frames'] = int(round(info['duration'] * float(fps.group(1))))
+	return info
+
+def mencoder_command(input_file, sub_file, output_file, scale, raw=False, encoding_settings=None):
 	"""
-		Hardsub a MP4 video reencoding it using a .srt file for Subititles
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
-		:param output_dir: Directory where to place raw hardsubbed video
-		:type output_dir: str
+		Build the mencoder command that hardsubs a MP4 video
+		:param input_file: Name of the file that had to be reencoded
+		:type input_file: str
+		:param sub_file: .srt file with subtitles to burn
+		:type sub_file: str
+		:param output_file: Where to write the hardsubbed video track
+		:type output_file: str
 		:param scale: Subtitle font scale
 		:type a: int
+		:param raw: Write a raw elementary stream instead of a container
+		:type raw: bool
+		:param encoding_settings: Settings of this container on an encoding profile, None for the ones in use
+		:type encoding_settings: dict
+		:returns: str -- mencoder command
 	"""
-        base_file_name = get_base_file_name(file_name)
-	# Build MEncoder command
-	command = '{mencoder} -o "{output_file}" -of rawvideo -nosound -noautosub -noskip -mc 0 -sub "{sub_file}" -subfont-text-scale "{subtitle_scale}" -ovc x264 -x264encopts crf=21:preset=slow:level_idc=31 "{input_file}"'.format(
+	return '{mencoder} -o "{output_file}"{raw} -nosound -noautosub -noskip -mc 0 -sub "{sub_file}" -subfont-text-scale "{subtitle_scale}" {video_opts} "{input_file}"'.format(
 		mencoder = which("mencoder")[0],
-		output_file = "{}/{}.264".format(output_dir, base_file_name),
-		sub_file = os.path.splitext(file_name)[0] + ".srt",
+		output_file = output_file,
+		raw = ' -of rawvideo' if raw else '',
+		sub_file = sub_file,
 		subtitle_scale = scale,
-		input_file = file_name
+		video_opts = mencoder_video_options(encoding_settings or in_use('mp4', encoding)),
+		input_file = input_file
 	)
+
+def hardsub_video(media, output_dir, scale):
+	"""
+		Hardsub a MP4 video reencoding it using a .srt file for Subititles
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place raw hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+	"""
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
+	# MP4Box imports the raw H.264 stream
+	command = mencoder_command(file_name, os.path.splitext(file_name)[0] + ".srt", "{}/{}.264".format(output_dir, base_file_name), scale, True)
 	launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['mencoder'], 100, 'Video Encoding: ', verbose, debug)
 
-def extract_audio(file_name, output_dir):
+def extract_audio(media, output_dir):
 	"""
 		Extract all audio tracks from a MP4 container
-		:param filename: Name of the file that contains audio track
-		:type filename: str 
+		:param media: File that contains audio track
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw audio track
 		:type output_dir: str	
 	"""
-	# detect how many audio tracks
-	command = '{mp4info} "{input_file}"'.format(mp4info=which('mp4info')[0], input_file=file_name)
-	if verbose:
-		print command
-	thread = pexpect.spawn(command)
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		"(\d+)\s+audio\s+(.*)"
-		])
-	audio_tracks = {}
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0: # EOF, Process exited
-			break
-		if i == 1: # Status
-			# MP4Box gets the type of the audio track from the extension
-			# TODO(gquadro): handle types other than AAC
-			if 'AAC' in thread.match.group(2):
-				audio_tracks[int(thread.match.group(1))] = 'aac'
-			else:
-				audio_tracks[int(thread.match.group(1))] = 'audio'
-	thread.close()
-        base_file_name = get_base_file_name(file_name)
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
 	# Now extract each audio track
-	for track in audio_tracks:
+	for track, codec in media.audio_tracks:
+		# MP4Box gets the type of the audio track from the extension
+		# TODO(gquadro): handle types other than AAC
+		output_file = output_dir + os.sep + base_file_name + '_' + "{}".format(track) + "." + ('aac' if 'AAC' in codec else 'audio')
 		# If the destination file already exists, MP4Box adds the new track to it
-		output_file = output_dir + os.sep + base_file_name + '_' + "{}".format(track) + "." + audio_tracks[track]
 		if os.path.isfile(output_file):
 			os.remove(output_file)
 		t_command = '{MP4Box} -out "{dest_file}" -raw {track} "{input_file}"'.format(
@@ -111,19 +129,27 @@ def extract_audio(file_name, output_dir):
 		)
 		launch_process_with_progress_bar(t_command, REQUIRED_EXECUTABLES['MP4Box'], 100, 'Extract audio track {}: '.format(track), verbose, debug)
 
-def mux_audio_video(file_name, output_dir):
+def mux_audio_video(media, output_dir, passthrough=False):
 	"""
 		Rebuild the MP4 container for source file with hardsubbed video track
-		:param filename: Name of the file that had to be reencoded
-		:type filename: str 
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
 		:param output_dir: Directory where to place raw hardsubbed video
 		:type output_dir: str
+		:param passthrough: Take audio tracks straight from the source file instead of the extracted ones
+		:type passthrough: bool
 	"""
-        base_file_name = get_base_file_name(file_name)
-	list_of_files = [f for f in os.listdir(output_dir) if re.match(base_file_name + r'.*\.(264|aac|audio)', f)]
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
+	# Only pick the files of this job, other jobs may share the output directory
+	extensions = '264' if passthrough else '264|aac|audio'
+	list_of_files = [f for f in os.listdir(output_dir) if re.match(re.escape(base_file_name) + r'(_\d+)?\.(' + extensions + ')$', f)]
 	file_param = []
 	for f in reversed(list_of_files):
 		file_param.append('-add "' + output_dir + os.sep + f + '"')
+	if passthrough:
+		for track, codec in media.audio_tracks:
+			file_param.append('-add "' + file_name + '#trackID={}"'.format(track))
 
 	# If the destination file already exists, MP4Box adds the new tracks to it
 	output_file = output_dir + os.sep + os.path.basename(file_name)
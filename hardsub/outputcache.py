@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: outputcache
+
+    :synopsis: Module that stores hardsubbed files by content, so identical jobs are never encoded twice
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+
+# Bump when the layout of the cache changes
+CACHE_VERSION = 1
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+def parse_size(size):
+	"""
+		Parse a size such as 500M or 2G
+		:param size: Size, with an optional K, M, G or T suffix
+		:type size: str
+		:returns: int -- Size in bytes
+	"""
+	match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(size), re.I)
+	if match is None:
+		raise ValueError("invalid size: {}".format(size))
+	return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def _link_or_copy(source, dest):
+	"""
+		Hardlink a file, or copy it if the destination is on another file system.
+		The destination appears atomically.
+	"""
+	tmp_file = "{}.{}.tmp".format(dest, os.getpid())
+	try:
+		os.link(source, tmp_file)
+	except OSError as e:
+		if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+			raise
+		shutil.copyfile(source, tmp_file)
+	os.rename(tmp_file, dest)
+
+class OutputCache(object):
+	"""
+		Cache of hardsubbed files, addressed by a hash of the source content, the
+		subtitles content and the encoder settings. When the cache grows beyond its
+		maximum size, least recently used files are evicted.
+		:param cache_dir: Directory of the cache
+		:type cache_dir: str
+		:param max_size: Maximum size of the cache in bytes, None for no limit
+		:type max_size: int
+	"""
+
+	def __init__(self, cache_dir, max_size=None):
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+		self.objects_dir = os.path.join(cache_dir, 'objects')
+		self.digests_file = os.path.join(cache_dir, 'digests.json')
+		if not os.path.isdir(self.objects_dir):
+			try:
+				os.makedirs(self.objects_dir)
+			except OSError as e:
+				# Another process of the pool may have created it
+				if e.errno != errno.EEXIST:
+					raise
+
+	def _locked(self):
+		lock = open(os.path.join(self.cache_dir, '.lock'), 'a')
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		return lock
+
+	def digest(self, file_name):
+		"""
+			Hash the content of a file. Digests are remembered as long as
+			size and modification time of the file do not change, so big
+			sources are read only once.
+			:param file_name: File to hash
+			:type file_name: str
+			:returns: str -- SHA-1 of the content
+		"""
+		file_name = os.path.abspath(file_name)
+		st = os.stat(file_name)
+		stamp = [st.st_size, st.st_mtime]
+		with self._locked():
+			digests = self._load_digests()
+		if file_name in digests and digests[file_name][0:2] == stamp:
+			return digests[file_name][2]
+		sha1 = hashlib.sha1()
+		with open(file_name, 'rb') as f:
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				sha1.update(chunk)
+		with self._locked():
+			digests = self._load_digests()
+			digests[file_name] = stamp + [sha1.hexdigest()]
+			tmp_file = "{}.{}.tmp".format(self.digests_file, os.getpid())
+			with open(tmp_file, 'w') as f:
+				json.dump({'version': CACHE_VERSION, 'files': digests}, f)
+			os.rename(tmp_file, self.digests_file)
+		return sha1.hexdigest()
+
+	def _load_digests(self):
+		try:
+			with open(self.digests_file) as f:
+				data = json.load(f)
+			if data.get('version') == CACHE_VERSION:
+				return data['files']
+		except (IOError, OSError, ValueError, KeyError):
+			pass
+		return {}
+
+	def key(self, media, encoder_settings):
+		"""
+			Get the address of a job on the cache
+			:param media: File that had to be reencoded
+			:type media: MediaInfo
+			:param encoder_settings: Everything that affects the encoded output, subtitle scale included
+			:type encoder_settings: str
+			:returns: str -- Key of the job
+		"""
+		sub_file = os.path.splitext(media.file_name)[0] + ".srt"
+		data = [CACHE_VERSION, self.digest(media.file_name), self.digest(sub_file), encoder_settings]
+		return hashlib.sha1(json.dumps(data)).hexdigest()
+
+	def _path(self, key, file_name):
+		return os.path.join(self.objects_dir, key + os.path.splitext(file_name)[1])
+
+	def fetch(self, key, dest_file):
+		"""
+			Place a cached file on its destination
+			:param key: Key of the job
+			:type key: str
+			:param dest_file: Where to place the hardsubbed file
+			:type dest_file: str
+			:returns: boolean -- True on a cache hit, False otherwise
+		"""
+		cached_file = self._path(key, dest_file)
+		try:
+			_link_or_copy(cached_file, dest_file)
+		except (IOError, OSError):
+			return False
+		# Refresh the modification time, used to evict least recently used files
+		try:
+			os.utime(cached_file, None)
+		except OSError:
+			pass
+		return True
+
+	def store(self, key, source_file):
+		"""
+			Store a hardsubbed file on the cache and evict old files if the cache is too big
+			:param key: Key of the job
+			:type key: str
+			:param source_file: Hardsubbed file
+			:type source_file: str
+		"""
+		cached_file = self._path(key, source_file)
+		if not os.path.isfile(cached_file):
+			_link_or_copy(source_file, cached_file)
+		self.evict()
+
+	def evict(self):
+		"""
+			Remove least recently used files until the cache fits in its maximum size
+		"""
+		if self.max_size is None:
+			return
+		with self._locked():
+			entries = []
+			for f in os.listdir(self.objects_dir):
+				if f.endswith('.tmp'):
+					continue
+				path = os.path.join(self.objects_dir, f)
+				st = os.stat(path)
+				entries.append((st.st_mtime, st.st_size, path))
+			entries.sort()
+			total = sum([e[1] for e in entries])
+			for mtime, size, path in entries:
+				if total <= self.max_size:
+					break
+				try:
+					os.remove(path)
+					total = total - size
+				except OSError:
+					pass
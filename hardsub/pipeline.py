@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: pipeline
+
+    :synopsis: Module that runs hardsub jobs inside the calling process, e.g. of a long running service
+"""
+
+import os
+import re
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+import hardsub
+import preview
+import profiles
+import report
+import runner
+from jobcontext import JobContext
+from journal import Journal
+from mediainfo import probe
+from report import JobReport
+from runner import ToolTimeout
+from utils import HardsubError, ToolError, get_progress_output, set_progress_output
+
+# Styles of the messages of check_arguments, left out of exceptions
+STYLE = re.compile(r'\x1b\[[0-9;]*m')
+
+class NotAVideo(HardsubError):
+	"""
+		The file of a job is not a video of a supported container, or it cannot be probed
+	"""
+
+class MissingExecutables(HardsubError):
+	"""
+		Some tools needed by a job are not installed
+		:param executables: Missing tools
+		:type executables: tuple
+	"""
+
+	def __init__(self, executables):
+		HardsubError.__init__(self, "missing {}".format(', '.join(executables)))
+		self.executables = executables
+
+class JobCancelled(HardsubError):
+	"""
+		A job has been cancelled while it was running
+	"""
+
+class _Discard(object):
+	"""
+		Progress output that draws nothing, progress is told by callbacks instead
+	"""
+
+	def write(self, data):
+		pass
+
+	def flush(self):
+		pass
+
+	def next_row(self, offset=1):
+		return self
+
+class HardsubJob(object):
+	"""
+		Hardsub of a file run on the calling thread. Every setting belongs to the
+		job, so jobs with different settings can run at the same time on different
+		threads of the same process, and failures raise HardsubError instead of
+		exiting. The .srt file must lie next to the video, as for hs.
+		:param file_name: Video to hardsub
+		:type file_name: str
+		:param output_dir: Directory where to place the hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type scale: float
+		:param engine: Engine that hardsubs the file, see hardsub.ENGINES
+		:type engine: str
+		:param profile: Name of the encoding profile
+		:type profile: str
+		:param profile_file: JSON file with user defined encoding profiles, None for the default one
+		:type profile_file: str
+		:param threads: Encoder threads, None to keep the ones of the profile
+		:type threads: int
+		:param on_progress: Function called with the job and each ProgressEvent of its tools, on the thread of the tool
+		:param options: Other settings, as the options of hs: segments, stream, passthrough, smart_render,
+		                languages, scratch_dir, resume (True to use the journal of the output directory),
+		                cache (OutputCache), tool_timeout (0 to wait forever), verbose and debug
+		:raises: ValueError -- if settings are inconsistent
+	"""
+
+	def __init__(self, file_name, output_dir, scale=2.5, engine='mencoder', profile=profiles.DEFAULT_PROFILE, profile_file=None, threads=None, on_progress=None, **options):
+		self.file_name = os.path.abspath(file_name)
+		self.output_dir = output_dir
+		self.scale = scale
+		self.engine = engine
+		self.on_progress = on_progress
+		self.segments = options.pop('segments', 1)
+		self.stream = options.pop('stream', False)
+		self.passthrough = options.pop('passthrough', False)
+		self.smart_render = options.pop('smart_render', False)
+		self.languages = options.pop('languages', False)
+		self.scratch_dir = options.pop('scratch_dir', None)
+		self.resume = options.pop('resume', False)
+		self.cache = options.pop('cache', None)
+		self.tool_timeout = options.pop('tool_timeout', runner.tool_timeout)
+		self.verbose = options.pop('verbose', False)
+		self.debug = options.pop('debug', False)
+		if len(options) > 0:
+			raise ValueError("unknown settings {}".format(', '.join(sorted(options))))
+		if engine not in hardsub.ENGINES:
+			raise ValueError("unknown engine {}, available engines are {}".format(engine, ', '.join(hardsub.ENGINES)))
+		checks, errors = hardsub.check_arguments({
+			'output': output_dir, 'source_dir': os.path.dirname(self.file_name), 'jobs': 1, 'segments': self.segments,
+			'scratch_dir': self.scratch_dir, 'tool_timeout': self.tool_timeout, 'threads': threads, 'profile': profile,
+			'profile_file': profile_file, 'cache_size': None, 'min_free_memory': '0', 'stream': self.stream,
+			'smart_render': self.smart_render, 'engine': engine, 'languages': self.languages, 'preview': False, 'preview_events': preview.DEFAULT_EVENTS
+		})
+		if not checks:
+			raise ValueError('; '.join([STYLE.sub('', e) for e in errors]))
+		self.profile = profiles.get_profile(profile, profile_file, threads)
+		self.report = None
+		self.context = None
+		self.cancelled = False
+
+	def run(self):
+		"""
+			Hardsub the file on the calling thread
+			:returns: list -- Hardsubbed files
+			:raises: HardsubError -- NotAVideo, MissingExecutables, hardsub.NotEnoughSpace, ToolError or JobCancelled
+		"""
+		callbacks = [] if self.on_progress is None else [lambda event: self.on_progress(self, event)]
+		self.context = JobContext(self.verbose, self.debug, self.profile, self.tool_timeout or None, callbacks)
+		self.report = JobReport(self.file_name)
+		saved = (report.get_context(), get_progress_output())
+		# Stages started by the job carry its report and its context
+		report.set_context((self.report, None, self.context))
+		set_progress_output(_Discard())
+		try:
+			if self.cancelled:
+				raise JobCancelled(self.file_name)
+			try:
+				media = probe(self.file_name, strict=True)
+			except (OSError, IOError) as e:
+				raise NotAVideo("cannot read {}: {}".format(self.file_name, e.strerror))
+			except ToolTimeout as e:
+				if self.cancelled:
+					raise JobCancelled(self.file_name)
+				raise NotAVideo("cannot probe {}: {}".format(self.file_name, e))
+			# A probe killed by cancel looks like a file that is not a video
+			if self.cancelled:
+				raise JobCancelled(self.file_name)
+			if media.kind is None or not media.has_video:
+				raise NotAVideo(self.file_name)
+			executables_found, missing_executables = hardsub.check_prerequisites(media, self.stream, self.engine, self.smart_render)
+			if not executables_found:
+				raise MissingExecutables(missing_executables)
+			try:
+				hardsub.run_job(media, self.output_dir, self.scale, segments=self.segments, stream=self.stream, passthrough=self.passthrough,
+					engine=self.engine, smart_render=self.smart_render, profile=self.profile, scratch_dir=self.scratch_dir,
+					resume=Journal(self.output_dir) if self.resume else None, cache=self.cache, languages=self.languages)
+			except ToolError:
+				if self.cancelled:
+					raise JobCancelled(self.file_name)
+				raise
+		finally:
+			self.report.finish()
+			report.set_context(saved[0])
+			set_progress_output(saved[1])
+		return [os.path.join(self.output_dir, name) for sub_file, name in hardsub.job_output_names(media, self.languages)]
+
+	def cancel(self):
+		"""
+			Stop the job from any thread: its tools are killed and run raises JobCancelled
+		"""
+		self.cancelled = True
+		if self.context is not None:
+			runner.cancel_all(self.context)
+
+class Pipeline(object):
+	"""
+		Pool of threads that run jobs inside the calling process
+		:param workers: Number of jobs run at the same time
+		:type workers: int
+	"""
+
+	def __init__(self, workers=1):
+		self.pool = ThreadPool(workers)
+		self.jobs = []
+		self.lock = threading.Lock()
+
+	def _run(self, job):
+		try:
+			return job.run()
+		finally:
+			with self.lock:
+				self.jobs.remove(job)
+
+	def submit(self, job):
+		"""
+			Queue a job
+			:param job: Job to run
+			:type job: HardsubJob
+			:returns: AsyncResult -- Its get returns the hardsubbed files of the job or raises its HardsubError
+		"""
+		with self.lock:
+			self.jobs.append(job)
+		return self.pool.apply_async(self._run, (job,))
+
+	def cancel(self):
+		"""
+			Cancel every job submitted and not over yet
+		"""
+		with self.lock:
+			jobs = list(self.jobs)
+		for job in jobs:
+			job.cancel()
+
+	def close(self):
+		"""
+			Wait for the jobs submitted so far, then stop the threads of the pool
+		"""
+		self.pool.close()
+		self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is not None:
+			self.cancel()
+		self.close()
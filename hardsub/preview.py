@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: preview
+
+    :synopsis: Module that hardsubs short windows around some subtitles of a video, to check scale and placement quickly
+"""
+
+import bisect
+import os
+import shutil
+import sys
+import tempfile
+
+import ffmpeg
+from mediainfo import get_backend
+from profiles import RAW_VIDEO_FORMATS, ffmpeg_video_options, in_use
+from progress import FfmpegParser
+from srt import read_subtitles, write_subtitles, slice_subtitles
+from utils import which, launch_process_with_progress_bar, get_base_file_name
+
+# List of required executables on a Linux Box used to accomplish
+# previews, on top of the ones of the container module
+REQUIRED_EXECUTABLES = {
+	'ffmpeg' : FfmpegParser
+}
+
+# Subtitles encoded by default
+DEFAULT_EVENTS = 6
+
+# Seconds encoded before and after each subtitle
+MARGIN = 2.0
+
+# Frame rate assumed for files whose frame rate is unknown
+DEFAULT_FPS = 25.0
+
+verbose = False
+
+debug = False
+
+def pick_events(subtitles, count):
+	"""
+		Pick subtitles spread across the runtime: the nearest to evenly spaced instants
+		:param subtitles: (start, end, text) for every subtitle, sorted by start time
+		:type subtitles: list
+		:param count: Number of subtitles to pick
+		:type count: int
+		:returns: list -- Picked subtitles, sorted by start time
+	"""
+	if len(subtitles) <= count:
+		return list(subtitles)
+	starts = [s[0] for s in subtitles]
+	first, last = starts[0], starts[-1]
+	picked = set()
+	for i in range(count):
+		instant = first + (last - first) * (i + 0.5) / count
+		index = bisect.bisect_left(starts, instant)
+		if index > 0 and (index == len(starts) or instant - starts[index - 1] < starts[index] - instant):
+			index = index - 1
+		picked.add(index)
+	return [subtitles[i] for i in sorted(picked)]
+
+def plan_windows(events, duration=None, margin=MARGIN):
+	"""
+		Get the windows to encode around some subtitles, overlapping windows are merged
+		:param events: (start, end, text) of the subtitles, sorted by start time
+		:type events: list
+		:param duration: Duration of the video in seconds, None if unknown
+		:type duration: float
+		:param margin: Seconds encoded before and after each subtitle
+		:type margin: float
+		:returns: list -- (start, end) of every window in seconds
+	"""
+	windows = []
+	for start, end, text in events:
+		start = max(start - margin, 0.0)
+		end = end + margin
+		if duration is not None:
+			end = min(end, duration)
+		if end <= start:
+			continue
+		if len(windows) > 0 and start <= windows[-1][1]:
+			windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+		else:
+			windows.append((start, end))
+	return windows
+
+def window_command(media, sub_file, subtitles, start, end, piece, scale, engine, sub_dir):
+	"""
+		Build the command that hardsubs a window of a video into a raw video track
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param sub_file: .srt file with subtitles to burn
+		:type sub_file: str
+		:param subtitles: Subtitles read from sub_file
+		:type subtitles: list
+		:param start: First instant of the window in seconds
+		:type start: float
+		:param end: Last instant of the window in seconds
+		:type end: float
+		:param piece: Where to write the hardsubbed window
+		:type piece: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param engine: Engine that hardsubs the file
+		:type engine: str
+		:param sub_dir: Directory where slices of the subtitles can be written
+		:type sub_dir: str
+		:returns: (str, class) -- Command and parser of its output
+	"""
+	if engine == 'mencoder':
+		# mencoder keeps the timeline of the source when seeking, so subtitles keep their times
+		movie_type = get_backend(media.kind)
+		command = movie_type.mencoder_command(media.file_name, sub_file, piece, scale, True)
+		return (command + ' -ss {:.3f} -endpos {:.3f}'.format(start, end - start), movie_type.REQUIRED_EXECUTABLES['mencoder'])
+	# ffmpeg starts the timeline of a seeked input from 0 and needs plain subtitle paths
+	slice_file = os.path.join(sub_dir, os.path.basename(piece) + '.srt')
+	write_subtitles(slice_subtitles(subtitles, start, end), slice_file)
+	encoding = in_use(media.kind, ffmpeg.profile[media.kind])
+	command = '{ffmpeg} -y -nostats -progress pipe:1 -ss {start:.3f} -i "{input_file}" -t {length:.3f} -map 0:v:0 -vf subtitles={sub_file}:force_style=FontSize={font_size:.1f} {video_opts} -f {raw_format} "{piece}"'.format(
+		ffmpeg = which('ffmpeg')[0],
+		start = start,
+		input_file = media.file_name,
+		length = end - start,
+		sub_file = slice_file,
+		font_size = ffmpeg.font_size(scale),
+		video_opts = ffmpeg_video_options(encoding),
+		raw_format = RAW_VIDEO_FORMATS[encoding['codec']],
+		piece = piece
+	)
+	return (command, REQUIRED_EXECUTABLES['ffmpeg'])
+
+def preview_name(output_name):
+	"""
+		:param output_name: Name of the hardsubbed file
+		:type output_name: str
+		:returns: str -- Name of its preview, <name>.preview<extension>
+	"""
+	base, extension = os.path.splitext(output_name)
+	return base + '.preview' + extension
+
+def make_preview(media, sub_file, output_file, scale, events=DEFAULT_EVENTS, engine='mencoder'):
+	"""
+		Hardsub short windows around some subtitles spread across a video, with the
+		engine, encoding profile and subtitle scale of a full run, and join them in
+		a small video without audio.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param sub_file: .srt file with subtitles to burn
+		:type sub_file: str
+		:param output_file: Where to write the preview
+		:type output_file: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param events: Number of subtitles to show
+		:type events: int
+		:param engine: Engine that hardsubs the file
+		:type engine: str
+		:returns: boolean -- True if the preview has been written, False if there is no subtitle to show
+	"""
+	subtitles = read_subtitles(sub_file)
+	windows = plan_windows(pick_events(subtitles, events), media.duration)
+	if len(windows) == 0:
+		return False
+	fps = media.fps or DEFAULT_FPS
+	codec = in_use(media.kind, get_backend(media.kind).encoding)['codec']
+	work_dir = tempfile.mkdtemp(prefix='hs-', dir=os.path.dirname(output_file))
+	# The subtitles filter needs heavy escaping for paths with special characters:
+	# keep subtitle slices in a temporary directory with a plain name instead
+	sub_dir = tempfile.mkdtemp(prefix='hs-')
+	try:
+		joined = os.path.join(work_dir, get_base_file_name(output_file) + '.' + RAW_VIDEO_FORMATS[codec])
+		with open(joined, 'wb') as out:
+			for i, (start, end) in enumerate(windows):
+				piece = os.path.join(work_dir, '{:03d}.{}'.format(i, RAW_VIDEO_FORMATS[codec]))
+				command, parser = window_command(media, sub_file, subtitles, start, end, piece, scale, engine, sub_dir)
+				launch_process_with_progress_bar(command, parser, max(int((end - start) * fps), 1) if parser is FfmpegParser else 100, 'Preview {}/{}: '.format(i + 1, len(windows)), verbose, debug)
+				# Raw tracks carry their parameters in band, so pieces are joined as they are
+				with open(piece, 'rb') as f:
+					shutil.copyfileobj(f, out)
+				os.remove(piece)
+		command = '{ffmpeg} -y -nostats -progress pipe:1 -fflags +genpts -r {fps:.3f} -f {raw_format} -i "{joined}" -map 0:0 -c copy "{output_file}"'.format(
+			ffmpeg = which('ffmpeg')[0],
+			fps = fps,
+			raw_format = RAW_VIDEO_FORMATS[codec],
+			joined = joined,
+			output_file = output_file
+		)
+		frames = sum([int((end - start) * fps) for start, end in windows])
+		launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['ffmpeg'], frames or sys.maxint, 'Joining preview: ', verbose, debug)
+	finally:
+		shutil.rmtree(work_dir)
+		shutil.rmtree(sub_dir)
+	return True
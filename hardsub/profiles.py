@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: profiles
+
+    :synopsis: Module that holds the encoding profiles: codec, preset, rate control and threads of each container
+"""
+
+import copy
+import json
+import os
+
+from jobcontext import get_job_context
+
+# Profile used when none is requested, it matches the settings hardsub always used
+DEFAULT_PROFILE = 'balanced'
+
+# Video codecs each container module can write
+CONTAINER_CODECS = {
+	'avi'      : ('xvid', 'x264'),
+	'matroska' : ('x264',),
+	'mp4'      : ('x264',)
+}
+
+# Format of the raw video track written by each codec, as named by ffmpeg
+RAW_VIDEO_FORMATS = {
+	'xvid' : 'm4v',
+	'x264' : 'h264'
+}
+
+# Built in profiles. For each container:
+# codec    -- xvid or x264
+# preset   -- x264 preset
+# crf      -- x264 constant rate factor
+# quantizer -- xvid fixed quantizer
+# bitrate  -- average bitrate in kbit/s, instead of crf or quantizer
+# level    -- H.264 level multiplied by 10, None to let the encoder choose
+# threads  -- encoder threads, 0 to let the encoder choose
+# options  -- further encoder options, in mencoder syntax
+PROFILES = {
+	'fast': {
+		'avi'      : {'codec': 'xvid', 'quantizer': 3, 'threads': 0, 'options': 'vhq=0:me_quality=4'},
+		'matroska' : {'codec': 'x264', 'preset': 'veryfast', 'crf': 23, 'level': 31, 'threads': 0},
+		'mp4'      : {'codec': 'x264', 'preset': 'veryfast', 'crf': 23, 'level': 31, 'threads': 0}
+	},
+	'balanced': {
+		'avi'      : {'codec': 'xvid', 'quantizer': 2, 'threads': 0},
+		'matroska' : {'codec': 'x264', 'preset': 'slow', 'crf': 21, 'level': 31, 'threads': 0},
+		'mp4'      : {'codec': 'x264', 'preset': 'slow', 'crf': 21, 'level': 31, 'threads': 0}
+	},
+	'archival': {
+		'avi'      : {'codec': 'xvid', 'quantizer': 2, 'threads': 0, 'options': 'vhq=4:trellis:chroma_opt'},
+		'matroska' : {'codec': 'x264', 'preset': 'veryslow', 'crf': 18, 'level': None, 'threads': 0},
+		'mp4'      : {'codec': 'x264', 'preset': 'veryslow', 'crf': 18, 'level': None, 'threads': 0}
+	}
+}
+
+def default_config_file():
+	"""
+		Get the default location of the file of user defined profiles
+		:returns: str -- Path of the profiles file
+	"""
+	return os.path.join(os.path.expanduser('~'), '.config', 'hardsub', 'profiles.json')
+
+def load_profiles(config_file=None):
+	"""
+		Get every profile: built in ones and the ones defined on a JSON file such as
+		{"nightly": {"inherit": "fast", "matroska": {"crf": 24}, "mp4": {"crf": 24}}}
+		A profile inherits every setting it does not state from balanced, or from
+		the profile named by inherit.
+		:param config_file: File of user defined profiles, None or a missing file for built in profiles only
+		:type config_file: str
+		:returns: dict -- Settings of each container, by profile name
+	"""
+	profiles = copy.deepcopy(PROFILES)
+	if config_file is None or not os.path.isfile(config_file):
+		return profiles
+	try:
+		with open(config_file) as f:
+			user_profiles = json.load(f)
+	except ValueError as e:
+		raise ValueError("invalid profiles file {}: {}".format(config_file, e))
+	pending = dict(user_profiles)
+	while len(pending) > 0:
+		ready = [n for n, p in pending.items() if p.get('inherit', DEFAULT_PROFILE) in profiles and p.get('inherit', DEFAULT_PROFILE) not in pending]
+		if len(ready) == 0:
+			raise ValueError("profiles {} inherit from unknown profiles".format(', '.join(sorted(pending))))
+		for name in ready:
+			user_profile = pending.pop(name)
+			profile = copy.deepcopy(profiles[user_profile.get('inherit', DEFAULT_PROFILE)])
+			for kind, settings in user_profile.items():
+				if kind == 'inherit':
+					continue
+				if kind not in CONTAINER_CODECS:
+					raise ValueError("profile {} states settings for unknown container {}".format(name, kind))
+				if settings.get('codec', profile[kind]['codec']) != profile[kind]['codec']:
+					# Settings of another codec do not apply
+					profile[kind] = {'threads': profile[kind].get('threads', 0)}
+				profile[kind].update(settings)
+			profiles[name] = profile
+	return profiles
+
+def get_profile(name, config_file=None, threads=None):
+	"""
+		Get the settings of a profile, checked against what each container supports
+		:param name: Name of the profile
+		:type name: str
+		:param config_file: File of user defined profiles
+		:type config_file: str
+		:param threads: Encoder threads of every container, None to keep the ones of the profile
+		:type threads: int
+		:returns: dict -- Settings of each container
+	"""
+	profiles = load_profiles(config_file)
+	if name not in profiles:
+		raise ValueError("unknown profile {}, available profiles are {}".format(name, ', '.join(sorted(profiles))))
+	profile = profiles[name]
+	for kind, settings in profile.items():
+		if settings.get('codec') not in CONTAINER_CODECS[kind]:
+			raise ValueError("profile {} uses codec {} for {}, which supports {}".format(name, settings.get('codec'), kind, ', '.join(CONTAINER_CODECS[kind])))
+		if threads is not None:
+			settings['threads'] = threads
+	return profile
+
+def mencoder_video_options(settings):
+	"""
+		Build the mencoder video encoder options of a container
+		:param settings: Settings of the container on a profile
+		:type settings: dict
+		:returns: str -- mencoder options
+	"""
+	if settings['codec'] == 'xvid':
+		if settings.get('bitrate') is not None:
+			options = ['bitrate={}'.format(settings['bitrate'])]
+		else:
+			options = ['fixed_quant={}'.format(settings.get('quantizer', 2))]
+	else:
+		options = ['preset={}'.format(settings.get('preset', 'medium'))]
+		if settings.get('bitrate') is not None:
+			options.append('bitrate={}'.format(settings['bitrate']))
+		else:
+			options.append('crf={}'.format(settings.get('crf', 23)))
+		if settings.get('level') is not None:
+			options.append('level_idc={}'.format(settings['level']))
+	if settings['codec'] == 'x264':
+		options.append('threads={}'.format(settings.get('threads') or 'auto'))
+	elif settings.get('threads'):
+		# xvid runs a single thread unless told otherwise
+		options.append('threads={}'.format(settings['threads']))
+	if settings.get('options'):
+		options.append(settings['options'])
+	return '-ovc {codec} -{codec}encopts {options}'.format(codec=settings['codec'], options=':'.join(options))
+
+def ffmpeg_video_options(settings):
+	"""
+		Build the ffmpeg video encoder options of a container. Free form
+		options are in mencoder syntax, so they are not used by ffmpeg.
+		:param settings: Settings of the container on a profile
+		:type settings: dict
+		:returns: str -- ffmpeg options
+	"""
+	if settings['codec'] == 'xvid':
+		options = ['-c:v mpeg4 -vtag XVID']
+		if settings.get('bitrate') is not None:
+			options.append('-b:v {}k'.format(settings['bitrate']))
+		else:
+			options.append('-q:v {}'.format(settings.get('quantizer', 2)))
+	else:
+		options = ['-c:v libx264 -preset {}'.format(settings.get('preset', 'medium'))]
+		if settings.get('bitrate') is not None:
+			options.append('-b:v {}k'.format(settings['bitrate']))
+		else:
+			options.append('-crf {}'.format(settings.get('crf', 23)))
+		if settings.get('level') is not None:
+			options.append('-level {:.1f}'.format(settings['level'] / 10.0))
+	options.append('-threads {}'.format(settings.get('threads') or 0))
+	return ' '.join(options)
+
+def in_use(kind, default):
+	"""
+		Get the settings of a container for the job running on the current thread
+		:param kind: Container
+		:type kind: str
+		:param default: Settings of the container in use by the process
+		:type default: dict
+		:returns: dict -- Settings of the profile of the job, default if it has none
+	"""
+	context = get_job_context()
+	if context is None or context.profile is None:
+		return default
+	return context.profile[kind]
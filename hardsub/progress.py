@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: progress
+
+    :synopsis: Module that follows the progress of external tools by parsing their output
+"""
+
+import errno
+import fcntl
+import os
+import pty
+import re
+import shlex
+import subprocess
+import threading
+import time
+
+import runner
+from jobcontext import get_job_context
+
+# Size of the blocks counted by rusage I/O fields
+RUSAGE_BLOCK_SIZE = 512
+
+# Bytes read from a process at once
+CHUNK_SIZE = 1 << 16
+
+# Status lines end with a carriage return when they are redrawn in place
+LINE_END = re.compile(r'[\r\n]+')
+
+# Subscribers notified of the events of every process
+_subscribers = []
+_subscribers_lock = threading.Lock()
+
+class ProgressEvent(object):
+	"""
+		Progress of a process. Fields a tool does not report are None.
+		:param percent: Completion percentage
+		:type percent: float
+		:param frame: Frames processed so far
+		:type frame: int
+		:param fps: Frames processed per second
+		:type fps: float
+		:param bitrate: Bitrate of the output in kbit/s
+		:type bitrate: float
+		:param eta: Estimated seconds to completion, as reported by the tool
+		:type eta: float
+		:param done: True on the last event of a process
+		:type done: bool
+		:param usage: Resources used by the process, on the last event only: wall, user_cpu and
+		              system_cpu seconds, read_bytes and written_bytes of block I/O and frames processed
+		:type usage: dict
+	"""
+
+	def __init__(self, percent=None, frame=None, fps=None, bitrate=None, eta=None, done=False, usage=None):
+		self.percent = percent
+		self.frame = frame
+		self.fps = fps
+		self.bitrate = bitrate
+		self.eta = eta
+		self.done = done
+		self.usage = usage
+		# Filled by the monitor
+		self.message = None
+		self.command = None
+
+	def __repr__(self):
+		return 'ProgressEvent(percent={}, frame={}, fps={}, bitrate={}, eta={}, done={})'.format(
+			self.percent, self.frame, self.fps, self.bitrate, self.eta, self.done)
+
+def _float(value):
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return None
+
+class ProgressParser(object):
+	"""
+		Base of the parsers of tool output. Parsers get complete lines, newest last,
+		and only need to look at the newest line telling something: older ones are
+		already out of date.
+		:param scale: Maximum value reached by the progress counter of the tool
+		:type scale: int
+	"""
+
+	def __init__(self, scale=100):
+		self.scale = scale
+
+	def parse_line(self, line):
+		"""
+			Parse a line of output
+			:param line: Line of output, without line terminator
+			:type line: str
+			:returns: ProgressEvent -- Progress told by the line, None if it tells nothing
+		"""
+		raise NotImplementedError
+
+	def feed(self, lines):
+		"""
+			Parse the lines read at once from a process
+			:param lines: Complete lines, oldest first
+			:type lines: list
+			:returns: ProgressEvent -- Newest progress, None if there is none
+		"""
+		for line in reversed(lines):
+			event = self.parse_line(line)
+			if event is not None:
+				return event
+		return None
+
+	def _percent(self, counter):
+		if counter is None or not self.scale:
+			return None
+		return 100.0 * counter / self.scale
+
+class RegexParser(ProgressParser):
+	"""
+		Parser of a progress counter captured by the first group of a regular expression
+		:param reg_exp: Regular expression, searched on each line
+		:type reg_exp: str
+	"""
+
+	def __init__(self, reg_exp, scale=100):
+		ProgressParser.__init__(self, scale)
+		# Leading and trailing wildcards only make the search slower
+		self.reg_exp = re.compile(re.sub(r'(^\.\*|\.\*$)', '', reg_exp))
+
+	def parse_line(self, line):
+		match = self.reg_exp.search(line)
+		if match is None:
+			return None
+		return ProgressEvent(percent=self._percent(_float(match.group(1))))
+
+class MencoderParser(ProgressParser):
+	"""
+		Parser of mencoder and mplayer status lines, such as
+		Pos:  12.3s    296f (10%) 48.21fps Trem:   1min  12mb  A-V:0.000 [1234:128]
+	"""
+
+	STATUS = re.compile(r'(?:(\d+)f )?\(\s*(\d+)%\)(?:\s+([\d.]+)fps)?(?:\s+Trem:\s*(\d+)min)?(?:.*\[(\d+):(\d+)\])?')
+
+	def parse_line(self, line):
+		match = self.STATUS.search(line)
+		if match is None:
+			return None
+		frame, percent, fps, trem, video_rate, audio_rate = match.groups()
+		return ProgressEvent(
+			percent = self._percent(_float(percent)),
+			frame = int(frame) if frame is not None else None,
+			fps = _float(fps),
+			bitrate = _float(video_rate) + _float(audio_rate) if video_rate is not None else None,
+			eta = _float(trem) * 60 if trem is not None else None
+		)
+
+class MkvmergeParser(ProgressParser):
+	"""
+		Parser of mkvmerge and mkvextract progress lines, such as Progress: 45%
+	"""
+
+	STATUS = re.compile(r': (\d+)%')
+
+	def parse_line(self, line):
+		match = self.STATUS.search(line)
+		if match is None:
+			return None
+		return ProgressEvent(percent=self._percent(_float(match.group(1))))
+
+class MP4BoxParser(ProgressParser):
+	"""
+		Parser of MP4Box progress lines, such as Importing ISO File: |=====     | (45/100)
+	"""
+
+	STATUS = re.compile(r'\((\d+)/(\d+)\)')
+
+	def parse_line(self, line):
+		match = self.STATUS.search(line)
+		if match is None:
+			return None
+		return ProgressEvent(percent=self._percent(100.0 * int(match.group(1)) / max(int(match.group(2)), 1)))
+
+class FfmpegParser(ProgressParser):
+	"""
+		Parser of ffmpeg output. Blocks written by -progress pipe:1 are read a key
+		at a time and an event is made when the block ends; classic status lines,
+		such as frame=  120 fps= 25 q=2.0 size= 1024kB time=00:00:04.80 bitrate=1747.6kbits/s,
+		are understood too.
+		The scale is the number of frames of the output.
+	"""
+
+	KEY_VALUE = re.compile(r'^(\w+)=\s*(\S*)$')
+	STATUS = re.compile(r'frame=\s*(\d+)(?:\s+fps=\s*([\d.]+))?(?:.*bitrate=\s*([\d.]+)kbits/s)?')
+
+	def __init__(self, scale=100):
+		ProgressParser.__init__(self, scale)
+		self.block = {}
+
+	def _event(self, frame, fps, bitrate):
+		frame = int(frame) if frame is not None else None
+		fps = _float(fps)
+		eta = None
+		if frame is not None and fps and self.scale:
+			eta = max(self.scale - frame, 0) / fps
+		return ProgressEvent(percent=self._percent(frame), frame=frame, fps=fps, bitrate=_float(bitrate), eta=eta)
+
+	def feed(self, lines):
+		event = None
+		for line in lines:
+			match = self.KEY_VALUE.match(line)
+			if match is None:
+				continue
+			key, value = match.groups()
+			if key != 'progress':
+				self.block[key] = value
+				continue
+			bitrate = self.block.get('bitrate', '').replace('kbits/s', '')
+			event = self._event(self.block.get('frame'), self.block.get('fps'), bitrate)
+			self.block = {}
+		if event is None:
+			event = ProgressParser.feed(self, lines)
+		return event
+
+	def parse_line(self, line):
+		match = self.STATUS.search(line)
+		if match is None:
+			return None
+		return self._event(*match.groups())
+
+def make_parser(parser, scale=100):
+	"""
+		Build the parser of a process output
+		:param parser: Parser class of the tool, or a regular expression capturing its progress counter
+		:param scale: Maximum value reached by the progress counter of the tool
+		:type scale: int
+		:returns: ProgressParser -- Parser ready to be fed
+	"""
+	if isinstance(parser, basestring):
+		return RegexParser(parser, scale)
+	return parser(scale)
+
+def subscribe(callback):
+	"""
+		Notify a callback of the progress events of every process launched from now on
+		:param callback: Function called with a ProgressEvent, from the thread that runs the process
+	"""
+	with _subscribers_lock:
+		_subscribers.append(callback)
+
+def unsubscribe(callback):
+	"""
+		Stop notifying a callback subscribed with subscribe
+	"""
+	with _subscribers_lock:
+		if callback in _subscribers:
+			_subscribers.remove(callback)
+
+def _read_available(fd):
+	"""
+		Read everything a non blocking descriptor holds
+		:returns: (str, bool) -- Data read and True if the other end has been closed
+	"""
+	data = []
+	while True:
+		try:
+			chunk = os.read(fd, CHUNK_SIZE)
+		except OSError as e:
+			if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				return (''.join(data), False)
+			# Linux reports EIO once every process closed the slave side of a pty
+			if e.errno == errno.EIO:
+				return (''.join(data), True)
+			raise
+		if chunk == '':
+			return (''.join(data), True)
+		data.append(chunk)
+
+def _wait(process):
+	"""
+		Wait for the end of a process and get the resources it used
+		:returns: (int, resource.struct_rusage) -- Exit status, negative if killed by a signal, and resource usage
+	"""
+	while True:
+		try:
+			pid, status, rusage = os.wait4(process.pid, 0)
+			break
+		except OSError as e:
+			if e.errno != errno.EINTR:
+				raise
+	if os.WIFSIGNALED(status):
+		process.returncode = -os.WTERMSIG(status)
+	else:
+		process.returncode = os.WEXITSTATUS(status)
+	return (process.returncode, rusage)
+
+def monitor_process(command, parser, subscribers=(), message=None, logfile=None, timeout=None):
+	"""
+		Launch a process on a pseudo terminal, so tools keep printing their status
+		lines, and notify the progress told by its output until it ends.
+		Output is read in chunks as it comes and only the newest lines of each chunk
+		are parsed, so following a process costs next to nothing.
+		:param command: Command to launch
+		:type command: str
+		:param parser: Parser of the process output
+		:type parser: ProgressParser
+		:param subscribers: Functions called with each ProgressEvent, on top of the ones subscribed to every process and to the job of the current thread
+		:type subscribers: list
+		:param message: Label of the events
+		:type message: str
+		:param logfile: File where the whole output is copied
+		:param timeout: Seconds the process may go without printing anything before it is killed, None for runner.current_timeout
+		:type timeout: float
+		:returns: int -- Exit status of the process, negative if it has been killed by a signal
+	"""
+	timeout = runner.current_timeout() if timeout is None else timeout
+	start = time.time()
+	with _subscribers_lock:
+		subscribers = list(subscribers) + _subscribers
+	context = get_job_context()
+	if context is not None:
+		subscribers = subscribers + context.callbacks
+	master, slave = pty.openpty()
+	try:
+		with open(os.devnull) as null:
+			process = subprocess.Popen(shlex.split(command), stdin=null, stdout=slave, stderr=slave, close_fds=True)
+	except:
+		os.close(master)
+		raise
+	finally:
+		os.close(slave)
+	runner.register(process)
+	fcntl.fcntl(master, fcntl.F_SETFL, fcntl.fcntl(master, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+	frames = [None]
+
+	def notify(event):
+		if event.frame is not None:
+			frames[0] = event.frame
+		event.message = message
+		event.command = command
+		for subscriber in subscribers:
+			subscriber(event)
+
+	pending = ''
+	closed = False
+	try:
+		while not closed:
+			# A tool that prints nothing for too long is stuck
+			if not runner.wait_readable(master, None if timeout is None else time.time() + timeout):
+				raise runner.ToolTimeout(command, timeout)
+			data, closed = _read_available(master)
+			if len(data) == 0:
+				continue
+			if logfile is not None:
+				logfile.write(data)
+			lines = LINE_END.split(pending + data)
+			# The last piece is a line still being written
+			pending = lines.pop()
+			event = parser.feed(lines)
+			if event is not None:
+				notify(event)
+		if len(pending) > 0:
+			event = parser.feed([pending])
+			if event is not None:
+				notify(event)
+	except BaseException:
+		# Never leave the process running unattended
+		try:
+			process.kill()
+		except OSError:
+			pass
+		raise
+	finally:
+		os.close(master)
+		status, rusage = _wait(process)
+		runner.unregister(process)
+	notify(ProgressEvent(done=True, usage={
+		'wall': time.time() - start,
+		'user_cpu': rusage.ru_utime,
+		'system_cpu': rusage.ru_stime,
+		'read_bytes': rusage.ru_inblock * RUSAGE_BLOCK_SIZE,
+		'written_bytes': rusage.ru_oublock * RUSAGE_BLOCK_SIZE,
+		'frames': frames[0]
+	}))
+	return status
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: report
+
+    :synopsis: Module that measures where the time of a batch goes: wall time, CPU time and I/O of every stage
+"""
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+import progress
+from jobcontext import get_job_context, set_job_context
+
+# Bump when the layout of the report changes
+REPORT_VERSION = 1
+
+# Counters summed over commands, stages and files
+COUNTERS = ('user_cpu', 'system_cpu', 'read_bytes', 'written_bytes')
+
+# Per thread job being measured and stage running on it
+_current = threading.local()
+
+def _empty_stage():
+	stage = {'wall': 0.0, 'frames': None, 'fps': None, 'commands': []}
+	for counter in COUNTERS:
+		stage[counter] = 0
+	return stage
+
+def _add_usage(stage, usage):
+	"""
+		Add the resources used by a command to a stage
+	"""
+	for counter in COUNTERS:
+		stage[counter] = stage[counter] + usage[counter]
+	if usage['frames'] is not None:
+		stage['frames'] = (stage['frames'] or 0) + usage['frames']
+		stage['encode_wall'] = stage.get('encode_wall', 0.0) + usage['wall']
+		stage['fps'] = stage['frames'] / stage['encode_wall'] if stage['encode_wall'] > 0 else None
+
+class JobReport(object):
+	"""
+		Resources used by each stage of the job of a file. Stages may run on
+		different threads at the same time, each one is measured on its own.
+		:param file_name: File that had to be reencoded
+		:type file_name: str
+	"""
+
+	def __init__(self, file_name):
+		self.file_name = file_name
+		self.stages = {}
+		self.start = time.time()
+		self.wall = None
+		self.running = []
+		self.lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""
+			Measure a stage: every command launched by the calling thread until the stage is over is accounted to it
+			:param name: Name of the stage
+			:type name: str
+		"""
+		with self.lock:
+			if name not in self.stages:
+				self.stages[name] = _empty_stage()
+			self.running.append(name)
+		previous = getattr(_current, 'stage', None)
+		_current.stage = name
+		start = time.time()
+		try:
+			yield
+		finally:
+			_current.stage = previous
+			with self.lock:
+				self.stages[name]['wall'] = self.stages[name]['wall'] + time.time() - start
+				self.running.remove(name)
+
+	def add_command(self, stage, command, message, usage):
+		"""
+			Account the resources used by a command to a stage
+			:param stage: Name of the stage
+			:type stage: str
+			:param command: Command line
+			:type command: str
+			:param message: Label of the command
+			:type message: str
+			:param usage: Resources used by the command, see ProgressEvent
+			:type usage: dict
+		"""
+		entry = dict(usage)
+		entry['command'] = os.path.basename(command.split()[0])
+		entry['message'] = (message or '').strip(': ')
+		with self.lock:
+			self.stages[stage]['commands'].append(entry)
+			_add_usage(self.stages[stage], usage)
+
+	def running_stages(self):
+		"""
+			:returns: list -- Names of the stages running right now
+		"""
+		with self.lock:
+			return sorted(set(self.running))
+
+	def finish(self):
+		"""
+			Stop the clock of the job
+		"""
+		self.wall = time.time() - self.start
+
+	def to_dict(self):
+		"""
+			:returns: dict -- Report of the job, ready to be written as JSON
+		"""
+		with self.lock:
+			return {
+				'file_name': self.file_name,
+				'wall': self.wall if self.wall is not None else time.time() - self.start,
+				'stages': json.loads(json.dumps(self.stages))
+			}
+
+def set_job_report(job_report):
+	"""
+		Set the job measured on the current thread
+		:param job_report: Report of the job, None to stop measuring
+		:type job_report: JobReport
+	"""
+	_current.job = job_report
+	_current.stage = None
+
+def get_job_report():
+	"""
+		Get the job measured on the current thread
+		:returns: JobReport -- Report of the job, None if nothing is measured
+	"""
+	return getattr(_current, 'job', None)
+
+def get_context():
+	"""
+		Get the job and stage measured on the current thread, with the settings of its job, to carry them on threads it starts
+		:returns: tuple -- Context of the current thread
+	"""
+	return (get_job_report(), getattr(_current, 'stage', None), get_job_context())
+
+def set_context(context):
+	"""
+		Measure the commands of the current thread as part of the job and stage of another thread, with the settings of its job
+		:param context: Context got by get_context on the other thread
+		:type context: tuple
+	"""
+	_current.job, _current.stage, job_context = context
+	set_job_context(job_context)
+
+@contextlib.contextmanager
+def stage(name):
+	"""
+		Measure a stage of the job of the current thread, if any
+		:param name: Name of the stage
+		:type name: str
+	"""
+	job_report = get_job_report()
+	if job_report is None:
+		yield
+	else:
+		with job_report.stage(name):
+			yield
+
+def _record_command(event):
+	"""
+		Progress subscriber that accounts ended commands to the running stage
+	"""
+	if not event.done or event.usage is None:
+		return
+	job_report = get_job_report()
+	name = getattr(_current, 'stage', None)
+	if job_report is not None and name is not None:
+		job_report.add_command(name, event.command, event.message, event.usage)
+
+progress.subscribe(_record_command)
+
+class BatchReport(object):
+	"""
+		Report of a whole batch: the jobs of every file and their totals
+	"""
+
+	def __init__(self):
+		self.start = time.time()
+		self.stages = {}
+		self.jobs = []
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""
+			Measure a stage of the batch that is not part of any job, such as probing.
+			Child CPU and I/O are taken from the rusage of the whole process, so no
+			job must run at the same time.
+			:param name: Name of the stage
+			:type name: str
+		"""
+		before = resource.getrusage(resource.RUSAGE_CHILDREN)
+		start = time.time()
+		try:
+			yield
+		finally:
+			after = resource.getrusage(resource.RUSAGE_CHILDREN)
+			stage = self.stages.setdefault(name, _empty_stage())
+			stage['wall'] = stage['wall'] + time.time() - start
+			_add_usage(stage, {
+				'user_cpu': after.ru_utime - before.ru_utime,
+				'system_cpu': after.ru_stime - before.ru_stime,
+				'read_bytes': (after.ru_inblock - before.ru_inblock) * progress.RUSAGE_BLOCK_SIZE,
+				'written_bytes': (after.ru_oublock - before.ru_oublock) * progress.RUSAGE_BLOCK_SIZE,
+				'frames': None
+			})
+
+	def add_job(self, job_report, done):
+		"""
+			Add the report of a job
+			:param job_report: Report of the job, see JobReport.to_dict
+			:type job_report: dict
+			:param done: True if the file has been hardsubbed
+			:type done: bool
+		"""
+		job_report = dict(job_report)
+		job_report['done'] = done
+		self.jobs.append(job_report)
+
+	def totals(self):
+		"""
+			Sum the stages of every job
+			:returns: dict -- Totals of each stage
+		"""
+		totals = {}
+		for job_report in self.jobs:
+			for name, stage in job_report['stages'].items():
+				total = totals.setdefault(name, _empty_stage())
+				total['wall'] = total['wall'] + stage['wall']
+				for command in stage['commands']:
+					_add_usage(total, command)
+		for total in totals.values():
+			del total['commands']
+		return totals
+
+	def write(self, report_file):
+		"""
+			Write the report as JSON
+			:param report_file: Where to write the report
+			:type report_file: str
+		"""
+		data = {
+			'version': REPORT_VERSION,
+			'wall': time.time() - self.start,
+			'files': len(self.jobs),
+			'failed': len([j for j in self.jobs if not j['done']]),
+			'batch_stages': self.stages,
+			'stage_totals': self.totals(),
+			'jobs': sorted(self.jobs, key=lambda j: j['file_name'])
+		}
+		with open(report_file, 'w') as f:
+			json.dump(data, f, indent=1, sort_keys=True)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: runner
+
+    :synopsis: Module that supervises the external tools launched by a process or by a job run in process: timeouts and cancellation
+"""
+
+import errno
+import os
+import select
+import shlex
+import subprocess
+import threading
+import time
+
+from jobcontext import get_job_context
+
+# Seconds a tool may go without printing anything before it is considered stuck, None to wait forever.
+# Probes must end within this time, long running tools only need to keep printing their progress.
+tool_timeout = 600
+
+# Bytes read from a tool at once
+CHUNK_SIZE = 1 << 16
+
+# Tools running right now outside of any job context, by pid
+_children = {}
+_children_lock = threading.Lock()
+_cancelled = threading.Event()
+
+class ToolTimeout(Exception):
+	"""
+		A tool has been killed because it did not print anything for too long
+	"""
+
+	def __init__(self, command, timeout):
+		Exception.__init__(self, "{} gave no sign of life for {} seconds".format(command.split()[0], timeout))
+		self.command = command
+		self.timeout = timeout
+
+def _supervision(context=None):
+	"""
+		Get the tools of a job, of the job of the current thread when no context is given
+		:returns: (dict, Lock, Event) -- Running tools, their lock and the event set by cancel_all
+	"""
+	context = context or get_job_context()
+	if context is None:
+		return (_children, _children_lock, _cancelled)
+	return (context.children, context.children_lock, context.cancelled)
+
+def current_timeout():
+	"""
+		:returns: float -- Seconds a tool of the current thread may go without printing anything, None to wait forever
+	"""
+	context = get_job_context()
+	return tool_timeout if context is None else context.tool_timeout
+
+def register(process):
+	"""
+		Supervise a tool until it is unregistered. A tool started after cancel_all is killed at once.
+		:param process: Process of the tool
+		:type process: subprocess.Popen
+	"""
+	children, children_lock, cancelled = _supervision()
+	with children_lock:
+		children[process.pid] = process
+	if cancelled.is_set():
+		kill(process)
+
+def unregister(process):
+	"""
+		Stop supervising a tool, once it is over
+		:param process: Process of the tool
+		:type process: subprocess.Popen
+	"""
+	children, children_lock, cancelled = _supervision()
+	with children_lock:
+		children.pop(process.pid, None)
+
+def kill(process):
+	try:
+		process.kill()
+	except OSError:
+		pass
+
+def cancel_all(context=None):
+	"""
+		Kill every tool running on this process and any tool started afterwards, until reset is called.
+		Stages waiting on them see them fail and give up. Inside a job context only the tools of the job are killed.
+		:param context: Job whose tools are killed, None for the one of the current thread
+		:type context: JobContext
+	"""
+	children, children_lock, cancelled = _supervision(context)
+	cancelled.set()
+	with children_lock:
+		running = children.values()
+	for process in running:
+		kill(process)
+
+def reset():
+	"""
+		Let tools run again after cancel_all, e.g. at the start of the next job
+	"""
+	_supervision()[2].clear()
+
+def wait_readable(fd, deadline):
+	"""
+		Wait until a descriptor can be read
+		:param fd: Descriptor to wait for
+		:type fd: int
+		:param deadline: Time when waiting is over, None to wait forever
+		:type deadline: float
+		:returns: boolean -- False if the deadline passed
+	"""
+	while True:
+		timeout = None if deadline is None else max(deadline - time.time(), 0)
+		try:
+			ready, _, _ = select.select([fd], [], [], timeout)
+		except select.error as e:
+			if e.args[0] == errno.EINTR:
+				continue
+			raise
+		return len(ready) > 0
+
+def run_tool(command, timeout=None):
+	"""
+		Launch a tool, wait for its end and get what it printed on standard output and error, read together as it comes
+		:param command: Command to launch
+		:type command: str
+		:param timeout: Seconds the tool may run, None for the timeout of the current thread, see current_timeout
+		:type timeout: float
+		:returns: str -- Output of the tool
+	"""
+	timeout = current_timeout() if timeout is None else timeout
+	with open(os.devnull) as null:
+		process = subprocess.Popen(shlex.split(command), stdin=null, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=True)
+	register(process)
+	output = []
+	deadline = None if timeout is None else time.time() + timeout
+	try:
+		fd = process.stdout.fileno()
+		while True:
+			if not wait_readable(fd, deadline):
+				kill(process)
+				raise ToolTimeout(command, timeout)
+			chunk = os.read(fd, CHUNK_SIZE)
+			if chunk == '':
+				break
+			output.append(chunk)
+	except BaseException:
+		kill(process)
+		raise
+	finally:
+		process.stdout.close()
+		process.wait()
+		unregister(process)
+	return ''.join(output)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: scanner
+
+    :synopsis: Module that walks a library and pairs video files with their subtitles without touching their content
+"""
+
+import os
+import re
+
+try:
+	# The scandir backport makes walking big trees much faster on Python 2
+	from scandir import walk
+except ImportError:
+	from os import walk
+
+SUBTITLE_EXTENSION = '.srt'
+
+# Language tag of subtitles named <stem>.<tag>.srt, e.g. en, ita or pt-BR
+LANGUAGE_TAG = re.compile(r'^[A-Za-z]{2,3}(?:[-_][A-Za-z]{2,4})?$')
+
+def subtitle_stems(file_name, languages=False):
+	"""
+		Get the stems of the videos a subtitle file may belong to
+		:param file_name: Name of a file
+		:type file_name: str
+		:param languages: True to take <stem>.<tag>.srt files too
+		:type languages: bool
+		:returns: list -- Stems, empty if the file is not a subtitle file
+	"""
+	stem, extension = os.path.splitext(file_name)
+	if extension != SUBTITLE_EXTENSION:
+		return []
+	stems = [stem]
+	if languages:
+		base, tag = os.path.splitext(stem)
+		if len(base) > 0 and LANGUAGE_TAG.match(tag[1:]):
+			stems.append(base)
+	return stems
+
+def subtitle_files(stem, languages=False):
+	"""
+		Find the subtitles of a video
+		:param stem: Path of the video without extension
+		:type stem: str
+		:param languages: True to take <stem>.<tag>.srt files too
+		:type languages: bool
+		:returns: list -- (language tag, path) of each subtitle file, the tag is None for <stem>.srt
+	"""
+	subtitles = []
+	if os.path.isfile(stem + SUBTITLE_EXTENSION):
+		subtitles.append((None, stem + SUBTITLE_EXTENSION))
+	if languages:
+		directory, base = os.path.split(stem)
+		for f in sorted(os.listdir(directory or os.curdir)):
+			name, extension = os.path.splitext(f)
+			tag = name[len(base) + 1:]
+			if extension == SUBTITLE_EXTENSION and name.startswith(base + '.') and LANGUAGE_TAG.match(tag):
+				subtitles.append((tag, os.path.join(directory, f)))
+	return subtitles
+
+def pair_files(directory, file_names, languages=False):
+	"""
+		Pair the files of a directory with their subtitles by stem, only looking at names
+		:param directory: Directory that holds the files
+		:type directory: str
+		:param file_names: Names of the files of the directory
+		:type file_names: list
+		:param languages: True to pair <stem>.<tag>.srt files too
+		:type languages: bool
+		:returns: list -- Path of every file that has a .srt companion
+	"""
+	stems = set()
+	for f in file_names:
+		stems.update(subtitle_stems(f, languages))
+	if len(stems) == 0:
+		return []
+	paired = []
+	for f in file_names:
+		stem, extension = os.path.splitext(f)
+		if extension.lower() != SUBTITLE_EXTENSION and stem in stems:
+			paired.append(os.path.join(directory, f))
+	return paired
+
+def scan(directory, recursive=False, languages=False):
+	"""
+		Find the files of a library that have a .srt companion file with the same stem
+		:param directory: Root of the library
+		:type directory: str
+		:param recursive: True to descend into subdirectories
+		:type recursive: bool
+		:param languages: True to pair <stem>.<tag>.srt files too
+		:type languages: bool
+		:returns: list -- Path of every paired file, to be sniffed for a video signature
+	"""
+	paired = []
+	for root, dir_names, file_names in walk(directory):
+		paired.extend(pair_files(root, file_names, languages))
+		if not recursive:
+			break
+		# Skip hidden directories, such as job workspaces of an output directory inside the library
+		dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+	return paired
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: smartrender
+
+    :synopsis: Module that reencodes only the GOPs of a video that show subtitles
+"""
+
+import bisect
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import ffmpeg
+from ffmpeg import font_size
+from mediainfo import get_backend
+from profiles import CONTAINER_CODECS, ffmpeg_video_options, in_use
+from progress import FfmpegParser
+from srt import read_subtitles, write_subtitles, slice_subtitles
+from utils import which, launch_process_with_progress_bar, get_base_file_name, run_command
+
+# List of required executables on a Linux Box used to accomplish
+# smart rendering
+REQUIRED_EXECUTABLES = {
+	'ffmpeg'  : FfmpegParser,
+	'ffprobe' : None
+}
+
+# Profile codec whose GOPs can be joined with the ones of the source, by source codec
+SOURCE_CODECS = {
+	'h264'  : 'x264',
+	'mpeg4' : 'xvid'
+}
+
+# Format of the joined video track, so that the container modules can mux it as
+# if it had been written by their hardsub_video
+JOINED_FORMAT = {
+	'avi'      : 'avi',
+	'matroska' : 'matroska',
+	'mp4'      : 'h264'
+}
+
+verbose = False
+
+debug = False
+
+def probe_gops(file_name):
+	"""
+		Get the codec and the key frames of the video track
+		:param file_name: Video file
+		:type file_name: str
+		:returns: (str, list) -- Codec name and sorted key frame times in seconds
+	"""
+	# Packet flags tell key frames without decoding anything
+	command = '{ffprobe} -v error -select_streams v:0 -show_entries stream=codec_name:packet=pts_time,flags -of csv=p=0 "{input_file}"'.format(
+		ffprobe = which('ffprobe')[0],
+		input_file = file_name
+	)
+	codec = None
+	keyframes = []
+	for line in run_command(command, verbose).splitlines():
+		fields = line.strip().split(',')
+		if len(fields) == 1 and fields[0] != '':
+			codec = fields[0]
+		elif len(fields) >= 2 and 'K' in fields[1] and re.match(r'^-?\d+(\.\d+)?$', fields[0]):
+			keyframes.append(float(fields[0]))
+	return (codec, sorted(set(keyframes)))
+
+def range_encoding(kind, codec, profile=None):
+	"""
+		Get the encoder settings of the ranges that show subtitles: the codec of the
+		source, with the preset, rate control and threads of the profile. When the
+		container is set to another codec, the settings of that codec are taken from
+		another container of the profile, if any.
+		:param kind: Container of the video
+		:type kind: str
+		:param codec: Codec of the source, as named by ffprobe
+		:type codec: str
+		:param profile: Encoding profile, see profiles.get_profile, None for the one in use
+		:type profile: dict
+		:returns: dict -- Settings of the encoder, see profiles.PROFILES
+	"""
+	wanted = SOURCE_CODECS[codec]
+	settings = lambda k: profile[k] if profile is not None else in_use(k, ffmpeg.profile[k])
+	for k in [kind] + sorted([k for k in CONTAINER_CODECS if k != kind]):
+		if settings(k)['codec'] == wanted:
+			return settings(k)
+	# Rate control of another codec does not apply, keep the threads
+	return {'codec': wanted, 'threads': settings(kind).get('threads')}
+
+def plan_ranges(keyframes, subtitles, duration):
+	"""
+		Split a video in ranges of whole GOPs that either show subtitles or not
+		:param keyframes: Sorted key frame times in seconds
+		:type keyframes: list
+		:param subtitles: (start, end, text) for every subtitle
+		:type subtitles: list
+		:param duration: Duration of the video in seconds
+		:type duration: float
+		:returns: list -- (start, end, dirty) for every range, dirty ranges show subtitles
+	"""
+	dirty = [False] * len(keyframes)
+	# Frames before the first key frame cannot be copied, the first GOP is reencoded from the start
+	if keyframes[0] > 0:
+		dirty[0] = True
+	for start, end, text in subtitles:
+		# GOP i spans from keyframes[i] to keyframes[i + 1]
+		first = max(bisect.bisect_right(keyframes, start) - 1, 0)
+		last = max(bisect.bisect_left(keyframes, end) - 1, 0)
+		for i in range(first, min(last, len(keyframes) - 1) + 1):
+			dirty[i] = True
+	ranges = []
+	for i in range(len(keyframes)):
+		end = keyframes[i + 1] if i + 1 < len(keyframes) else duration
+		if len(ranges) > 0 and ranges[-1][2] == dirty[i]:
+			ranges[-1] = (ranges[-1][0], end, dirty[i])
+		else:
+			ranges.append((keyframes[i] if i > 0 else 0.0, end, dirty[i]))
+	return ranges
+
+def smart_render_video(media, output_dir, scale):
+	"""
+		Hardsub a video reencoding only the GOPs that show subtitles.
+		GOPs without subtitles are copied from the source as they are, the
+		others are reencoded with burnt subtitles by the same codec of the
+		source, then every range is joined in the same video track that
+		hardsub_video of the container module would write.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param output_dir: Directory where to place raw hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:returns: boolean -- True if the video has been hardsubbed, False if the source cannot be smart rendered
+	"""
+	file_name = media.file_name
+	codec, keyframes = probe_gops(file_name)
+	if codec not in SOURCE_CODECS or len(keyframes) == 0 or media.duration is None:
+		return False
+	subtitles = read_subtitles(os.path.splitext(file_name)[0] + ".srt")
+	ranges = plan_ranges(keyframes, subtitles, media.duration)
+	fps = media.fps or 25.0
+	# Key frame times are rounded by ffprobe: seek half a frame away from them, so
+	# that copies start on the key frame of their range and not on the previous one,
+	# while reencodes, which drop frames before the seek position, keep it
+	half_frame = 0.5 / fps
+	work_dir = tempfile.mkdtemp(prefix='hs-', dir=output_dir)
+	# The subtitles filter needs heavy escaping for paths with special characters:
+	# keep subtitle slices in a temporary directory with a plain name instead
+	sub_dir = tempfile.mkdtemp(prefix='hs-')
+	try:
+		pieces = []
+		for i, (start, end, dirty) in enumerate(ranges):
+			piece = os.path.join(work_dir, '{:05d}.ts'.format(i))
+			seek = max(start - half_frame, 0.0) if dirty else start + half_frame
+			# Stop half a frame before the key frame that starts the next range
+			length = '-t {:.6f}'.format(end - half_frame - seek) if i + 1 < len(ranges) else ''
+			if dirty:
+				sub_file = os.path.join(sub_dir, '{:05d}.srt'.format(i))
+				# Times of the piece start from the seek position
+				write_subtitles(slice_subtitles(subtitles, seek, end), sub_file)
+				command = '{ffmpeg} -y -nostats -progress pipe:1 -ss {seek:.6f} -i "{input_file}" {length} -map 0:v:0 -vf subtitles={sub_file}:force_style=FontSize={font_size:.1f} {video_opts} -f mpegts "{piece}"'.format(
+					ffmpeg = which('ffmpeg')[0],
+					seek = seek,
+					input_file = file_name,
+					length = length,
+					sub_file = sub_file,
+					font_size = font_size(scale),
+					video_opts = ffmpeg_video_options(range_encoding(media.kind, codec)),
+					piece = piece
+				)
+				message = 'Encoding GOPs {}/{}: '.format(i + 1, len(ranges))
+			else:
+				# Annex B keeps parameter sets in band, so pieces of different encoders can be joined
+				command = '{ffmpeg} -y -nostats -progress pipe:1 -ss {seek:.6f} -i "{input_file}" {length} -map 0:v:0 -c copy{bsf} -f mpegts "{piece}"'.format(
+					ffmpeg = which('ffmpeg')[0],
+					seek = seek,
+					input_file = file_name,
+					length = length,
+					bsf = ' -bsf:v h264_mp4toannexb' if codec == 'h264' else '',
+					piece = piece
+				)
+				message = 'Copying GOPs {}/{}: '.format(i + 1, len(ranges))
+			frames = max(int((end - start) * fps), 1)
+			launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['ffmpeg'], frames, message, verbose, debug)
+			pieces.append(piece)
+		list_file = os.path.join(work_dir, 'pieces.txt')
+		with open(list_file, 'w') as f:
+			for piece in pieces:
+				f.write("file '{}'\n".format(piece.replace("'", "'\\''")))
+		command = '{ffmpeg} -y -nostats -progress pipe:1 -f concat -safe 0 -i "{list_file}" -map 0:v:0 -c copy -f {joined_format} "{output_file}"'.format(
+			ffmpeg = which('ffmpeg')[0],
+			list_file = list_file,
+			joined_format = JOINED_FORMAT[media.kind],
+			output_file = "{}/{}.{}".format(output_dir, get_base_file_name(file_name), get_backend(media.kind).VIDEO_EXTENSION)
+		)
+		launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['ffmpeg'], media.frames or sys.maxint, 'Joining GOPs: ', verbose, debug)
+	finally:
+		shutil.rmtree(work_dir)
+		shutil.rmtree(sub_dir)
+	return True
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: srt
+
+    :synopsis: Module that reads, slices and writes SubRip subtitle files
+"""
+
+import re
+
+TIMING_REG_EXP = re.compile(r'(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)')
+
+def _to_seconds(hours, minutes, seconds, millis):
+	return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, '0')[:3]) / 1000.0
+
+def _to_timestamp(seconds):
+	millis = int(round(seconds * 1000))
+	return "{:02d}:{:02d}:{:02d},{:03d}".format(millis / 3600000, (millis / 60000) % 60, (millis / 1000) % 60, millis % 1000)
+
+def read_subtitles(file_name):
+	"""
+		Read all subtitles from a .srt file
+		:param file_name: .srt file to read
+		:type file_name: str
+		:returns: list -- (start, end, text) for every subtitle, sorted by start time. Times are in seconds
+	"""
+	with open(file_name, 'rb') as f:
+		content = f.read()
+	# Remove UTF-8 BOM and normalize line endings
+	if content.startswith('\xef\xbb\xbf'):
+		content = content[3:]
+	content = content.replace('\r\n', '\n').replace('\r', '\n')
+	subtitles = []
+	for block in re.split(r'\n\s*\n', content):
+		lines = block.strip('\n').split('\n')
+		for i in range(len(lines)):
+			timing = TIMING_REG_EXP.search(lines[i])
+			if timing is not None:
+				start = _to_seconds(*timing.groups()[0:4])
+				end = _to_seconds(*timing.groups()[4:8])
+				subtitles.append((start, end, '\n'.join(lines[i + 1:])))
+				break
+	subtitles.sort(key=lambda s: s[0])
+	return subtitles
+
+def write_subtitles(subtitles, file_name):
+	"""
+		Write subtitles to a .srt file
+		:param subtitles: (start, end, text) for every subtitle. Times are in seconds
+		:type subtitles: list
+		:param file_name: .srt file to write
+		:type file_name: str
+	"""
+	with open(file_name, 'wb') as f:
+		for i, (start, end, text) in enumerate(subtitles):
+			f.write("{}\n{} --> {}\n{}\n\n".format(i + 1, _to_timestamp(start), _to_timestamp(end), text))
+
+def slice_subtitles(subtitles, start, end=None):
+	"""
+		Get the subtitles shown between two instants, with times relative to the first one.
+		Subtitles that cross the boundaries are clipped.
+		:param subtitles: (start, end, text) for every subtitle. Times are in seconds
+		:type subtitles: list
+		:param start: First instant of the slice in seconds
+		:type start: float
+		:param end: Last instant of the slice in seconds, None for the end of the video
+		:type end: float
+		:returns: list -- (start, end, text) for every subtitle in the slice
+	"""
+	sliced = []
+	for s_start, s_end, text in subtitles:
+		if s_end <= start or (end is not None and s_start >= end):
+			continue
+		if end is not None:
+			s_end = min(s_end, end)
+		sliced.append((max(s_start, start) - start, s_end - start, text))
+	return sliced
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: streaming
+
+    :synopsis: Module that pipes the hardsubbed video from the encoder straight into the muxer
+"""
+
+import os
+import re
+import sys
+import threading
+
+import report
+import runner
+from profiles import RAW_VIDEO_FORMATS, in_use
+from progress import FfmpegParser
+from utils import ToolError, which, launch_process_with_progress_bar, get_base_file_name, set_progress_output, get_progress_output
+
+# List of required executables on a Linux Box used to accomplish
+# streaming, on top of the ones of the container module
+REQUIRED_EXECUTABLES = {
+	'ffmpeg' : FfmpegParser
+}
+
+verbose = False
+
+debug = False
+
+def _mux(command, tot_frames, progress_output, context, errors):
+	"""
+		Run the muxer on a separate thread, the encoder is waiting for it on the other end of the FIFO
+	"""
+	set_progress_output(progress_output)
+	report.set_context(context)
+	try:
+		launch_process_with_progress_bar(command, REQUIRED_EXECUTABLES['ffmpeg'], tot_frames, 'Rebuilding file: ', verbose, debug)
+	except Exception:
+		errors.append(sys.exc_info())
+		# The encoder would wait for a reader of the FIFO, or block on a full one, forever: stop it
+		runner.cancel_all()
+
+def stream_video(media, movie_type, output_dir, scale, passthrough=False):
+	"""
+		Hardsub a video and rebuild its container at once: the encoder writes a raw
+		video track on a named pipe and ffmpeg muxes it with the extracted audio tracks
+		while it is being encoded, so the video track never hits the disk.
+		Audio tracks must already be extracted in output_dir, unless they are
+		taken straight from the source file.
+		The muxer progress bar is drawn on the row after the current progress line.
+		:param media: File that had to be reencoded
+		:type media: MediaInfo
+		:param movie_type: Container module of the file
+		:type movie_type: module
+		:param output_dir: Directory where to place hardsubbed video
+		:type output_dir: str
+		:param scale: Subtitle font scale
+		:type a: int
+		:param passthrough: Take audio tracks straight from the source file instead of the extracted ones
+		:type passthrough: bool
+	"""
+	file_name = media.file_name
+	base_file_name = get_base_file_name(file_name)
+	fifo = output_dir + os.sep + base_file_name + '.fifo'
+	if os.path.exists(fifo):
+		os.remove(fifo)
+	os.mkfifo(fifo)
+	# Only pick the files of this job, other jobs may share the output directory
+	audio_files = [] if passthrough else sorted([f for f in os.listdir(output_dir) if re.match(re.escape(base_file_name) + r'_\d+\.(aac|audio)$', f)])
+	input_param = []
+	map_param = ['-map 0:0']
+	for count, f in enumerate(audio_files):
+		input_param.append('-i "' + output_dir + os.sep + f + '"')
+		map_param.append('-map {}:0'.format(count + 1))
+		if media.kind == 'mp4' and f.endswith('.aac'):
+			# Extracted AAC tracks have ADTS headers that MP4 does not allow
+			map_param.append('-bsf:a:{} aac_adtstoasc'.format(count))
+	if passthrough and len(media.audio_tracks) > 0:
+		input_param.append('-i "' + file_name + '"')
+		map_param.append('-map 1:a')
+	command = '{ffmpeg} -y -nostats -progress pipe:1 -fflags +genpts{rate} -f {raw_format} -i "{fifo}" {input_params} -c copy {map_params} "{dest_file}"'.format(
+		ffmpeg = which('ffmpeg')[0],
+		rate = '' if media.fps is None else ' -r {:.3f}'.format(media.fps),
+		raw_format = RAW_VIDEO_FORMATS[in_use(media.kind, movie_type.encoding)['codec']],
+		fifo = fifo,
+		input_params = ' '.join(input_param),
+		map_params = ' '.join(map_param),
+		dest_file = output_dir + os.sep + os.path.basename(file_name)
+	)
+	errors = []
+	mux = threading.Thread(target=_mux, args=(command, media.frames or sys.maxint, get_progress_output().next_row(), report.get_context(), errors))
+	mux.start()
+	try:
+		command = movie_type.mencoder_command(file_name, os.path.splitext(file_name)[0] + ".srt", fifo, scale, True)
+		launch_process_with_progress_bar(command, movie_type.REQUIRED_EXECUTABLES['mencoder'], 100, 'Video Encoding: ', verbose, debug)
+	except BaseException:
+		if len(errors) == 0:
+			# The muxer would wait for a writer of the FIFO forever: stop it
+			runner.cancel_all()
+			raise
+		# The encoder has been killed because the muxer failed, which is the error to report
+	finally:
+		mux.join()
+		# Cleaning some mess
+		os.remove(fifo)
+		for f in audio_files:
+			os.remove(output_dir + os.sep + f)
+	if len(errors) > 0:
+		raise errors[0][0], errors[0][1], errors[0][2]
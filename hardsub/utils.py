@@ -1,12 +1,163 @@
 # -*- coding: utf-8 -*-
 
+import errno
 import os
+import shutil
+import sys
+import threading
 import time
 
-import colorama
-import pexpect
 import progressbar
 
+import progress
+import runner
+from jobcontext import get_job_context
+
+# Per thread destination of progress bars, None means standard error
+_progress = threading.local()
+
+class HardsubError(Exception):
+	"""
+		A job cannot hardsub its file
+	"""
+
+class ToolError(HardsubError):
+	"""
+		A tool failed: it exited with an unexpected status or it gave no sign of life for too long
+		:param command: Command of the tool
+		:type command: str
+		:param message: What went wrong
+		:type message: str
+	"""
+
+	def __init__(self, command, message):
+		HardsubError.__init__(self, message)
+		self.command = command
+
+def _job_verbosity(verbose, debug):
+	"""
+		Add the verbosity of the job running on the current thread to the one requested by the caller
+		:returns: (boolean, boolean) -- verbose and debug
+	"""
+	context = get_job_context()
+	if context is None:
+		return (verbose, debug)
+	return (verbose or context.verbose, debug or context.debug)
+
+class ProgressLine(object):
+	"""
+		File-like object that keeps a progress bar on a row reserved on the terminal,
+		so that several progress bars can be drawn at the same time.
+		:param row: Row reserved for this progress bar, counted from the top of the board
+		:type row: int
+		:param rows: Number of rows reserved for the whole board
+		:type rows: int
+		:param lock: Lock shared by every writer of the board
+		:param prefix: Text written before the progress bar
+		:type prefix: str
+	"""
+
+	def __init__(self, row, rows, lock, prefix='', stream=sys.stderr):
+		self.row = row
+		self.rows = rows
+		self.lock = lock
+		self.prefix = prefix
+		self.stream = stream
+
+	def write(self, data):
+		data = data.strip('\r\n')
+		if len(data) == 0:
+			return
+		with self.lock:
+			if self.stream.isatty():
+				# Save cursor, go up to the reserved row, draw it and restore cursor
+				self.stream.write('\x1b7\x1b[{}A\r{}{}\x1b[K\x1b8'.format(self.rows - self.row, self.prefix, data))
+			else:
+				self.stream.write(self.prefix + data + '\n')
+			self.stream.flush()
+
+	def flush(self):
+		self.stream.flush()
+
+	def next_row(self, offset=1):
+		"""
+			Get a progress line drawn below this one
+			:param offset: How many rows below this one
+			:type offset: int
+			:returns: ProgressLine -- Progress line on the requested row of the board
+		"""
+		return ProgressLine(self.row + offset, self.rows, self.lock, self.prefix, self.stream)
+
+def reserve_progress_board(rows, stream=sys.stderr):
+	"""
+		Reserve rows on the terminal for a board of ProgressLine
+		:param rows: Number of rows to reserve
+		:type rows: int
+	"""
+	if stream.isatty():
+		stream.write('\n' * rows)
+		stream.flush()
+
+def set_progress_output(output):
+	"""
+		Set where the progress bars launched by the current thread are drawn
+		:param output: File-like object for progress bars, None for standard error
+	"""
+	_progress.output = output
+
+def get_progress_output():
+	"""
+		Get where the progress bars launched by the current thread are drawn
+		:returns: File-like object for progress bars
+	"""
+	output = getattr(_progress, 'output', None)
+	if output is None:
+		return sys.stderr
+	return output
+
+def move_file(source, dest):
+	"""
+		Move a file, the destination appears atomically even when it is on another file system
+		:param source: File to move
+		:type source: str
+		:param dest: Destination file
+		:type dest: str
+	"""
+	try:
+		os.rename(source, dest)
+		return
+	except OSError as e:
+		if e.errno != errno.EXDEV:
+			raise
+	# Copy next to the destination, then rename it in place
+	tmp_file = os.path.join(os.path.dirname(dest), '.{}.{}.tmp'.format(os.path.basename(dest), os.getpid()))
+	try:
+		shutil.copyfile(source, tmp_file)
+		os.rename(tmp_file, dest)
+	except:
+		if os.path.exists(tmp_file):
+			os.remove(tmp_file)
+		raise
+	os.remove(source)
+
+def free_space(directory):
+	"""
+		Get the space available to unprivileged users on the file system of a directory
+		:returns: int -- Free bytes
+	"""
+	st = os.statvfs(directory)
+	return st.f_bavail * st.f_frsize
+
+def log(message):
+	"""
+		Print a timestamped line, for modes that keep running such as the watch daemon
+		:param message: Line to print
+		:type message: str
+	"""
+	# A single write, so lines of several processes do not mix
+	sys.stdout.write("{} {}\n".format(time.strftime("%Y-%m-%d %H:%M:%S"), message))
+	sys.stdout.flush()
+
 def get_base_file_name(file_name):
 	return os.path.splitext(os.path.basename(file_name))[0]
 
@@ -46,41 +197,58 @@ def which(name, flags=os.X_OK):
 	                result.append(pext)
 	    return result
 	   
-def launch_process_with_progress_bar(command, progress_reg_exp, progress_scale=100, progress_bar_message="Working", verbose=False, debug=False, accepted_exit_codes=(0,)):
+def run_command(command, verbose=False):
+	"""
+		Launch a process and wait for its end, for at most runner.current_timeout seconds
+		:param command: Command to launch
+		:type command: str
+		:returns: str -- Output of the process
+	"""
+	verbose, debug = _job_verbosity(verbose, False)
+	if verbose:
+		print command
+	return runner.run_tool(command)
+
+def launch_process_with_progress_bar(command, progress_parser, progress_scale=100, progress_bar_message="Working", verbose=False, debug=False, accepted_exit_codes=(0,)):
 	"""
 		Launch a process and show a progress bar with auto calculated ETA.
+		Raises ToolError if the process fails or is stuck.
 		:param command: Command to launch
 		:type command: str
-		:param progress_reg_exp: Regular Expression used to get process update percentage. It is applied on standard output
-		:type progress_reg_exp: str
-		:param progress_scale: Maximum value reached by the number captured in the regexp
+		:param progress_parser: Parser class of the process output, or a regular expression whose first group captures the progress
+		:param progress_scale: Maximum value reached by the progress counter of the process
 		:type progress_scale: integer 
 		:param progress_bar_message: Message shown on progress bar
 		:type progress_bar_message: str
+		:returns: int -- Frames processed by the process, as told by its last progress line, None if it did not tell
 	"""
+	verbose, debug = _job_verbosity(verbose, debug)
 	if verbose:
 		print command
-	thread = pexpect.spawn(command)
+	fout = None
 	if debug:
 		fout = file('/tmp/hs.log', 'a')
 		fout.write(time.ctime() + ': ' + command + "\n")
-		thread.logfile = fout
-	pl = thread.compile_pattern_list([
-		pexpect.EOF,
-		progress_reg_exp
-		])
 	widgets = [progress_bar_message, progressbar.Percentage(), ' ', progressbar.Bar(fill="-"),
                ' ', progressbar.AdaptiveETA(), ' ']
-	pbar = progressbar.ProgressBar(widgets=widgets, maxval=100).start()
-	while True:
-		i = thread.expect_list(pl, timeout=None)
-		if i == 0:  # EOF, Process exited
+	pbar = progressbar.ProgressBar(widgets=widgets, maxval=100, fd=get_progress_output()).start()
+	frames = [None]
+
+	def update_bar(event):
+		if event.done:
+			frames[0] = event.usage['frames']
 			pbar.finish()
-			break
-		if i == 1:  # Status
-			progress = 100 * int(thread.match.group(1)) / progress_scale
-			pbar.update(progress)	
-	thread.close()
-        if thread.exitstatus not in accepted_exit_codes :
-		print (colorama.Fore.RED + "Error in execution of command. " + colorama.Fore.RESET + "Try again with -v switch to see the executed command.")
-		quit()
+		elif event.percent is not None:
+			# Totals may be estimated, never go beyond the end of the bar
+			pbar.update(max(min(int(event.percent), 100), 0))
+
+	try:
+		exit_status = progress.monitor_process(command, progress.make_parser(progress_parser, progress_scale), [update_bar], progress_bar_message, fout)
+	except runner.ToolTimeout as e:
+		raise ToolError(command, str(e))
+	finally:
+		if fout is not None:
+			fout.close()
+	if exit_status not in accepted_exit_codes :
+		raise ToolError(command, "{} exited with status {}".format(command.split()[0], exit_status))
+	return frames[0]
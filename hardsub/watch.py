@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: watch
+
+    :synopsis: Module that hardsubs videos as soon as they are dropped on a directory, together with their srt file
+"""
+
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import colorama
+
+import hardsub
+import loadcontrol
+import runner
+import scanner
+from inotify import Inotify, IN_CLOSE_WRITE, IN_CREATE, IN_ISDIR, IN_MODIFY, IN_MOVED_TO, IN_Q_OVERFLOW
+from mediainfo import ProbeCache, probe
+from outputcache import parse_size
+from report import JobReport, set_job_report
+from utils import ProgressLine, log, set_progress_output
+from workqueue import QUEUE_FILE, WorkQueue
+
+# Seconds a video and its srt file must stay untouched before they are queued
+SETTLE_TIME = 5
+
+# Seconds between two checks of the files waiting to settle
+POLL_INTERVAL = 1
+
+# Events that tell a file is being written or has been moved on the directory
+WATCH_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_MODIFY | IN_MOVED_TO
+
+class DropFolder(object):
+	"""
+		Directory watched with inotify. Files are ready once neither an
+		event nor their size and modification time show a change for the
+		settle time, which also covers writers whose events are not seen.
+		:param directory: Directory to watch
+		:type directory: str
+		:param recursive: True to watch subdirectories too
+		:type recursive: bool
+		:param settle: Seconds a file must stay untouched
+		:type settle: float
+		:param languages: True to pair videos with language tagged srt files too
+		:type languages: bool
+	"""
+
+	def __init__(self, directory, recursive=False, settle=SETTLE_TIME, languages=False):
+		self.directory = directory
+		self.recursive = recursive
+		self.settle = settle
+		self.languages = languages
+		self.inotify = Inotify()
+		# Stem of each changed file: time of its last change and stamp of its files at the last check
+		self.pending = {}
+		self.watch(directory)
+
+	def watch(self, directory):
+		"""
+			Watch a directory, its subdirectories when recursive, and take the files already there
+			:param directory: Directory to watch
+			:type directory: str
+		"""
+		for root, dir_names, file_names in scanner.walk(directory):
+			self.inotify.add_watch(root, WATCH_MASK)
+			for file_name in scanner.pair_files(root, file_names, self.languages):
+				self.changed(file_name)
+			if not self.recursive:
+				break
+			dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+
+	def changed(self, path):
+		"""
+			Record that a file has changed, restarting the settle time of its stem
+			:param path: Changed file
+			:type path: str
+		"""
+		# A language tagged srt file may belong to <stem>.<tag> or to <stem>
+		for stem in scanner.subtitle_stems(path, self.languages) or [os.path.splitext(path)[0]]:
+			entry = self.pending.get(stem)
+			if entry is None:
+				self.pending[stem] = [time.time(), None]
+			else:
+				entry[0] = time.time()
+
+	def poll(self, timeout=POLL_INTERVAL):
+		"""
+			Wait for inotify events and record them
+			:param timeout: Seconds to wait
+			:type timeout: float
+		"""
+		for path, mask, cookie in self.inotify.read_events(timeout):
+			if mask & IN_Q_OVERFLOW:
+				# Events have been lost, take every paired file again
+				for file_name in scanner.scan(self.directory, self.recursive, self.languages):
+					self.changed(file_name)
+			elif os.path.basename(path).startswith('.'):
+				# Hidden files are usually partial uploads, renamed when complete
+				continue
+			elif mask & IN_ISDIR:
+				if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+					self.watch(path)
+			else:
+				self.changed(path)
+
+	def ready(self):
+		"""
+			Get the videos that have settled together with their srt file
+			:returns: list -- (file name, stamp) of each settled video, stamp holds size and modification time of the video and of its srt files
+		"""
+		now = time.time()
+		ready = []
+		for stem, entry in self.pending.items():
+			if now - entry[0] < self.settle:
+				continue
+			directory, base = os.path.split(stem)
+			try:
+				sub_files = [f for tag, f in scanner.subtitle_files(stem, self.languages)]
+				if len(sub_files) == 0:
+					# The other file of the pair will restart the settle time when it arrives
+					del self.pending[stem]
+					continue
+				names = [f for f in os.listdir(directory) if os.path.splitext(f)[0] == base] + [os.path.basename(f) for f in sub_files]
+				videos = scanner.pair_files(directory, sorted(set(names)), self.languages)
+				stamp = [(os.stat(f).st_size, os.stat(f).st_mtime) for f in videos + sub_files]
+			except OSError:
+				del self.pending[stem]
+				continue
+			if len(videos) == 0:
+				del self.pending[stem]
+			elif stamp != entry[1]:
+				# Changed since the last check, wait for another settle time
+				entry[0] = now
+				entry[1] = stamp
+			else:
+				del self.pending[stem]
+				ready.extend([(f, [stamp[i]] + stamp[len(videos):]) for i, f in enumerate(videos)])
+		return ready
+
+	def close(self):
+		self.inotify.close()
+
+def _watch_worker(work_queue, wakeup, stopping, output_dir, scale, options):
+	"""
+		Hardsub files taken from the queue until told to stop, one wake up token for each queued file
+	"""
+	# Signals are handled by the daemon, which lets running jobs finish
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+	set_progress_output(ProgressLine(0, hardsub.rows_per_job(options.get('segments', 1)), threading.Lock(), stream=open(os.devnull, 'w')))
+	while wakeup.get() is not None and not stopping.is_set():
+		file_name = work_queue.take()
+		if file_name is None:
+			continue
+		log("Start work on " + colorama.Style.BRIGHT + "{}".format(os.path.basename(file_name)) + colorama.Style.NORMAL)
+		job_report = JobReport(file_name)
+		set_job_report(job_report)
+		try:
+			media = probe(file_name)
+			done = media.kind is not None and hardsub.hardsub_file(media, output_dir, scale, **options)
+		except Exception:
+			traceback.print_exc()
+			done = False
+		job_report.finish()
+		if not done and stopping.is_set():
+			# Interrupted by the shutdown, the next daemon takes the file again
+			continue
+		work_queue.finish(file_name, done)
+		if done:
+			outcome = colorama.Fore.GREEN + "done" + colorama.Fore.RESET
+		else:
+			outcome = colorama.Fore.RED + "failed" + colorama.Fore.RESET
+		log("{} {} in {}".format(os.path.basename(file_name), outcome, time.strftime("%H:%M:%S", time.gmtime(job_report.wall))))
+
+def build_watch_parser():
+	"""
+		Build an ArgumentParser instance suitable for the watch mode
+		:returns: ArgumentParser -- ArgumentParser for the watch mode
+	"""
+	ap = hardsub.build_argument_parser()
+	ap.prog = "hs watch"
+	ap.description = "Hardsub videos as soon as they are dropped on a directory with their srt file"
+	ap.add_argument("--settle", default=SETTLE_TIME, type=float, help="seconds a video and its srt file must stay untouched before being queued", metavar="<seconds>")
+	ap.add_argument("--queue-file", help="file where queued videos are kept, by default .hs-queue.json on the output directory", metavar="<queue_file>")
+	return ap
+
+def watch_main(argv):
+	"""
+		Watch a directory and hardsub the videos dropped on it
+		:param argv: Parameters of the watch mode
+		:type argv: list
+	"""
+	ap = build_watch_parser()
+	arguments = ap.parse_args(argv)
+	parameter_checks, param_errors = hardsub.check_arguments(vars(arguments))
+	if arguments.preview:
+		parameter_checks = False
+		param_errors.append(colorama.Style.BRIGHT + "preview" + colorama.Style.NORMAL + " can only be used on a batch")
+	if arguments.settle < 0:
+		parameter_checks = False
+		param_errors.append(colorama.Style.BRIGHT + "settle" + colorama.Style.NORMAL + " cannot be negative")
+	if not parameter_checks:
+		print ("Some parameters are inconsistent:")
+		for pe in param_errors:
+			print ("\t- {}".format(pe))
+		sys.exit(3)
+	runner.tool_timeout = arguments.tool_timeout or None
+	file_options = hardsub.build_file_options(arguments)
+	work_queue = WorkQueue(arguments.queue_file or os.path.join(arguments.output, QUEUE_FILE))
+	cache = None if arguments.no_probe_cache else ProbeCache(arguments.probe_cache)
+	wakeup = multiprocessing.Queue()
+	stopping = multiprocessing.Event()
+	if arguments.adaptive:
+		loadcontrol.controller = loadcontrol.LoadController(parse_size(arguments.min_free_memory))
+	for i in range(work_queue.recover()):
+		wakeup.put(True)
+	workers = [multiprocessing.Process(target=_watch_worker, args=(work_queue, wakeup, stopping, arguments.output, arguments.subtitle_scale, file_options))
+		for i in range(arguments.jobs)]
+	for worker in workers:
+		worker.start()
+	signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+	log("Watching " + colorama.Style.BRIGHT + "{}".format(arguments.source_dir) + colorama.Style.NORMAL + " with {} worker(s)".format(arguments.jobs))
+	folder = None
+	try:
+		folder = DropFolder(arguments.source_dir, arguments.recursive, arguments.settle, arguments.languages)
+		while not stopping.is_set():
+			folder.poll()
+			ready = folder.ready()
+			for file_name, stamp in ready:
+				media = probe(file_name, cache)
+				if media.kind is None or not media.has_video:
+					continue
+				executables_found, missing_executables = hardsub.check_prerequisites(media, arguments.stream, arguments.engine, arguments.smart_render)
+				if not executables_found:
+					log(colorama.Fore.RED + "{} skipped, missing {}".format(os.path.basename(file_name), ', '.join(missing_executables)) + colorama.Fore.RESET)
+				elif work_queue.put(file_name, stamp):
+					log("Queued {}".format(os.path.basename(file_name)))
+					wakeup.put(True)
+			if len(ready) > 0 and cache is not None:
+				cache.save()
+	finally:
+		stopping.set()
+		log("Stopping, waiting for running jobs")
+		for worker in workers:
+			wakeup.put(None)
+		for worker in workers:
+			worker.join()
+		if folder is not None:
+			folder.close()
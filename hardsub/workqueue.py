@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule: workqueue
+
+    :synopsis: Module that keeps the files waiting to be hardsubbed on disk, so that a watch daemon can be restarted without losing them
+"""
+
+import fcntl
+import json
+import os
+import time
+
+# Name of the queue inside the output directory
+QUEUE_FILE = '.hs-queue.json'
+
+# States of a queued file
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class WorkQueue(object):
+	"""
+		Queue of files to hardsub, stored as JSON. Every update is done
+		under an exclusive lock, so several processes can take files from it.
+		:param queue_file: File where the queue is stored
+		:type queue_file: str
+	"""
+
+	def __init__(self, queue_file):
+		self.queue_file = queue_file
+
+	def _load(self):
+		try:
+			with open(self.queue_file) as f:
+				return json.load(f)
+		except (IOError, OSError, ValueError):
+			return {}
+
+	def _update(self, change):
+		"""
+			Apply a change to the queue under the lock
+			:param change: Function that changes the entries in place and returns a result
+			:returns: Result of change
+		"""
+		with open(self.queue_file + '.lock', 'a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				entries = self._load()
+				result = change(entries)
+				# Write on a temporary file and rename it, a crash never leaves half a queue
+				tmp_file = "{}.{}.tmp".format(self.queue_file, os.getpid())
+				with open(tmp_file, 'w') as f:
+					json.dump(entries, f, indent=1)
+				os.rename(tmp_file, self.queue_file)
+				return result
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def put(self, file_name, stamp):
+		"""
+			Queue a file, unless it is already queued or it has been hardsubbed as it is now
+			:param file_name: File to hardsub
+			:type file_name: str
+			:param stamp: Size and modification time of the file and of its subtitles
+			:type stamp: list
+			:returns: boolean -- True if the file has been queued
+		"""
+		# Stored as JSON, where tuples become lists
+		stamp = json.loads(json.dumps(stamp))
+
+		def change(entries):
+			entry = entries.get(file_name)
+			if entry is not None:
+				if entry['state'] in (PENDING, RUNNING):
+					return False
+				if entry['state'] == DONE and entry['stamp'] == stamp:
+					return False
+			entries[file_name] = {'state': PENDING, 'queued': time.time(), 'stamp': stamp}
+			return True
+
+		return self._update(change)
+
+	def take(self):
+		"""
+			Take the file queued first and mark it as running
+			:returns: str -- File to hardsub, None if nothing is pending
+		"""
+
+		def change(entries):
+			pending = [(e['queued'], f) for f, e in entries.items() if e['state'] == PENDING]
+			if len(pending) == 0:
+				return None
+			file_name = min(pending)[1]
+			entries[file_name]['state'] = RUNNING
+			entries[file_name]['pid'] = os.getpid()
+			return file_name
+
+		return self._update(change)
+
+	def finish(self, file_name, done):
+		"""
+			Record the outcome of a file taken from the queue
+			:param file_name: File taken from the queue
+			:type file_name: str
+			:param done: True if it has been hardsubbed
+			:type done: bool
+		"""
+
+		def change(entries):
+			entry = entries.get(file_name)
+			if entry is not None:
+				entry['state'] = DONE if done else FAILED
+				entry.pop('pid', None)
+
+		self._update(change)
+
+	def recover(self):
+		"""
+			Put back files left running by a previous daemon, to be called before any worker starts
+			:returns: int -- Number of pending files
+		"""
+
+		def change(entries):
+			for entry in entries.values():
+				if entry['state'] == RUNNING:
+					entry['state'] = PENDING
+					entry.pop('pid', None)
+			return len([e for e in entries.values() if e['state'] == PENDING])
+
+		return self._update(change)